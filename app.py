@@ -1,18 +1,46 @@
-from flask import Flask, request, jsonify
-from helpers import validate_form_fields
-import sqlite3
+from flask import Flask, Response, request, jsonify, stream_with_context
+from helpers import pagination_args, keyset_query, page_rows, stream_format, ndjson_stream, json_array_stream, batch_lines, in_clause, make_etag, not_modified, with_etag
+from database import db_connection, get_pool, get_writer, init_db, allocate_invoice_number, bump_table_version, insert_unique, table_version
+from reference_cache import get_reference_cache, init_reference_cache
+from stock_ledger import record_stock_movement, stock_as_of, stock_series, average_cost
+from bulk_import import IMPORTERS, iter_records, text_stream, write_rows
+from reports import VALUATION_COLUMNS, inventory_valuation
+from metrics import get_metrics, init_metrics
+from serialization import list_response
+from slow_queries import init_slow_query_log
+from idempotency import MAX_FINGERPRINT_BODY, get_idempotency_store, init_idempotency
+from compression import init_compression
+from validation import MIN_YEAR, MAX_YEAR, request_data, validation_error, PARTNER_SCHEMA, ITEM_SCHEMA, VAT_RATE_SCHEMA, UNIT_OF_MEASURE_SCHEMA, BILL_SCHEMA, BILL_RECORD_SCHEMA, INVOICE_SCHEMA, INVOICE_RECORD_SCHEMA, INVOICE_RECORD_LINE_SCHEMA, INVOICE_RECORD_BATCH_SCHEMA
+from datetime import date
+import io
+import os
 
 app = Flask(__name__)
-
-def db_connection():
-    """Connect application to database"""
-    
-    conn = None
-    try:
-        conn = sqlite3.connect("database.sqlite3")
-    except sqlite3.error as e:
-        print(e)
-    return conn
+app.config["DATABASE"] = os.environ.get("DATABASE", "database.sqlite3")
+# Reads run in parallel on the pooled connections, so by default there is at least one connection per CPU core
+app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", max(5, os.cpu_count() or 1)))
+app.config["DB_GROUP_COMMIT_SIZE"] = int(os.environ.get("DB_GROUP_COMMIT_SIZE", 64))
+app.config["DB_WRITER_TIMEOUT"] = float(os.environ.get("DB_WRITER_TIMEOUT", 60))
+app.config["DB_JOURNAL_MODE"] = os.environ.get("DB_JOURNAL_MODE", "wal")
+app.config["INVOICE_NUMBERING"] = os.environ.get("INVOICE_NUMBERING", "continuous")
+app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+if os.environ.get("SLOW_QUERY_MS"):
+    app.config["SLOW_QUERY_THRESHOLD"] = float(os.environ["SLOW_QUERY_MS"]) / 1000
+app.config["SLOW_QUERY_LOG"] = os.environ.get("SLOW_QUERY_LOG", "slow_queries.log")
+app.config["IDEMPOTENCY_TTL"] = int(os.environ.get("IDEMPOTENCY_TTL", 86400))
+app.config["COMPRESSION_ENABLED"] = os.environ.get("COMPRESSION_ENABLED", "1") == "1"
+app.config["COMPRESSION_MIN_SIZE"] = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+app.config["COMPRESSION_LEVEL"] = int(os.environ.get("COMPRESSION_LEVEL", 6))
+init_db(app)
+init_reference_cache(app)
+# The compression hook is registered first, so that it runs after all other after_request hooks
+init_compression(app)
+init_metrics(app)
+init_slow_query_log(app)
+init_idempotency(app)
+
+# Maximum number of days of a daily stock series
+MAX_STOCK_SERIES_DAYS = 3660
 
 
 @app.route("/")
@@ -22,6 +50,32 @@ def index():
     return jsonify({"application name": "Inventory Management System"})
 
 
+@app.route("/pool_stats")
+def pool_stats():
+    """Display the connection pool counters (hits, misses, waits, open connections) and the single writer counters"""
+
+    return jsonify({"success": True, "pool": get_pool().stats(), "writer": get_writer().stats()})
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    """Display the reference data cache counters (hits, misses) and the versions of the cached tables,
+    and the counters of the stored idempotent responses"""
+
+    return jsonify({"success": True, "reference_cache": get_reference_cache().stats(), "idempotency": get_idempotency_store().stats()})
+
+
+@app.route("/metrics")
+def metrics():
+    """Display the request, SQL and serialization metrics of every route, the pool and the cache counters
+    in the Prometheus text format"""
+
+    if get_metrics() is None:
+        return jsonify({"success": False, "message": "Metrics are disabled"})
+
+    return Response(get_metrics().render(get_pool().stats(), get_reference_cache().stats(), get_writer().stats()), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/partners", methods=["GET", "POST"])
 def partners():
     """Display list of all partners (if endpoint is accessed using a "GET" request),
@@ -33,52 +87,51 @@ def partners():
 
     # If endpoint is accessed using a "GET" request, fetch all patners from database and add them to a list that gets returned
     if request.method == "GET":
-        partners = []
-        data = db.execute("SELECT * FROM partners").fetchall()
+        # If the partners have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "partners")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        # Read the pagination parameters. Without them, the whole list is returned
+        try:
+            limit, after = pagination_args(request.args, 1)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+
+        # The columns are named like the keys of the response (the rows are encoded with the column names)
+        select = "SELECT partner_id AS id, partner_name, partner_address, partner_manager_first_name, partner_manager_last_name FROM partners"
+        query, params = keyset_query(select, ["partner_id"], limit, after)
+        data = db.execute(query, params).fetchall()
         
         # If there are no partners in database, return False
-        if data is None or len(data) == 0:
+        if (data is None or len(data) == 0) and after is None:
             return(jsonify({"success": False, "message": "There are no partners in database"}))
 
-        # Each partner is a dictionary that gets added to the list
-        for row in data:
-            partner = {}
-            partner["id"] = row[0]
-            partner["partner_name"] = row[1]
-            partner["partner_address"] = row[2]
-            partner["partner_manager_first_name"] = row[3]
-            partner["partner_manager_last_name"] = row[4]
+        data, next_cursor = page_rows(data, limit, [0])
 
-            partners.append(partner)
-        
-        return jsonify({"success": True, "partners": partners})
+        # Each partner is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
+
+        return with_etag(list_response(response, "partners", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new partner into the database
     if request.method == "POST":
-        # Check if all necessary keys are in the request form
-        form_fields = ["partner_name", "partner_address", "partner_manager_first_name", "partner_manager_last_name"]
-        valid_form_data = validate_form_fields(form_fields, request.form)
-        if valid_form_data == True:
-            pass
-        else:
-            return jsonify({"success": False, "message": f"form-data must contain {valid_form_data[1]}"})
-
-        partner_name = request.form["partner_name"]
-        partner_address = request.form["partner_address"]
-        partner_manager_first_name = request.form["partner_manager_first_name"]
-        partner_manager_last_name = request.form["partner_manager_last_name"]
-
-        # If a required input is not provided, return False
-        if not partner_name or not partner_address:
-            return jsonify({"success": False, "message": "'partner_name' and 'partner_address' are required fields"})
-
-        # Check if partner already exists, If not, insert the new partner in the database
-        data = db.execute("SELECT * FROM partners WHERE partner_name = :partner_name", {
-            "partner_name": partner_name
-        }).fetchone()
-
-        if data is None or len(data) == 0:        
-            db.execute(""" INSERT INTO partners (
+        # Validate the form-data (or JSON body) against the schema of a partner
+        values, errors = PARTNER_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        partner_name = values["partner_name"]
+        partner_address = values["partner_address"]
+        partner_manager_first_name = values["partner_manager_first_name"]
+        partner_manager_last_name = values["partner_manager_last_name"]
+
+        # The insert runs as one work unit of the single writer
+        def add_partner(db):
+            # Insert the new partner, unless a partner with the same name already exists (UNIQUE constraint)
+            inserted = insert_unique(db, "partners", """ INSERT INTO partners (
                 partner_name,
                 partner_address,
                 partner_manager_first_name,
@@ -88,17 +141,19 @@ def partners():
                     :partner_address,
                     :partner_manager_first_name,
                     :partner_manager_last_name
-                    ) """, {
+                    ) ON CONFLICT DO NOTHING """, {
                         "partner_name": partner_name,
                         "partner_address": partner_address,
                         "partner_manager_first_name": partner_manager_first_name,
                         "partner_manager_last_name": partner_manager_last_name
                     })
-            conn.commit()
 
-            return jsonify({"success": True, "message": f"{partner_name} successfully added in database"})
-        else:
-            return jsonify({"success": False, "message": f"{partner_name} already exists in database"})
+            if inserted:
+                return {"success": True, "message": f"{partner_name} successfully added in database"}
+            else:
+                return {"success": False, "message": f"{partner_name} already exists in database"}
+
+        return jsonify(get_writer().run(add_partner))
 
 
 @app.route("/partner/<int:partner_id>", methods=["GET", "PUT", "DELETE"])
@@ -111,6 +166,12 @@ def partner(partner_id):
     conn = db_connection()
     db = conn.cursor()
 
+    if request.method == "GET":
+        # If the partners have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "partners")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
     # Check the database for the partner with the provided id. If there is no such partner, return False
     data = db.execute("SELECT * FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
     
@@ -128,57 +189,61 @@ def partner(partner_id):
         partner["partner_manager_first_name"] = data[3]
         partner["partner_manager_last_name"] = data[4]
 
-        return(jsonify({"success": True, "partner": partner}))
+        return with_etag(jsonify({"success": True, "partner": partner}), etag)
 
     # If endpoint is accessed using a "PUT" request, update the information about the partner
     if request.method == "PUT":
-        # Check if all necessary keys are in the request form
-        form_fields = ["partner_name", "partner_address", "partner_manager_first_name", "partner_manager_last_name"]
-        valid_form_data = validate_form_fields(form_fields, request.form)
-        if valid_form_data == True:
-            pass
-        else:
-            return jsonify({"success": False, "message": f"form-data must contain {valid_form_data[1]}"})
-
-        partner_name = request.form["partner_name"]
-        partner_address = request.form["partner_address"]
-        partner_manager_first_name = request.form["partner_manager_first_name"]
-        partner_manager_last_name = request.form["partner_manager_last_name"]
-
-        # Check if all necessary data is provided
-        if not partner_name or not partner_address:
-            return jsonify({"success": False, "message": "'partner_name' and 'partner_address' are required fields"})
-
-        db.execute(""" UPDATE partners SET
-        partner_name = :partner_name,
-        partner_address = :partner_address,
-        partner_manager_first_name = :partner_manager_first_name,
-        partner_manager_last_name = :partner_manager_last_name
-        WHERE
-        partner_id = :partner_id""", {
-            "partner_name": partner_name,
-            "partner_address": partner_address,
-            "partner_manager_first_name": partner_manager_first_name,
-            "partner_manager_last_name": partner_manager_last_name,
-            "partner_id": partner_id
-        })
+        # Validate the form-data (or JSON body) against the schema of a partner
+        values, errors = PARTNER_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        partner_name = values["partner_name"]
+        partner_address = values["partner_address"]
+        partner_manager_first_name = values["partner_manager_first_name"]
+        partner_manager_last_name = values["partner_manager_last_name"]
+
+        # The changes run as one work unit of the single writer (see database.Writer)
+        def update_partner(db):
+            # "OR IGNORE" skips the update if another partner already has the new name (UNIQUE constraint)
+            db.execute(""" UPDATE OR IGNORE partners SET
+            partner_name = :partner_name,
+            partner_address = :partner_address,
+            partner_manager_first_name = :partner_manager_first_name,
+            partner_manager_last_name = :partner_manager_last_name
+            WHERE
+            partner_id = :partner_id""", {
+                "partner_name": partner_name,
+                "partner_address": partner_address,
+                "partner_manager_first_name": partner_manager_first_name,
+                "partner_manager_last_name": partner_manager_last_name,
+                "partner_id": partner_id
+            })
+            if db.rowcount == 0:
+                return {"success": False, "message": f"{partner_name} already exists in database"}
+
+            bump_table_version(db, "partners")
 
-        conn.commit()
+            return {"success": True, "message": f"Information about {partner_name} successfully updated"}
 
-        return jsonify({"success": True, "message": f"Information about {partner_name} successfully updated"})
+        return jsonify(get_writer().run(update_partner))
 
     if request.method == "DELETE":
-        # Check if there are any bills from the partner or any invoices issued to the partner. If True, DO NOT delete the partner
-        bills = db.execute("SELECT * FROM bills WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
-        invoices = db.execute("SELECT * FROM invoices WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
+        # The check and the delete run as one work unit of the single writer, so no bill or invoice of the partner can be added in between
+        def delete_partner(db):
+            # Check if there are any bills from the partner or any invoices issued to the partner. If True, DO NOT delete the partner
+            bills = db.execute("SELECT * FROM bills WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
+            invoices = db.execute("SELECT * FROM invoices WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
 
-        if bills is not None or invoices is not None:
-            return jsonify({"success": False, "message": "Cannot delete partner. There are bills/invoices from/to this partner"})
+            if bills is not None or invoices is not None:
+                return {"success": False, "message": "Cannot delete partner. There are bills/invoices from/to this partner"}
 
-        db.execute("DELETE FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id})
-        conn.commit()
+            db.execute("DELETE FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id})
+            bump_table_version(db, "partners")
         
-        return jsonify({"success": True, "message": f"{partner_name} successfully deleted from database"})
+            return {"success": True, "message": f"{partner_name} successfully deleted from database"}
+
+        return jsonify(get_writer().run(delete_partner))
 
 
 @app.route("/items", methods=["GET", "POST"])
@@ -192,69 +257,58 @@ def items():
 
     # If endpoint is accessed using a "GET" request, fetch all items from database and add them to a list that gets returned
     if request.method == "GET":
-        data = db.execute("SELECT * FROM items").fetchall()
+        # If the items have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "items")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        # Read the pagination parameters. Without them, the whole list is returned
+        try:
+            limit, after = pagination_args(request.args, 1)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+
+        # The columns are named like the keys of the response (the rows are encoded with the column names)
+        select = """SELECT item_id, item_code, item_description, unit_id, vat_rate_id, item_quantity,
+            latest_purchase_price, average_purchase_price, latest_net_selling_price AS latest_selling_price FROM items"""
+        query, params = keyset_query(select, ["item_id"], limit, after)
+        data = db.execute(query, params).fetchall()
         
         # if there are no items in database, return False
-        if data is None or len(data) == 0:
+        if (data is None or len(data) == 0) and after is None:
             return jsonify({"success": False, "message": "There are no items in database"})
-        
-        items = []
-
-        # Each item is a dictionary that gets added to the list
-        for row in data:
-            item = {}
-            item["item_id"] = row[0]
-            item["item_code"] = row[1]
-            item["item_description"] = row[2]
-            item["unit_id"] = row[3]
-            item["vat_rate_id"] = row[4]
-            item["item_quantity"] = row[5]
-            item["latest_purchase_price"] = row[6]
-            item["average_purchase_price"] = row[7]
-            item["latest_selling_price"] = row[8]
-
-            items.append(item)
-        
-        return jsonify({"success": True, "items": items})
 
-    if request.method == "POST":
-        # Check if the request form contains all necessary keys
-        form_fields = ["item_code", "item_description", "unit_id", "vat_rate_id"]
-        valid_form_data = validate_form_fields(form_fields, request.form)
-        if valid_form_data:
-            pass
-        else:
-            return jsonify({"success": False, "message": f"{valid_form_data[1]}"})
-
-        item_code = request.form["item_code"]
-        item_description = request.form["item_description"]
-        try:
-            unit_id = int(request.form["unit_id"])
-        except:
-            return jsonify({"success": False, "message": "'unit_id' must be integer"})
-
-        try:
-            vat_rate_id = int(request.form["vat_rate_id"])
-        except:
-            return jsonify({"success": False, "message": "'vat_rate_id' must be integer"})
-
-        # If a required input is not provided, return False
-        if not item_code or not item_description or not unit_id or not vat_rate_id:
-            return jsonify({"success": False, "message": "You must provide all reqiured data"})
-
-        check_unit_id = db.execute("SELECT * FROM units_of_measure WHERE unit_id = :unit_id", {"unit_id": unit_id}).fetchone()
-        if check_unit_id is None or len(check_unit_id) == 0:
-            return jsonify({"success": False, "message": f"{unit_id} is not valid (not in database)"})
+        data, next_cursor = page_rows(data, limit, [0])
 
-        check_vat_rate_id = db.execute("SELECT * FROM vat_rates WHERE vat_rate_id = :vat_rate_id", {"vat_rate_id": vat_rate_id}).fetchone()
-        if check_vat_rate_id is None or len(check_vat_rate_id) == 0:
-            return jsonify({"success": False, "message": f"{vat_rate_id} is not valid (not in database)"})
+        # Each item is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
 
-        check_item_code = db.execute("SELECT * FROM items WHERE item_code = :item_code", {"item_code": item_code}).fetchone()
-        check_item_description = db.execute("SELECT * FROM items WHERE item_description = :item_description", {"item_description": item_description}).fetchone()
+        return with_etag(list_response(response, "items", db, data), etag)
 
-        if (check_item_code is None or len(check_item_code) == 0) and (check_item_description is None or len(check_item_description) == 0):
-            db.execute("""INSERT INTO items (
+    if request.method == "POST":
+        # Validate the form-data (or JSON body) against the schema of an item
+        values, errors = ITEM_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        item_code = values["item_code"]
+        item_description = values["item_description"]
+        unit_id = values["unit_id"]
+        vat_rate_id = values["vat_rate_id"]
+
+        # The checks and the insert run as one work unit of the single writer
+        def add_item(db):
+            # The units of measure and VAT rates are checked in the reference data cache
+            if unit_id not in get_reference_cache().units_of_measure(db):
+                return {"success": False, "message": f"{unit_id} is not valid (not in database)"}
+
+            if get_reference_cache().vat_rate(db, vat_rate_id) is None:
+                return {"success": False, "message": f"{vat_rate_id} is not valid (not in database)"}
+
+            # Insert the new item, unless an item with the same code or description already exists (UNIQUE constraints)
+            inserted = insert_unique(db, "items", """INSERT INTO items (
                 item_code,
                 item_description,
                 unit_id,
@@ -264,17 +318,63 @@ def items():
                     :item_description,
                     :unit_id,
                     :vat_rate_id
-                    )""", {
+                    ) ON CONFLICT DO NOTHING""", {
                         "item_code": item_code,
                         "item_description": item_description,
                         "unit_id": unit_id,
                         "vat_rate_id": vat_rate_id
                     })
-            conn.commit()
 
-            return jsonify({"success": True, "message": f"{item_description} successfully added to database"})
+            if inserted:
+                return {"success": True, "message": f"{item_description} successfully added to database"}
+            else:
+                return {"success": False, "message": f"Item with code {item_code} or item with description {item_description} already exists in database"}
+
+        return jsonify(get_writer().run(add_item))
+
+
+@app.route("/<any(partners, items):table>/import", methods=["POST"])
+def import_rows(table):
+    """Import many partners or items from a CSV or NDJSON file.
+    The file is either uploaded as the "file" key of the form-data, or sent as the request body"""
+
+    # Connect to database
+    conn = db_connection()
+
+    upload = request.files.get("file")
+    if upload is not None:
+        stream = upload.stream
+        filename = upload.filename or ""
+    else:
+        # A body of up to MAX_FINGERPRINT_BODY bytes may already have been read (for the fingerprint of an idempotency key),
+        # so it is read from its cached copy. Larger bodies are never read before, and are streamed
+        if request.content_length is not None and request.content_length <= MAX_FINGERPRINT_BODY:
+            stream = io.BytesIO(request.get_data(cache=True))
+        else:
+            stream = request.stream
+        filename = ""
+
+    # The format is taken from the "format" parameter, the content type or the file extension
+    file_format = request.args.get("format")
+    if file_format is None:
+        content_type = upload.mimetype if upload is not None else request.mimetype
+        if content_type in ("application/x-ndjson", "application/jsonl") or filename.endswith((".ndjson", ".jsonl")):
+            file_format = "ndjson"
         else:
-            return jsonify({"success": False, "message": f"Item with code {item_code} or item with description {item_description} already exists in database"})
+            file_format = "csv"
+
+    if file_format not in ("csv", "ndjson"):
+        return jsonify({"success": False, "message": "'format' must be 'csv' or 'ndjson'"})
+
+    # The rows are read, validated and inserted in chunks while the file is being read.
+    # Every chunk is inserted by the single writer, as one work unit
+    def write_chunk(table_name, query, chunk):
+        return get_writer().run(write_rows, table_name, query, chunk)
+
+    records = iter_records(text_stream(stream), file_format)
+    report = IMPORTERS[table](conn, records, write_chunk=write_chunk)
+
+    return jsonify({"success": True, "message": f"{report.imported} {table} imported, {report.rejected} rejected", **report.to_dict()})
 
 
 @app.route("/item/<int:item_id>", methods=["GET", "DELETE"])
@@ -286,6 +386,12 @@ def item(item_id):
     conn = db_connection()
     db = conn.cursor()
 
+    if request.method == "GET":
+        # If the items have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "items")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
     # Check if item is in database
     data = db.execute("SELECT * FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
     if data is None or len(data) == 0:
@@ -303,20 +409,71 @@ def item(item_id):
         item["average_purchase_price"] = data[7]
         item["latest_selling_price"] = data[8]
 
-        return jsonify({"success": True, "item": item})
+        return with_etag(jsonify({"success": True, "item": item}), etag)
 
     if request.method == "DELETE":
-        # Check if there are any bill records or invoice records with the item. If true, DO NOT delete the item.
-        bill_records = db.execute("SELECT * FROM bill_records WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
-        invoice_records = db.execute("SELECT * FROM invoice_records WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
-
-        if bill_records is not None or invoice_records is not None:
-            return jsonify({"success": False, "message": "Cannot delete item from database. There are bill records and/or invoice records with this item."})
+        # The check and the delete run as one work unit of the single writer, so no record of the item can be added in between
+        def delete_item(db):
+            # Check if there are any bill records or invoice records with the item. If true, DO NOT delete the item.
+            bill_records = db.execute("SELECT * FROM bill_records WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
+            invoice_records = db.execute("SELECT * FROM invoice_records WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
+
+            if bill_records is not None or invoice_records is not None:
+                return {"success": False, "message": "Cannot delete item from database. There are bill records and/or invoice records with this item."}
         
-        db.execute("DELETE FROM items WHERE item_id = :item_id", {"item_id": item_id})
-        conn.commit()
+            db.execute("DELETE FROM items WHERE item_id = :item_id", {"item_id": item_id})
+            bump_table_version(db, "items")
+
+            return {"success": True, "message": f"{data[2]} successfully deleted from database"}
+
+        return jsonify(get_writer().run(delete_item))
+
+
+@app.route("/item/<int:item_id>/stock")
+def item_stock(item_id):
+    """Display the quantity, value and average purchase price of an item on stock at the end of a date ("as_of" parameter),
+    or at the end of every day of a date range ("from" and "to" parameters). The dates are in the format yyyy-mm-dd"""
 
-        return jsonify({"success": True, "message": f"{data[2]} successfully deleted from database"})
+    #Connect to database
+    conn = db_connection()
+    db = conn.cursor()
+
+    # Check if item is in database
+    data = db.execute("SELECT item_id FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
+    if data is None or len(data) == 0:
+        return jsonify({"success": False, "message": f"There is no item with id {item_id} in database"})
+
+    # If a date range is provided, return the stock at the end of every day of the range
+    if "from" in request.args or "to" in request.args:
+        try:
+            date_from = date.fromisoformat(request.args.get("from", ""))
+            date_to = date.fromisoformat(request.args.get("to", ""))
+        except ValueError:
+            return jsonify({"success": False, "message": "'from' and 'to' must be dates in the format yyyy-mm-dd"})
+
+        # Like the dates of bills and invoices, the range stays within the supported years (so the day before and after it are valid dates too)
+        if date_from.year < MIN_YEAR or date_to.year > MAX_YEAR:
+            return jsonify({"success": False, "message": f"'from' and 'to' must be between the years {MIN_YEAR} and {MAX_YEAR}"})
+
+        if date_to < date_from:
+            return jsonify({"success": False, "message": "'to' can't be before 'from'"})
+
+        if (date_to - date_from).days >= MAX_STOCK_SERIES_DAYS:
+            return jsonify({"success": False, "message": f"The date range can contain at most {MAX_STOCK_SERIES_DAYS} days"})
+
+        return jsonify({"success": True, "item_id": item_id, "from": date_from.isoformat(), "to": date_to.isoformat(),
+            "stock": stock_series(db, item_id, date_from, date_to)})
+
+    # Otherwise, return the stock at the end of the "as_of" date (today, if the date is not provided)
+    try:
+        as_of = date.fromisoformat(request.args.get("as_of", date.today().isoformat()))
+    except ValueError:
+        return jsonify({"success": False, "message": "'as_of' must be a date in the format yyyy-mm-dd"})
+
+    quantity, value = stock_as_of(db, item_id, as_of.isoformat())
+
+    return jsonify({"success": True, "item_id": item_id, "as_of": as_of.isoformat(), "quantity": quantity, "value": value,
+        "average_purchase_price": average_cost(quantity, value)})
 
 
 @app.route("/vat_rates", methods=["GET", "POST"])
@@ -330,48 +487,44 @@ def vat_rates():
 
     # If endpoint is accessed using a "GET" request, fetch all VAT rates from database and add them to a list that gets returned
     if request.method == "GET":
-        data = db.execute("SELECT * FROM vat_rates").fetchall()
+        # If the VAT rates have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "vat_rates")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        data = db.execute("SELECT vat_rate_id, vat_rate FROM vat_rates").fetchall()
         
         # If there are no VAT rates in database, return False
         if data is None or len(data) == 0:
             return(jsonify({"success": False, "message": "There are no VAT rates in database"}))
         
-        vat_rates = []
-
-        # Each VAT rate is a dictionary that gets added to the list
-        for row in data:
-            vat_rate = {}
-            vat_rate["vat_rate_id"] = row[0]
-            vat_rate["vat_rate"] = row[1]
-
-            vat_rates.append(vat_rate)
-
-        return jsonify({"success": True, "vat_rates": vat_rates})
+        # Each VAT rate is encoded as a JSON object, with the column names as keys
+        return with_etag(list_response({"success": True}, "vat_rates", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new VAT rate into the database
     if request.method == "POST":
-        # Check if all necessary keys are in the request form
-        form_fields = ["vat_rate"]
-        valid_form_data = validate_form_fields(form_fields, request.form)
-        if valid_form_data:
-            pass
-        else:
-            return jsonify({"success": False, "message": valid_form_data[1]})
+        # Validate the form-data (or JSON body) against the schema of a VAT rate
+        values, errors = VAT_RATE_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
 
-        vat_rate = request.form["vat_rate"]
-        
-        # If a VAT rate is not provided, return False
-        if not vat_rate:
-            return jsonify({"success": False, "message": "'vat_rate' is a required field"})
+        vat_rate = values["vat_rate"]
 
-        # Check if VAT rate already exists in database
-        data = db.execute("SELECT * FROM vat_rates WHERE vat_rate = :vat_rate", {"vat_rate": vat_rate}).fetchone()
-        if data is None or len(data) == 0:
-            db.execute("INSERT INTO vat_rates (vat_rate) VALUES (:vat_rate)", {"vat_rate": vat_rate})
-            conn.commit()
-            return jsonify({"success": True, "message": f"VAT rate of {vat_rate}% successfully added to database"})
-        else:
-            return jsonify({"success": False, "message": f"VAT rate of {vat_rate}% already exists in database"})
+        # The insert runs as one work unit of the single writer
+        def add_vat_rate(db):
+            # Insert the VAT rate, unless it already exists (UNIQUE constraint).
+            # The new table version lets the reference data cache (of every process) know that the VAT rates have changed
+            inserted = insert_unique(db, "vat_rates", "INSERT INTO vat_rates (vat_rate) VALUES (:vat_rate) ON CONFLICT DO NOTHING", {"vat_rate": vat_rate})
+            if inserted:
+                return {"success": True, "message": f"VAT rate of {vat_rate}% successfully added to database"}
+            else:
+                return {"success": False, "message": f"VAT rate of {vat_rate}% already exists in database"}
+
+        result = get_writer().run(add_vat_rate)
+        if result["success"]:
+            get_reference_cache().invalidate("vat_rates")
+
+        return jsonify(result)
 
 
 @app.route("/units_of_measure", methods=["GET", "POST"])
@@ -385,64 +538,51 @@ def units_of_measure():
 
     # If endpoint is accessed using a "GET" request, fetch all units of measure from database and add them to a list that gets returned
     if request.method == "GET":
+        # If the units of measure have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "units_of_measure")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
         # If there are no units of measure in database, return False
-        data = db.execute("SELECT * FROM units_of_measure").fetchall()
+        data = db.execute("SELECT unit_id, unit_acronym, unit_name FROM units_of_measure").fetchall()
         if data is None or len(data) == 0:
             return jsonify({"success": False, "message": "There no units of measure in database"})
 
-        units_of_measure = []
-
-        # Each unit of measure is a dictionary that gets added to the list
-        for row in data:
-            unit_of_measure = {}
-            unit_of_measure["unit_id"] = row[0]
-            unit_of_measure["unit_acronym"] = row[1]
-            unit_of_measure["unit_name"] = row[2]
-
-            units_of_measure.append(unit_of_measure)
-
-        return jsonify({"success": True, "units of measure": units_of_measure})
+        # Each unit of measure is encoded as a JSON object, with the column names as keys
+        return with_etag(list_response({"success": True}, "units of measure", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new unit of measure into the database
     if request.method == "POST":
-        # Check if all necessary keys are in the request form
-        form_fields = ["unit_acronym", "unit_name"]
-        valid_form_fields = validate_form_fields(form_fields, request.form)
-
-        if valid_form_fields:
-            pass
-        else:
-            return jsonify({"success": False, "message": valid_form_fields[1]})
-
-        unit_acronym = request.form["unit_acronym"]
-        unit_name = request.form["unit_name"]
-
-        # If a required input is not provided, return False
-        if not unit_acronym or not unit_name:
-            return jsonify({"success": False, "message": "You must provide all necessary data"})
-
-        # Check if the unit of measure already exists in the database
-        data = db.execute("""SELECT * FROM units_of_measure WHERE
-        unit_acronym = :unit_acronym OR
-        unit_name = :unit_name""", {
-            "unit_acronym": unit_acronym.upper(),
-            "unit_name": unit_name.capitalize()
-        }).fetchone()
-
-        if data is None or len(data) == 0:
-            db.execute("""INSERT INTO units_of_measure (
+        # Validate the form-data (or JSON body) against the schema of a unit of measure
+        values, errors = UNIT_OF_MEASURE_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        unit_acronym = values["unit_acronym"]
+        unit_name = values["unit_name"]
+
+        # The insert runs as one work unit of the single writer
+        def add_unit_of_measure(db):
+            # Insert the unit of measure, unless its acronym or name already exists (UNIQUE constraints).
+            # The new table version lets the reference data cache (of every process) know that the units of measure have changed
+            inserted = insert_unique(db, "units_of_measure", """INSERT INTO units_of_measure (
                 unit_acronym, unit_name) VALUES (
                     :unit_acronym,
-                    :unit_name)""", {
+                    :unit_name) ON CONFLICT DO NOTHING""", {
                         "unit_acronym": unit_acronym.upper(),
                         "unit_name": unit_name.capitalize()
                     })
 
-            conn.commit()
+            if inserted:
+                return {"success": True, "message": f"{unit_name.capitalize()} ({unit_acronym.upper()}) successfully added to database"}
+            else:
+                return {"success": False, "message": f"{unit_name.capitalize()} ({unit_acronym.upper()}) already exists in database"}
 
-            return jsonify({"success": True, "message": f"{unit_name.capitalize()} ({unit_acronym.upper()}) successfully added to database"})
-        else:
-            return jsonify({"success": False, "message": f"{unit_name.capitalize()} ({unit_acronym.upper()}) already exists in database"})
+        result = get_writer().run(add_unit_of_measure)
+        if result["success"]:
+            get_reference_cache().invalidate("units_of_measure")
+
+        return jsonify(result)
 
 
 @app.route("/bills", methods=["GET", "POST"])
@@ -456,160 +596,57 @@ def bills():
 
     # If endpoint is accessed using a "GET" request, fetch all bills from database and add them to a list that gets returned
     if request.method == "GET":
+        # If the bills have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "bills")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        # Read the pagination parameters. Without them, the whole list is returned
+        try:
+            limit, after = pagination_args(request.args, 2)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+
         # If there are no bills in the database, return False
-        data = db.execute("SELECT * FROM bills ORDER BY bill_date").fetchall()
-        if data is None or len(data) == 0:
+        # The bills are ordered by date (and by id, so that the order of bills with the same date is stable)
+        select = "SELECT bill_id, bill_number, bill_date, bill_due_date, bill_amount, partner_id FROM bills"
+        query, params = keyset_query(select, ["bill_date", "bill_id"], limit, after)
+        data = db.execute(query, params).fetchall()
+        if (data is None or len(data) == 0) and after is None:
             return jsonify({"success": False, "message": "There are no bills in database"})
 
-        bills = []
+        data, next_cursor = page_rows(data, limit, [2, 0])
 
-        # Each bill is a dictionary that gets added to the list
-        for row in data:
-            bill = {}
-            bill["bill_id"] = row[0]
-            bill["bill_number"] = row[1]
-            bill["bill_date"] = row[2]
-            bill["bill_due_date"] = row[3]
-            bill["bill_amount"] = row[4]
-            bill["partner_id"] = row[5]
+        # Each bill is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
 
-            bills.append(bill)
-        
-        return jsonify({"success": True, "bills": bills})
+        return with_etag(list_response(response, "bills", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new bill into the database
     if request.method == "POST":
-        # Check if the form data contains the necessary keys (input fields)
-        form_fields = ["bill_number", "bill_date", "bill_due_date", "bill_amount", "partner_id"]
-        for form_field in form_fields:
-            if form_field not in request.form:
-                return jsonify({"success": False, "message": f"Form-data must contain a field called \'{form_field}\'"})
-
-        bill_number = request.form["bill_number"]
-        bill_date = request.form["bill_date"]
-        bill_due_date = request.form["bill_due_date"]
-        try:
-            partner_id = int(request.form["partner_id"])
-        except:
-            return jsonify({"success": False, "message": "partner_id must be integer"})
-        
-        try:
-            bill_amount = int(request.form["bill_amount"])
-        except:
-            return jsonify({"success": False, "message": "Bill amount must be integer"})
-
-        # Check if all required inputs are provided
-        if not bill_number or not bill_date or not bill_due_date or not bill_amount or not partner_id:
-            return jsonify({"success": False, "message": "You need to provide all required data"})
-
-        # Check if the partner that had sent the bill is in the database
-        data = db.execute("SELECT * FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
-        if data is None or len(data) == 0:
-            return jsonify({"success": False, "message": f"There is no partner with id {partner_id} in database"})
-
-        # Validate the bill date
-        # The format in which the user provides the date must be dd.mm.yyyy
-        # The format in which the date is stored in the database is yyyy-mm-dd (this way, we can later compare and order dates)
-        if len(bill_date) != 10:
-            return jsonify({"success": False, "message": "The format of bill date must be: dd.mm.yyyy"})
-
-        if bill_date[2] != "." or bill_date[5] != ".":
-            return jsonify({"success": False, "message": "The format of bill date must be: dd.mm.yyyy"})
-
-        try:
-            day = int(bill_date[0:2])
-        except:
-            return jsonify({"success": False, "message": "The format of bill date must be: dd.mm.yyyy"})
-
-        if day < 1 or day > 31:
-            return jsonify({"success": False, "message": "Day must be between 01 and 31"})
-
-        try:
-            month = int(bill_date[3:5])
-        except:
-            return jsonify({"success": False, "message": "The format of bill date must be: dd.mm.yyyy"})
-
-        if month < 1 or month > 12:
-            return jsonify({"success": False, "message": "Month must be between 01 and 12"})
-
-        if (month == 2 and day > 28) or ((month == 4 or month == 6 or month == 9 or month == 11) and day > 30):
-            return jsonify({"success": False, "message": "Invalid date"})
-        
-        try:
-            year = int(bill_date[6:])
-        except:
-            return jsonify({"success": False, "message": "The format of bill date must be: dd.mm.yyyy"})
-
-        if year < 1950 and year > 2500:
-            return jsonify({"success": False, "message": "Year must be between 1950 and 2500"})
-
-        day = bill_date[0:2]
-        month = bill_date[3:5]
-        year = bill_date[6:]
-
-        bill_date = f"{year}-{month}-{day}"
-
-        # Validate the bill due date
-        # The format in which the user provides the due date must be dd.mm.yyyy
-        # The format in which the due date is stored in the database is yyyy-mm-dd (this way, we can later compare and order dates)
-        if len(bill_due_date) != 10:
-            return jsonify({"success": False, "message": "The format of bill due date must be: dd.mm.yyyy"})
-
-        if bill_due_date[2] != "." or bill_due_date[5] != ".":
-            return jsonify({"success": False, "message": "The format of bill due date must be: dd.mm.yyyy"})
-
-        try:
-            day = int(bill_due_date[0:2])
-        except:
-            return jsonify({"success": False, "message": "The format of bill due date must be: dd.mm.yyyy"})
-
-        if day < 1 or day > 31:
-            return jsonify({"success": False, "message": "Day must be between 01 and 31"})
-
-        try:
-            month = int(bill_due_date[3:5])
-        except:
-            return jsonify({"success": False, "message": "The format of bill due date must be: dd.mm.yyyy"})
-
-        if month < 1 or month > 12:
-            return jsonify({"success": False, "message": "Month must be between 01 and 12"})
-
-        if (month == 2 and day > 28) or ((month == 4 or month == 6 or month == 9 or month == 11) and day > 30):
-            return jsonify({"success": False, "message": "Invalid due date"})
-        
-        try:
-            year = int(bill_due_date[6:])
-        except:
-            return jsonify({"success": False, "message": "The format of bill due date must be: dd.mm.yyyy"})
-
-        if year < 1950 and year > 2500:
-            return jsonify({"success": False, "message": "Year must be between 1950 and 2500"})
-
-        day = bill_due_date[0:2]
-        month = bill_due_date[3:5]
-        year = bill_due_date[6:]
-
-        bill_due_date = f"{year}-{month}-{day}"
-
-        if bill_due_date < bill_date:
-            return jsonify({"success": False, "message": "Due date can't be before the date"})
-
-        # Check if the bill already exists in the database
-        data = db.execute("""SELECT * FROM bills WHERE
-        bill_number = :bill_number AND
-        bill_date = :bill_date AND
-        bill_due_date = :bill_due_date AND
-        bill_amount = :bill_amount AND
-        partner_id = :partner_id""", {
-            "bill_number": bill_number,
-            "bill_date": bill_date,
-            "bill_due_date": bill_due_date,
-            "bill_amount": bill_amount,
-            "partner_id": partner_id
-        }).fetchone()
-
-        if data is None or len(data) == 0:
-            db.execute("""INSERT INTO bills (
+        # Validate the form-data (or JSON body) against the schema of a bill.
+        # The dates are sent in the format dd.mm.yyyy and stored in the format yyyy-mm-dd (this way, we can later compare and order dates)
+        values, errors = BILL_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        bill_number = values["bill_number"]
+        bill_date = values["bill_date"]
+        bill_due_date = values["bill_due_date"]
+        bill_amount = values["bill_amount"]
+        partner_id = values["partner_id"]
+
+        # The check and the insert run as one work unit of the single writer
+        def add_bill(db):
+            # Check if the partner that had sent the bill is in the database
+            data = db.execute("SELECT * FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
+            if data is None or len(data) == 0:
+                return {"success": False, "message": f"There is no partner with id {partner_id} in database"}
+
+            # Insert the bill, unless the same bill already exists (UNIQUE constraint)
+            inserted = insert_unique(db, "bills", """INSERT INTO bills (
                 bill_number,
                 bill_date,
                 bill_due_date,
@@ -621,18 +658,20 @@ def bills():
                 :bill_due_date,
                 :bill_amount,
                 :partner_id
-            )""", {
+            ) ON CONFLICT DO NOTHING""", {
                 "bill_number": bill_number,
                 "bill_date": bill_date,
                 "bill_due_date": bill_due_date,
                 "bill_amount": bill_amount,
                 "partner_id": partner_id
             })
-            conn.commit()
 
-            return jsonify({"success": True, "message": f"Bill no. {bill_number} successfully added to database"})
-        else:
-            return jsonify({"success": False, "message": "This bill already exists"})
+            if inserted:
+                return {"success": True, "message": f"Bill no. {bill_number} successfully added to database"}
+            else:
+                return {"success": False, "message": "This bill already exists"}
+
+        return jsonify(get_writer().run(add_bill))
         
 
 @app.route("/bill_records", methods=["GET", "POST"])
@@ -646,72 +685,239 @@ def bill_records():
 
     # If endpoint is accessed using a "GET" request, fetch all bill records from database and add them to a list that gets returned
     if request.method == "GET":
+        # The columns are named like the keys of the response (the rows are encoded with the column names)
+        select = """SELECT bill_record_id, item_id, quantity, price, bill_record_amount_net, bill_record_vat,
+            bill_record_amount_total, bill_id FROM bill_records"""
+
+        # If streaming is requested, send the bill records while they are read from the database, instead of building the whole list in memory
+        streaming = stream_format(request)
+        if streaming:
+            # If there are no bill records in database, answer like the regular list does (before the stream has started)
+            if db.execute("SELECT 1 FROM bill_records LIMIT 1").fetchone() is None:
+                return jsonify({"success": False, "message": "There are no bill records in database"})
+
+            db.execute(select + " ORDER BY bill_record_id")
+            if streaming == "ndjson":
+                return Response(stream_with_context(ndjson_stream(db)), mimetype="application/x-ndjson")
+            return Response(stream_with_context(json_array_stream(db, "bill_records")), mimetype="application/json")
+
+        # If the bill records have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "bill_records")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        # Read the pagination parameters. Without them, the whole list is returned
+        try:
+            limit, after = pagination_args(request.args, 1)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+
         # If there are no bill records in database, return False
-        data = db.execute("SELECT * FROM bill_records").fetchall()
-        if data is None or len(data) == 0:
+        query, params = keyset_query(select, ["bill_record_id"], limit, after)
+        data = db.execute(query, params).fetchall()
+        if (data is None or len(data) == 0) and after is None:
             return jsonify({"success": False, "message": "There are no bill records in database"})
 
-        bill_records = []
-
-        # Each bill record is a dictionary that gets added to the list
-        for row in data:
-            bill_record = {}
-            bill_record["bill_record_id"] = row[0]
-            bill_record["item_id"] = row[1]
-            bill_record["quantity"] = row[2]
-            bill_record["price"] = row[3]
-            bill_record["bill_record_amount_net"] = row[4]
-            bill_record["bill_record_vat"] = row[5]
-            bill_record["bill_record_amount_total"] = row[6]
-            bill_record["bill_id"] = row[7]
+        data, next_cursor = page_rows(data, limit, [0])
 
-            bill_records.append(bill_record)
+        # Each bill record is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
 
-        return jsonify({"success": True, "bill_records": bill_records})
+        return with_etag(list_response(response, "bill_records", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new bill record into the database
     if request.method == "POST":
-        # Check if all necessary keys are in the request form
-        form_fields = ["item_id", "quantity", "price", "bill_id"]
-        for form_field in form_fields:
-            if form_field not in request.form:
-                return jsonify({"success": False, "message": f"form-data must contain {form_field}"})
+        # Validate the form-data (or JSON body) against the schema of a bill record
+        values, errors = BILL_RECORD_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        item_id = values["item_id"]
+        quantity = values["quantity"]
+        price = values["price"]
+        bill_id = values["bill_id"]
+
+        # The checks, the insert and the update of the item run as one work unit of the single writer, in one transaction
+        def add_bill_record(db):
+            # Check if the item that had been billed by the partner exists in the database
+            check_item = db.execute("SELECT * FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
+            if check_item is None or len(check_item) == 0:
+                return {"success": False, "message": f"There is no item with id {item_id} in database"}
+
+            # Check if the bill that contains the item exists in the database
+            check_bill = db.execute("SELECT * FROM bills WHERE bill_id = :bill_id", {"bill_id": bill_id}).fetchone()
+            if check_bill is None or len(check_bill) == 0:
+                return {"success": False, "message": f"There is no bill with id {bill_id} in database"}
+
+            # The VAT rate of the item is taken from the reference data cache
+            vat_rate = int(get_reference_cache().vat_rate(db, check_item[4]))
+
+            bill_record_amount_net = quantity * price
+            bill_record_vat = bill_record_amount_net * (vat_rate / 100)
+            bill_record_amount_total = bill_record_amount_net + bill_record_vat
+
+            db.execute("""INSERT INTO bill_records (
+                item_id,
+                quantity,
+                price,
+                bill_record_amount_net,
+                bill_record_vat,
+                bill_record_amount_total,
+                bill_id
+                ) VALUES (
+                :item_id,
+                :quantity,
+                :price,
+                :bill_record_amount_net,
+                :bill_record_vat,
+                :bill_record_amount_total,
+                :bill_id
+                )""", {
+                    "item_id": item_id,
+                    "quantity": quantity,
+                    "price": price,
+                    "bill_record_amount_net": bill_record_amount_net,
+                    "bill_record_vat": bill_record_vat,
+                    "bill_record_amount_total": bill_record_amount_total,
+                    "bill_id": bill_id
+                })
+
+            bill_date = str(check_bill[2])
+            record_stock_movement(db, item_id, bill_date, quantity, bill_record_amount_net)
+            bump_table_version(db, "bill_records")
+
+            # Update item information regarding quantity and prices
+            item_quantity = quantity + check_item[5]
+
+            item_total_purchase = db.execute("""SELECT SUM(bill_record_amount_net), SUM(quantity)
+            FROM bill_records
+            WHERE item_id = :item_id""", {
+                "item_id": item_id
+            }).fetchone()
+
+            item_total_purchase_value = item_total_purchase[0]
+            item_total_purchase_quantity = item_total_purchase[1]
+            average_purchase_price = item_total_purchase_value / item_total_purchase_quantity
+
+            db.execute("""UPDATE items SET
+            item_quantity = :item_quantity,
+            latest_purchase_price = :price,
+            average_purchase_price = :average_purchase_price
+            WHERE
+            item_id = :item_id""", {
+                "item_quantity": item_quantity,
+                "price": price,
+                "average_purchase_price": average_purchase_price,
+                "item_id": item_id
+            })
+            bump_table_version(db, "items")
 
-        try:
-            item_id = int(request.form["item_id"])
-            quantity = float(request.form["quantity"])
-            price = float(request.form["price"])
-            bill_id = int(request.form["bill_id"])
-        except:
-            item_id = None
-            quantity = None
-            price = None
-            bill_id = None
-
-        # If a required input is not provided, return False
-        if not item_id or not quantity or not price or not bill_id:
-            return jsonify({"success": False, "message": "You must provide all necessary data"})
-
-        # Check if the item that had been billed by the partner exists in the database
-        check_item = db.execute("SELECT * FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
-        if check_item is None or len(check_item) == 0:
-            return jsonify({"success": False, "message": f"There is no item with id {item_id} in database"})
-
-        # Check if the bill that contains the item exists in the database
-        check_bill = db.execute("SELECT * FROM bills WHERE bill_id = :bill_id", {"bill_id": bill_id}).fetchone()
-        if check_bill is None or len(check_bill) == 0:
-            return jsonify({"success": False, "message": f"There is no bill with id {bill_id} in database"})
-
-        vat_rate = db.execute("""SELECT vat_rate FROM vat_rates WHERE vat_rate_id = 
-        (SELECT vat_rate_id FROM items WHERE item_id = :item_id)""", {"item_id": item_id}).fetchone()
-
-        vat_rate = int(vat_rate[0])
-
-        bill_record_amount_net = quantity * price
-        bill_record_vat = bill_record_amount_net * (vat_rate / 100)
-        bill_record_amount_total = bill_record_amount_net + bill_record_vat
-
-        db.execute("""INSERT INTO bill_records (
+            return {"success": True, "message": "Bill record successfully added to database"}
+
+        return jsonify(get_writer().run(add_bill_record))
+
+
+@app.route("/bill_records/batch", methods=["POST"])
+def bill_records_batch():
+    """Insert many bill records (of one or more bills) at once.
+    The request body is a JSON array of bill records with the keys item_id, quantity, price and bill_id"""
+
+    try:
+        lines, on_error = batch_lines(request.get_json(silent=True), "bill_records")
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+
+    # Validate the format of every line first, without touching the database
+    results = []
+    parsed_lines = []
+    for line in lines:
+        if not isinstance(line, dict):
+            results.append({"success": False, "message": "Bill record must be a JSON object"})
+            parsed_lines.append(None)
+            continue
+
+        values, errors = BILL_RECORD_SCHEMA.validate(line)
+        if errors:
+            results.append(validation_error(errors))
+            parsed_lines.append(None)
+            continue
+
+        results.append({"success": True, "message": "Bill record successfully added to database"})
+        parsed_lines.append((values["item_id"], values["quantity"], values["price"], values["bill_id"]))
+
+    # The lookups, the inserts and the updates of the items run as one work unit of the single writer, in one transaction
+    def add_bill_records(db):
+        # Look up all items and all bills of the batch with one query each (the VAT rates come from the reference data cache)
+        item_ids = sorted({line[0] for line in parsed_lines if line is not None})
+        bill_ids = sorted({line[3] for line in parsed_lines if line is not None})
+
+        placeholders, params = in_clause("item_id", item_ids)
+        items_data = db.execute(f"SELECT item_id, item_quantity, vat_rate_id FROM items WHERE item_id IN ({placeholders})", params).fetchall()
+        items_found = {row[0]: row for row in items_data}
+
+        placeholders, params = in_clause("bill_id", bill_ids)
+        bills_data = db.execute(f"SELECT bill_id, bill_date FROM bills WHERE bill_id IN ({placeholders})", params).fetchall()
+        bill_dates = {row[0]: str(row[1]) for row in bills_data}
+
+        for i, line in enumerate(parsed_lines):
+            if line is None:
+                continue
+
+            item_id, quantity, price, bill_id = line
+            if item_id not in items_found:
+                results[i] = {"success": False, "message": f"There is no item with id {item_id} in database"}
+                parsed_lines[i] = None
+            elif bill_id not in bill_dates:
+                results[i] = {"success": False, "message": f"There is no bill with id {bill_id} in database"}
+                parsed_lines[i] = None
+
+        # With "reject_batch", one invalid line rejects the whole batch. With "skip_line", only the invalid lines are skipped
+        failed = sum(1 for result in results if not result["success"])
+        if failed and (on_error == "reject_batch" or failed == len(lines)):
+            for result in results:
+                if result["success"]:
+                    result["success"] = False
+                    result["message"] = "Bill record not added, because the batch contains invalid bill records"
+            return {"success": False, "message": f"{failed} of {len(lines)} bill records are not valid. No bill records were added", "results": results}
+
+        # Compute the amounts of all valid lines
+        bill_records = []
+        item_quantities = {}
+        item_latest_prices = {}
+        stock_movements = {}
+        for line in parsed_lines:
+            if line is None:
+                continue
+
+            item_id, quantity, price, bill_id = line
+            vat_rate = int(get_reference_cache().vat_rate(db, items_found[item_id][2]))
+
+            bill_record_amount_net = quantity * price
+            bill_record_vat = bill_record_amount_net * (vat_rate / 100)
+            bill_record_amount_total = bill_record_amount_net + bill_record_vat
+
+            bill_records.append({
+                "item_id": item_id,
+                "quantity": quantity,
+                "price": price,
+                "bill_record_amount_net": bill_record_amount_net,
+                "bill_record_vat": bill_record_vat,
+                "bill_record_amount_total": bill_record_amount_total,
+                "bill_id": bill_id
+            })
+
+            item_quantities[item_id] = item_quantities.get(item_id, 0) + quantity
+            item_latest_prices[item_id] = price
+
+            # Stock movements are added to the stock ledger once per item and bill date
+            movement_key = (item_id, bill_dates[bill_id])
+            movement_quantity, movement_value = stock_movements.get(movement_key, (0, 0))
+            stock_movements[movement_key] = (movement_quantity + quantity, movement_value + bill_record_amount_net)
+
+        # Insert all bill records and update the items in one transaction
+        db.executemany("""INSERT INTO bill_records (
             item_id,
             quantity,
             price,
@@ -727,44 +933,42 @@ def bill_records():
             :bill_record_vat,
             :bill_record_amount_total,
             :bill_id
-            )""", {
-                "item_id": item_id,
-                "quantity": quantity,
-                "price": price,
-                "bill_record_amount_net": bill_record_amount_net,
-                "bill_record_vat": bill_record_vat,
-                "bill_record_amount_total": bill_record_amount_total,
-                "bill_id": bill_id
-            })
-        conn.commit()
+            )""", bill_records)
 
-        # Update item information regarding quantity and prices
-        item_quantity = quantity + check_item[5]
+        for (item_id, bill_date), (quantity, value) in stock_movements.items():
+            record_stock_movement(db, item_id, bill_date, quantity, value)
 
-        item_total_purchase = db.execute("""SELECT SUM(bill_record_amount_net), SUM(quantity)
+        # Update item information regarding quantity and prices, once per item
+        placeholders, params = in_clause("item_id", list(item_quantities))
+        item_totals = db.execute(f"""SELECT item_id, SUM(bill_record_amount_net), SUM(quantity)
         FROM bill_records
-        WHERE item_id = :item_id""", {
-            "item_id": item_id
-        }).fetchone()
-
-        item_total_purchase_value = item_total_purchase[0]
-        item_total_purchase_quantity = item_total_purchase[1]
-        average_purchase_price = item_total_purchase_value / item_total_purchase_quantity
+        WHERE item_id IN ({placeholders})
+        GROUP BY item_id""", params).fetchall()
+
+        item_updates = []
+        for item_id, item_total_purchase_value, item_total_purchase_quantity in item_totals:
+            item_updates.append({
+                "item_quantity": items_found[item_id][1] + item_quantities[item_id],
+                "price": item_latest_prices[item_id],
+                "average_purchase_price": item_total_purchase_value / item_total_purchase_quantity,
+                "item_id": item_id
+            })
 
-        db.execute("""UPDATE items SET
+        db.executemany("""UPDATE items SET
         item_quantity = :item_quantity,
         latest_purchase_price = :price,
         average_purchase_price = :average_purchase_price
         WHERE
-        item_id = :item_id""", {
-            "item_quantity": item_quantity,
-            "price": price,
-            "average_purchase_price": average_purchase_price,
-            "item_id": item_id
-        })
-        conn.commit()
+        item_id = :item_id""", item_updates)
+        bump_table_version(db, "bill_records")
+        bump_table_version(db, "items")
+
+        if failed:
+            return {"success": True, "message": f"{len(bill_records)} of {len(lines)} bill records successfully added to database", "results": results}
+
+        return {"success": True, "message": f"{len(bill_records)} bill records successfully added to database", "results": results}
 
-        return jsonify({"success": True, "message": "Bill record successfully added to database"})
+    return jsonify(get_writer().run(add_bill_records))
 
 
 @app.route("/invoices", methods=["GET", "POST"])
@@ -778,166 +982,63 @@ def invoices():
 
     # If endpoint is accessed using a "GET" request, fetch all issued invoices from database and add them to a list that gets returned
     if request.method == "GET":
-        # If there are no issued invoices in database, return False
-        data = db.execute("SELECT * FROM invoices ORDER BY invoice_number").fetchall()
-        if data is None or len(data) == 0:
-            return jsonify({"success": False, "message": "There are no invoices in database"})
-
-        invoices = []
-
-        # Each issued invoice is a dictionary that gets added to the list
-        for row in data:
-            invoice = {}
-            invoice["invoice_id"] = row[0]
-            invoice["invoice_number"] = row[1]
-            invoice["invoice_date"] = row[2]
-            invoice["invoice_due_date"] = row[3]
-            invoice["invoice_amount_net"] = row[4]
-            invoice["invoice_vat"] = row[5]
-            invoice["invoice_amount_total"] = row[6]
-            invoice["partner_id"] = row[7]
-
-            invoices.append(invoice)
-        
-        return jsonify({"success": True, "invoices": invoices})
-
-    # If endpoint is accessed using a "POST" request, validate the inputs and insert the new issued invoice into the database
-    if request.method == "POST":
-        data = db.execute("SELECT * FROM invoices ORDER BY invoice_number DESC").fetchall()
-        # The invoices are numbered automatically, starting with 00001
-        if data is None or len(data) == 0:
-            invoice_number = "00001"
-        else:
-            latest_invoice_number = data[0][1]
-            invoice_number = int(latest_invoice_number) + 1
-            invoice_number = (5 - len(str(invoice_number))) * "0" + str(invoice_number)
-
-        # Check if all necessary keys are in the request form
-        form_fields = ["invoice_date", "invoice_due_date", "partner_id"]
-        for form_field in form_fields:
-            if form_field not in request.form:
-                return jsonify({"success": False, "message": f"Form-data must contain a field called \'{form_field}\'"})
-
-        invoice_date = request.form["invoice_date"]
-        invoice_due_date = request.form["invoice_due_date"]
-        try:
-            partner_id = int(request.form["partner_id"])
-        except:
-            return jsonify({"success": False, "message": "partner_id must be integer"})
-        
-        # If a required input is not provided, return False
-        if not invoice_date or not invoice_due_date or not partner_id:
-            return jsonify({"success": False, "message": "You need to provide all required data"})
-
-        # Check if the partner to whom the invoice is issued is in the database
-        data = db.execute("SELECT * FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
-        if data is None or len(data) == 0:
-            return jsonify({"success": False, "message": f"There is no partner with id {partner_id} in database"})
-
-        # Validate the invoice date
-        # The format in which the user provides the date must be dd.mm.yyyy
-        # The format in which the date is stored in the database is yyyy-mm-dd (this way, we can later compare and order dates)
-        if len(invoice_date) != 10:
-            return jsonify({"success": False, "message": "The format of invoice date must be: dd.mm.yyyy"})
-
-        if invoice_date[2] != "." or invoice_date[5] != ".":
-            return jsonify({"success": False, "message": "The format of invoice date must be: dd.mm.yyyy"})
+        # If the invoices have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "invoices")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
 
+        # Read the pagination parameters. Without them, the whole list is returned
         try:
-            day = int(invoice_date[0:2])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice date must be: dd.mm.yyyy"})
+            limit, after = pagination_args(request.args, 2)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
 
-        if day < 1 or day > 31:
-            return jsonify({"success": False, "message": "Day must be between 01 and 31"})
-
-        try:
-            month = int(invoice_date[3:5])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice date must be: dd.mm.yyyy"})
-
-        if month < 1 or month > 12:
-            return jsonify({"success": False, "message": "Month must be between 01 and 12"})
-
-        if (month == 2 and day > 28) or ((month == 4 or month == 6 or month == 9 or month == 11) and day > 30):
-            return jsonify({"success": False, "message": "Invalid date"})
-        
-        try:
-            year = int(invoice_date[6:])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice date must be: dd.mm.yyyy"})
-
-        if year < 1950 and year > 2500:
-            return jsonify({"success": False, "message": "Year must be between 1950 and 2500"})
-
-        day = invoice_date[0:2]
-        month = invoice_date[3:5]
-        year = invoice_date[6:]
-
-        invoice_date = f"{year}-{month}-{day}"
-
-        # Validate the invoice due date
-        # The format in which the user provides the due date must be dd.mm.yyyy
-        # The format in which the due date is stored in the database is yyyy-mm-dd (this way, we can later compare and order dates)
-        if len(invoice_due_date) != 10:
-            return jsonify({"success": False, "message": "The format of invoice due date must be: dd.mm.yyyy"})
-
-        if invoice_due_date[2] != "." or invoice_due_date[5] != ".":
-            return jsonify({"success": False, "message": "The format of invoice due date must be: dd.mm.yyyy"})
-
-        try:
-            day = int(invoice_due_date[0:2])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice due date must be: dd.mm.yyyy"})
+        # If there are no issued invoices in database, return False
+        select = """SELECT invoice_id, invoice_number, invoice_date, invoice_due_date, invoice_amount_net, invoice_vat,
+            invoice_amount_total, partner_id FROM invoices"""
+        query, params = keyset_query(select, ["invoice_number", "invoice_id"], limit, after)
+        data = db.execute(query, params).fetchall()
+        if (data is None or len(data) == 0) and after is None:
+            return jsonify({"success": False, "message": "There are no invoices in database"})
 
-        if day < 1 or day > 31:
-            return jsonify({"success": False, "message": "Day must be between 01 and 31"})
+        data, next_cursor = page_rows(data, limit, [1, 0])
 
-        try:
-            month = int(invoice_due_date[3:5])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice due date must be: dd.mm.yyyy"})
+        # Each issued invoice is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
 
-        if month < 1 or month > 12:
-            return jsonify({"success": False, "message": "Month must be between 01 and 12"})
+        return with_etag(list_response(response, "invoices", db, data), etag)
 
-        if (month == 2 and day > 28) or ((month == 4 or month == 6 or month == 9 or month == 11) and day > 30):
-            return jsonify({"success": False, "message": "Invalid due date"})
-        
-        try:
-            year = int(invoice_due_date[6:])
-        except:
-            return jsonify({"success": False, "message": "The format of invoice due date must be: dd.mm.yyyy"})
-
-        if year < 1950 and year > 2500:
-            return jsonify({"success": False, "message": "Year must be between 1950 and 2500"})
-
-        day = invoice_due_date[0:2]
-        month = invoice_due_date[3:5]
-        year = invoice_due_date[6:]
-
-        invoice_due_date = f"{year}-{month}-{day}"
-
-        if invoice_due_date < invoice_date:
-            return jsonify({"success": False, "message": "The due date can't be before the date"})
-
-        invoice_amount_net = 0
-        invoice_vat = 0
-        invoice_amount_total = 0
-
-        # Check if the issued invoice already exists in the database
-        data = db.execute("""SELECT * FROM invoices WHERE
-        invoice_number = :invoice_number AND
-        invoice_date = :invoice_date AND
-        invoice_due_date = :invoice_due_date AND
-        partner_id = :partner_id""", {
-            "invoice_number": invoice_number,
-            "invoice_date": invoice_date,
-            "invoice_due_date": invoice_due_date,
-            "partner_id": partner_id
-        }).fetchone()
+    # If endpoint is accessed using a "POST" request, validate the inputs and insert the new issued invoice into the database
+    if request.method == "POST":
+        # Validate the form-data (or JSON body) against the schema of an invoice.
+        # The dates are sent in the format dd.mm.yyyy and stored in the format yyyy-mm-dd (this way, we can later compare and order dates)
+        values, errors = INVOICE_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        invoice_date = values["invoice_date"]
+        invoice_due_date = values["invoice_due_date"]
+        partner_id = values["partner_id"]
+        invoice_series = values["invoice_series"]
+
+        # The checks, the invoice number and the insert run as one work unit of the single writer, in one transaction
+        def add_invoice(db):
+            # Check if the partner to whom the invoice is issued is in the database
+            data = db.execute("SELECT * FROM partners WHERE partner_id = :partner_id", {"partner_id": partner_id}).fetchone()
+            if data is None or len(data) == 0:
+                return {"success": False, "message": f"There is no partner with id {partner_id} in database"}
+
+            invoice_amount_net = 0
+            invoice_vat = 0
+            invoice_amount_total = 0
+
+            # The invoices are numbered automatically, starting with 00001.
+            # The number is taken from the sequence in the same transaction that inserts the invoice,
+            # so concurrent requests (even from different processes) never get the same number
+            invoice_number = allocate_invoice_number(db, invoice_date, invoice_series, app.config["INVOICE_NUMBERING"])
 
-        if data is None or len(data) == 0:
             db.execute("""INSERT INTO invoices (
                 invoice_number,
                 invoice_date,
@@ -963,11 +1064,11 @@ def invoices():
                 "invoice_amount_total": invoice_amount_total,
                 "partner_id": partner_id
             })
-            conn.commit()
+            bump_table_version(db, "invoices")
 
-            return jsonify({"success": True, "message": f"Invoice no. {invoice_number} successfully added to database"})
-        else:
-            return jsonify({"success": False, "message": "This invoice already exists"})
+            return {"success": True, "message": f"Invoice no. {invoice_number} successfully added to database"}
+
+        return jsonify(get_writer().run(add_invoice))
 
 
 @app.route("/invoice_records", methods=["GET", "POST"])
@@ -981,147 +1082,302 @@ def invoice_records():
 
     # If endpoint is accessed using a "GET" request, fetch all invoice records from database and add them to a list that gets returned
     if request.method == "GET":
+        # The columns are named like the keys of the response (the rows are encoded with the column names)
+        select = """SELECT invoice_record_id, item_id, quantity, net_selling_price, invoice_record_amount_net, invoice_record_vat,
+            invoice_record_amount_total, invoice_id, average_purchase_price, vat_amount_per_unit, gross_selling_price FROM invoice_records"""
+
+        # If streaming is requested, send the invoice records while they are read from the database, instead of building the whole list in memory
+        streaming = stream_format(request)
+        if streaming:
+            # If there are no invoice records in database, answer like the regular list does (before the stream has started)
+            if db.execute("SELECT 1 FROM invoice_records LIMIT 1").fetchone() is None:
+                return jsonify({"success": False, "message": "There are no invoice records in database"})
+
+            db.execute(select + " ORDER BY invoice_record_id")
+            if streaming == "ndjson":
+                return Response(stream_with_context(ndjson_stream(db)), mimetype="application/x-ndjson")
+            return Response(stream_with_context(json_array_stream(db, "invoice_records")), mimetype="application/json")
+
+        # If the invoice records have not changed since the client has read them, answer with "304 Not Modified" without reading the table
+        etag = make_etag([table_version(db, "invoice_records")], request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        # Read the pagination parameters. Without them, the whole list is returned
+        try:
+            limit, after = pagination_args(request.args, 1)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)})
+
         # If there are no invoice records in the database, return False
-        data = db.execute("SELECT * FROM invoice_records").fetchall()
-        if data is None or len(data) == 0:
+        query, params = keyset_query(select, ["invoice_record_id"], limit, after)
+        data = db.execute(query, params).fetchall()
+        if (data is None or len(data) == 0) and after is None:
             return jsonify({"success": False, "message": "There are no invoice records in database"})
 
-        invoice_records = []
+        data, next_cursor = page_rows(data, limit, [0])
+
+        # Each invoice record is encoded as a JSON object, with the column names as keys
+        response = {"success": True}
+        if limit is not None:
+            response["next_cursor"] = next_cursor
 
-        # Each invoice record is a dictionary that gets added to the list
-        for row in data:
-            invoice_record = {}
-            invoice_record["invoice_record_id"] = row[0]
-            invoice_record["item_id"] = row[1]
-            invoice_record["quantity"] = row[2]
-            invoice_record["net_selling_price"] = row[3]
-            invoice_record["invoice_record_amount_net"] = row[4]
-            invoice_record["invoice_record_vat"] = row[5]
-            invoice_record["invoice_record_amount_total"] = row[6]
-            invoice_record["invoice_id"] = row[7]
-            invoice_record["average_purchase_price"] = row[8]
-            invoice_record["vat_amount_per_unit"] = row[9]
-            invoice_record["gross_selling_price"] = row[10]
-
-            invoice_records.append(invoice_record)
-
-        return jsonify({"success": True, "invoice_records": invoice_records})
+        return with_etag(list_response(response, "invoice_records", db, data), etag)
 
     # If endpoint is accessed using a "POST" request, validate the inputs and insert the new invoice record into the database
     if request.method == "POST":
-        # Check if all necessary keys are in the request form
-        form_fields = ["item_id", "quantity", "selling_price", "vat_included", "invoice_id"]
-        for form_field in form_fields:
-            if form_field not in request.form:
-                return jsonify({"success": False, "message": f"form-data must contain {form_field}"})
-
-        try:
-            item_id = int(request.form["item_id"])
-            quantity = float(request.form["quantity"])
-            selling_price = float(request.form["selling_price"])
-            vat_included = int(request.form["vat_included"])
-            invoice_id = int(request.form["invoice_id"])
-        except:
-            item_id = None
-            quantity = None
-            selling_price = None
-            vat_included = False
-            invoice_id = None
-
-        # If a required input is not provided, return False
-        if not item_id or not quantity or not selling_price or not invoice_id:
-            return jsonify({"success": False, "message": "You must provide all necessary data"})
-
-        if vat_included == 0:
-            vat_included = False
-        elif vat_included == 1:
-            vat_included = True
-        else:
-            return jsonify({"success": False, "message": "\"vat_included\" should be 0 if VAT is not included in the selling price, otherwise it should be 1"})
-
-        # Check if the item that gets invoiced is in the database
-        check_item = db.execute("SELECT * FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
-        if check_item is None or len(check_item) == 0:
-            return jsonify({"success": False, "message": f"There is no item with id {item_id} in database"})
-
-        # Check if the invoice that the record is a part of exists in the database
-        check_invoice = db.execute("SELECT * FROM invoices WHERE invoice_id = :invoice_id", {"invoice_id": invoice_id}).fetchone()
-        if check_invoice is None or len(check_invoice) == 0:
-            return jsonify({"success": False, "message": f"There is no invoice with id {invoice_id} in database"})
-
-        # Check if there is actually enough quantity on stock up to the invoice date
-        invoice_date = str(check_invoice[2])
+        # Validate the form-data (or JSON body) against the schema of an invoice record
+        values, errors = INVOICE_RECORD_SCHEMA.validate(request_data())
+        if errors:
+            return jsonify(validation_error(errors))
+
+        item_id = values["item_id"]
+        quantity = values["quantity"]
+        selling_price = values["selling_price"]
+        vat_included = values["vat_included"]
+        invoice_id = values["invoice_id"]
+
+        # The stock check, the insert and the update of the item run as one work unit of the single writer,
+        # so no other sale can take the same stock in between
+        def add_invoice_record(db):
+            # Check if the item that gets invoiced is in the database
+            check_item = db.execute("SELECT * FROM items WHERE item_id = :item_id", {"item_id": item_id}).fetchone()
+            if check_item is None or len(check_item) == 0:
+                return {"success": False, "message": f"There is no item with id {item_id} in database"}
+
+            # Check if the invoice that the record is a part of exists in the database
+            check_invoice = db.execute("SELECT * FROM invoices WHERE invoice_id = :invoice_id", {"invoice_id": invoice_id}).fetchone()
+            if check_invoice is None or len(check_invoice) == 0:
+                return {"success": False, "message": f"There is no invoice with id {invoice_id} in database"}
+
+            # Check if there is actually enough quantity on stock up to the invoice date
+            # The quantity and value on stock are read from the stock ledger, which keeps the running totals per item and date
+            invoice_date = str(check_invoice[2])
+            item_quantity_on_stock, item_amount_on_stock = stock_as_of(db, item_id, invoice_date)
+
+            if item_quantity_on_stock < quantity:
+                return {"success": False, "message": f"You don't have enough quantity on stock. Maximum quantity allowed: {item_quantity_on_stock}"}
+
+            average_purchase_price = item_amount_on_stock / item_quantity_on_stock
         
-        item_purchased_quantity_and_amount = db.execute("""SELECT SUM(quantity), SUM(bill_record_amount_net)
-        FROM bill_records 
-        JOIN bills ON bill_records.bill_id = bills.bill_id 
-        WHERE 
-        item_id = :item_id AND
-        bills.bill_date <= :invoice_date""", {
-            "item_id": item_id,
-            "invoice_date": invoice_date
-        }).fetchone()
-
-        if item_purchased_quantity_and_amount is None or len(item_purchased_quantity_and_amount) == 0:
-            return jsonify({"success": False, "message": "You have no quantity on stock. Cannot continue until you have quantity."})
-        
-        item_purchased_quantity = item_purchased_quantity_and_amount[0]
-        item_purchased_amount = item_purchased_quantity_and_amount[1]
+            # The VAT rate of the item is taken from the reference data cache
+            vat_rate = int(get_reference_cache().vat_rate(db, check_item[4]))
+
+            if vat_included:
+                net_selling_price = selling_price / (1 + (vat_rate / 100))
+                gross_selling_price = selling_price
+            else:
+                net_selling_price = selling_price
+                gross_selling_price = net_selling_price * (1 + (vat_rate / 100))
+
+            vat_amount_per_unit = gross_selling_price - net_selling_price        
+            invoice_record_amount_net = quantity * net_selling_price
+            invoice_record_vat = invoice_record_amount_net * (vat_rate / 100)
+            invoice_record_amount_total = invoice_record_amount_net + invoice_record_vat
+
+            db.execute("""INSERT INTO invoice_records (
+                item_id,
+                quantity,
+                net_selling_price,
+                invoice_record_amount_net,
+                invoice_record_vat,
+                invoice_record_amount_total,
+                invoice_id,
+                average_purchase_price,
+                vat_amount_per_unit,
+                gross_selling_price
+                ) VALUES (
+                :item_id,
+                :quantity,
+                :net_selling_price,
+                :invoice_record_amount_net,
+                :invoice_record_vat,
+                :invoice_record_amount_total,
+                :invoice_id,
+                :average_purchase_price,
+                :vat_amount_per_unit,
+                :gross_selling_price
+                )""", {
+                    "item_id": item_id,
+                    "quantity": quantity,
+                    "net_selling_price": net_selling_price,
+                    "invoice_record_amount_net": invoice_record_amount_net,
+                    "invoice_record_vat": invoice_record_vat,
+                    "invoice_record_amount_total": invoice_record_amount_total,
+                    "invoice_id": invoice_id,
+                    "average_purchase_price": average_purchase_price,
+                    "vat_amount_per_unit": vat_amount_per_unit,
+                    "gross_selling_price": gross_selling_price
+                })
+
+            # Sold quantity leaves the stock at its average purchase price
+            record_stock_movement(db, item_id, invoice_date, -quantity, -quantity * average_purchase_price)
+            bump_table_version(db, "invoice_records")
+
+            item_quantity = check_item[5] - quantity
+
+            item_total_sales = db.execute("""SELECT SUM(invoice_record_amount_net), SUM(quantity)
+            FROM invoice_records
+            WHERE item_id = :item_id""", {
+                "item_id": item_id
+            }).fetchone()
+
+            item_total_selling_value = item_total_sales[0]
+            item_total_selling_quantity = item_total_sales[1]
+            average_net_selling_price = item_total_selling_value / item_total_selling_quantity
+
+            # Update item information regarding quantity and prices
+            db.execute("""UPDATE items SET
+            item_quantity = :item_quantity,
+            latest_net_selling_price = :latest_net_selling_price,
+            average_net_selling_price = :average_net_selling_price
+            WHERE
+            item_id = :item_id""", {
+                "item_quantity": item_quantity,
+                "latest_net_selling_price": net_selling_price,
+                "average_net_selling_price": average_net_selling_price,
+                "item_id": item_id
+            })
+            bump_table_version(db, "items")
 
-        if item_purchased_quantity is None:
-            item_purchased_quantity = 0
-            item_purchased_amount = 0
+            return {"success": True, "message": "Invoice record successfully added to database"}
 
-        print(f"item_purchased_quantity: {item_purchased_quantity}")
-        print(f"item_purchased_amount: {item_purchased_amount}")
+        return jsonify(get_writer().run(add_invoice_record))
 
-        item_sold_quantity_and_amount = db.execute("""SELECT SUM(quantity), SUM(quantity*average_purchase_price)
-        FROM invoice_records
-        JOIN invoices ON invoice_records.invoice_id = invoices.invoice_id
-        WHERE
-        item_id = :item_id AND
-        invoices.invoice_date <= :invoice_date""", {
-            "item_id": item_id,
-            "invoice_date": invoice_date
-        }).fetchone()
-        
-        if item_sold_quantity_and_amount is None or len(item_sold_quantity_and_amount) == 0:
-            item_sold_quantity = 0
-            item_sold_amount = 0
-        else:
-            item_sold_quantity = item_sold_quantity_and_amount[0]
-            item_sold_amount = item_sold_quantity_and_amount[1]
 
-        if item_sold_quantity is None:
-            item_sold_quantity = 0
-            item_sold_amount = 0
+@app.route("/invoice_records/batch", methods=["POST"])
+def invoice_records_batch():
+    """Insert all invoice records of an invoice at once.
+    The request body is a JSON object with the keys invoice_id and invoice_records, which is an array of invoice records
+    with the keys item_id, quantity, selling_price and vat_included"""
 
-        item_quantity_on_stock = item_purchased_quantity - item_sold_quantity
-        item_amount_on_stock = item_purchased_amount - item_sold_amount
-
-        if item_quantity_on_stock < quantity:
-            return jsonify({"success": False, "message": f"You don't have enough quantity on stock. Maximum quantity allowed: {item_quantity_on_stock}"})
-        
-        average_purchase_price = item_amount_on_stock / item_quantity_on_stock
-        
-        vat_rate = db.execute("""SELECT vat_rate FROM vat_rates WHERE vat_rate_id = 
-        (SELECT vat_rate_id FROM items WHERE item_id = :item_id)""", {"item_id": item_id}).fetchone()
+    request_json = request.get_json(silent=True)
+    try:
+        lines, on_error = batch_lines(request_json, "invoice_records")
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)})
+
+    # The invoice is validated like the fields of the lines
+    values, errors = INVOICE_RECORD_BATCH_SCHEMA.validate(request_json)
+    if errors:
+        return jsonify(validation_error(errors))
+    invoice_id = values["invoice_id"]
+
+    # The stock checks, the inserts and the updates of the items run as one work unit of the single writer,
+    # so no other sale can take the same stock in between
+    def add_invoice_records(db):
+        # Check if the invoice that the records are a part of exists in the database
+        check_invoice = db.execute("SELECT * FROM invoices WHERE invoice_id = :invoice_id", {"invoice_id": invoice_id}).fetchone()
+        if check_invoice is None or len(check_invoice) == 0:
+            return {"success": False, "message": f"There is no invoice with id {invoice_id} in database"}
 
-        vat_rate = int(vat_rate[0])
+        invoice_date = str(check_invoice[2])
 
-        if vat_included:
-            net_selling_price = selling_price / (1 + (vat_rate / 100))
-            gross_selling_price = selling_price
-        else:
-            net_selling_price = selling_price
-            gross_selling_price = net_selling_price * (1 + (vat_rate / 100))
+        # Validate the format of every line first, without touching the database
+        results = []
+        parsed_lines = []
+        for line in lines:
+            if not isinstance(line, dict):
+                results.append({"success": False, "message": "Invoice record must be a JSON object"})
+                parsed_lines.append(None)
+                continue
+
+            values, errors = INVOICE_RECORD_LINE_SCHEMA.validate(line)
+            if errors:
+                results.append(validation_error(errors))
+                parsed_lines.append(None)
+                continue
+
+            results.append({"success": True, "message": "Invoice record successfully added to database"})
+            parsed_lines.append((values["item_id"], values["quantity"], values["selling_price"], values["vat_included"]))
+
+        # Look up all items and their stock on the invoice date with one query each (the VAT rates come from the reference data cache).
+        # The stock comes from the last stock ledger row of every item up to the invoice date
+        item_ids = sorted({line[0] for line in parsed_lines if line is not None})
+
+        placeholders, params = in_clause("item_id", item_ids)
+        items_data = db.execute(f"SELECT item_id, item_quantity, vat_rate_id FROM items WHERE item_id IN ({placeholders})", params).fetchall()
+        items_found = {row[0]: row for row in items_data}
+
+        params["invoice_date"] = invoice_date
+        stock_data = db.execute(f"""SELECT item_id, running_quantity, running_value
+        FROM stock_ledger AS ledger
+        WHERE item_id IN ({placeholders}) AND ledger_date = (
+            SELECT MAX(ledger_date) FROM stock_ledger
+            WHERE item_id = ledger.item_id AND ledger_date <= :invoice_date
+        )""", params).fetchall()
+        stock = {row[0]: (row[1], row[2]) for row in stock_data}
+
+        # Check the stock line by line, because several lines can take the same item
+        remaining_quantities = {item_id: stock.get(item_id, (0, 0))[0] for item_id in item_ids}
+        for i, line in enumerate(parsed_lines):
+            if line is None:
+                continue
+
+            item_id, quantity = line[0], line[1]
+            if item_id not in items_found:
+                results[i] = {"success": False, "message": f"There is no item with id {item_id} in database"}
+                parsed_lines[i] = None
+            elif remaining_quantities[item_id] < quantity:
+                results[i] = {"success": False, "message": f"You don't have enough quantity on stock. Maximum quantity allowed: {remaining_quantities[item_id]}"}
+                parsed_lines[i] = None
+            else:
+                remaining_quantities[item_id] -= quantity
+
+        # With "reject_batch", one invalid line rejects the whole batch. With "skip_line", only the invalid lines are skipped
+        failed = sum(1 for result in results if not result["success"])
+        if failed and (on_error == "reject_batch" or failed == len(lines)):
+            for result in results:
+                if result["success"]:
+                    result["success"] = False
+                    result["message"] = "Invoice record not added, because the batch contains invalid invoice records"
+            return {"success": False, "message": f"{failed} of {len(lines)} invoice records are not valid. No invoice records were added", "results": results}
+
+        # Compute the amounts of all valid lines
+        invoice_records = []
+        item_quantities = {}
+        item_latest_prices = {}
+        for line in parsed_lines:
+            if line is None:
+                continue
+
+            item_id, quantity, selling_price, vat_included = line
+            vat_rate = int(get_reference_cache().vat_rate(db, items_found[item_id][2]))
+
+            # Selling at the average purchase price does not change it, so it is the same for all lines of the item
+            item_quantity_on_stock, item_amount_on_stock = stock[item_id]
+            average_purchase_price = item_amount_on_stock / item_quantity_on_stock
+
+            if vat_included:
+                net_selling_price = selling_price / (1 + (vat_rate / 100))
+                gross_selling_price = selling_price
+            else:
+                net_selling_price = selling_price
+                gross_selling_price = net_selling_price * (1 + (vat_rate / 100))
+
+            vat_amount_per_unit = gross_selling_price - net_selling_price
+            invoice_record_amount_net = quantity * net_selling_price
+            invoice_record_vat = invoice_record_amount_net * (vat_rate / 100)
+            invoice_record_amount_total = invoice_record_amount_net + invoice_record_vat
+
+            invoice_records.append({
+                "item_id": item_id,
+                "quantity": quantity,
+                "net_selling_price": net_selling_price,
+                "invoice_record_amount_net": invoice_record_amount_net,
+                "invoice_record_vat": invoice_record_vat,
+                "invoice_record_amount_total": invoice_record_amount_total,
+                "invoice_id": invoice_id,
+                "average_purchase_price": average_purchase_price,
+                "vat_amount_per_unit": vat_amount_per_unit,
+                "gross_selling_price": gross_selling_price
+            })
 
-        vat_amount_per_unit = gross_selling_price - net_selling_price        
-        invoice_record_amount_net = quantity * net_selling_price
-        invoice_record_vat = invoice_record_amount_net * (vat_rate / 100)
-        invoice_record_amount_total = invoice_record_amount_net + invoice_record_vat
+            item_quantities[item_id] = item_quantities.get(item_id, 0) + quantity
+            item_latest_prices[item_id] = net_selling_price
 
-        db.execute("""INSERT INTO invoice_records (
+        # Insert all invoice records and update the items in one transaction
+        db.executemany("""INSERT INTO invoice_records (
             item_id,
             quantity,
             net_selling_price,
@@ -1143,47 +1399,70 @@ def invoice_records():
             :average_purchase_price,
             :vat_amount_per_unit,
             :gross_selling_price
-            )""", {
-                "item_id": item_id,
-                "quantity": quantity,
-                "net_selling_price": net_selling_price,
-                "invoice_record_amount_net": invoice_record_amount_net,
-                "invoice_record_vat": invoice_record_vat,
-                "invoice_record_amount_total": invoice_record_amount_total,
-                "invoice_id": invoice_id,
-                "average_purchase_price": average_purchase_price,
-                "vat_amount_per_unit": vat_amount_per_unit,
-                "gross_selling_price": gross_selling_price
-            })
-        conn.commit()
+            )""", invoice_records)
 
-        item_quantity = check_item[5] - quantity
+        # Sold quantity leaves the stock at its average purchase price, once per item
+        for item_id, quantity in item_quantities.items():
+            item_quantity_on_stock, item_amount_on_stock = stock[item_id]
+            record_stock_movement(db, item_id, invoice_date, -quantity, -quantity * item_amount_on_stock / item_quantity_on_stock)
 
-        item_total_sales = db.execute("""SELECT SUM(invoice_record_amount_net), SUM(quantity)
+        # Update item information regarding quantity and prices, once per item
+        placeholders, params = in_clause("item_id", list(item_quantities))
+        item_totals = db.execute(f"""SELECT item_id, SUM(invoice_record_amount_net), SUM(quantity)
         FROM invoice_records
-        WHERE item_id = :item_id""", {
-            "item_id": item_id
-        }).fetchone()
-
-        item_total_selling_value = item_total_sales[0]
-        item_total_selling_quantity = item_total_sales[1]
-        average_net_selling_price = item_total_selling_value / item_total_selling_quantity
+        WHERE item_id IN ({placeholders})
+        GROUP BY item_id""", params).fetchall()
+
+        item_updates = []
+        for item_id, item_total_selling_value, item_total_selling_quantity in item_totals:
+            item_updates.append({
+                "item_quantity": items_found[item_id][1] - item_quantities[item_id],
+                "latest_net_selling_price": item_latest_prices[item_id],
+                "average_net_selling_price": item_total_selling_value / item_total_selling_quantity,
+                "item_id": item_id
+            })
 
-        # Update item information regarding quantity and prices
-        db.execute("""UPDATE items SET
+        db.executemany("""UPDATE items SET
         item_quantity = :item_quantity,
         latest_net_selling_price = :latest_net_selling_price,
         average_net_selling_price = :average_net_selling_price
         WHERE
-        item_id = :item_id""", {
-            "item_quantity": item_quantity,
-            "latest_net_selling_price": net_selling_price,
-            "average_net_selling_price": average_net_selling_price,
-            "item_id": item_id
-        })
-        conn.commit()
-
-        return jsonify({"success": True, "message": "Invoice record successfully added to database"})
+        item_id = :item_id""", item_updates)
+        bump_table_version(db, "invoice_records")
+        bump_table_version(db, "items")
+
+        if failed:
+            return {"success": True, "message": f"{len(invoice_records)} of {len(lines)} invoice records successfully added to database", "results": results}
+
+        return {"success": True, "message": f"{len(invoice_records)} invoice records successfully added to database", "results": results}
+
+    return jsonify(get_writer().run(add_invoice_records))
+
+
+@app.route("/reports/valuation")
+def valuation_report():
+    """Display the quantity on hand, average purchase price and stock value of every item at the end of a date
+    ("as_of" parameter in the format yyyy-mm-dd, default: today), computed from the bill records and invoice records"""
+
+    # Connect to database
+    conn = db_connection()
+    db = conn.cursor()
+
+    try:
+        as_of = date.fromisoformat(request.args.get("as_of", date.today().isoformat()))
+    except ValueError:
+        return jsonify({"success": False, "message": "'as_of' must be a date in the format yyyy-mm-dd"})
+
+    # If streaming is requested, send the items while they are read from the database
+    if stream_format(request) == "ndjson":
+        inventory_valuation(db, as_of.isoformat())
+        return Response(stream_with_context(ndjson_stream(db)), mimetype="application/x-ndjson")
+
+    # The total value is summed by the query (the last column of every row), and the items are encoded without it
+    rows = inventory_valuation(db, as_of.isoformat(), with_total=True).fetchall()
+    total_value = rows[0][6] if rows else 0
+
+    return list_response({"success": True, "as_of": as_of.isoformat(), "total_value": total_value}, "items", db, rows, keys=VALUATION_COLUMNS)
 
 
 if __name__=="__main__":
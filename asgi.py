@@ -0,0 +1,155 @@
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+from database import get_pool, get_writer
+
+# Request bodies larger than this are spooled to a temporary file instead of being kept in memory
+MAX_BODY_IN_MEMORY = 1024 * 1024
+
+
+class AsgiAdapter:
+    """Serve the Flask application over ASGI.
+
+    The event loop of the ASGI server holds the client connections (including idle keep-alive connections
+    and slow clients), and only the work that needs the database runs on a bounded thread pool:
+    the view function itself, and every chunk of a streamed response. A slow client therefore never
+    holds a worker thread while it is reading the response, and the number of threads that use
+    the database at the same time never exceeds max_workers (by default, the size of the connection pool).
+    The same views run as in the WSGI mode, so the endpoints and the JSON responses are identical"""
+
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        """Answer the startup and shutdown events of the ASGI server"""
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                get_writer(self.wsgi_app).close()
+                get_pool(self.wsgi_app).close_all()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        """Run one HTTP request through the Flask application"""
+
+        loop = asyncio.get_running_loop()
+        body = await self.read_body(receive)
+        environ = self.build_environ(scope, body)
+
+        # The view and all chunks of its response run in the same context (one after another, possibly in different threads),
+        # so the Flask request context stays available for streamed responses
+        context = contextvars.copy_context()
+
+        def run(function, *args):
+            return loop.run_in_executor(self.executor, context.run, function, *args)
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start["status"] = int(status.split(" ", 1)[0])
+            response_start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        try:
+            iterable = await run(self.wsgi_app, environ, start_response)
+        finally:
+            body.close()
+
+        try:
+            await send({"type": "http.response.start", "status": response_start["status"], "headers": response_start["headers"]})
+
+            iterator = iter(iterable)
+            while True:
+                chunk = await run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            # Closing the response ends the request, which gives the database connection back to the pool
+            if hasattr(iterable, "close"):
+                await run(iterable.close)
+
+    async def read_body(self, receive):
+        """Read the request body without blocking the event loop"""
+
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_BODY_IN_MEMORY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        body.seek(0)
+        return body
+
+    def build_environ(self, scope, body):
+        """Build the WSGI environ of an ASGI HTTP request"""
+
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False
+        }
+
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ["CONTENT_TYPE"] = value
+            elif name == "CONTENT_LENGTH":
+                environ["CONTENT_LENGTH"] = value
+            else:
+                key = f"HTTP_{name}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+        # The whole body has already been read, so its size is the content length, also for a body that was sent with
+        # "Transfer-Encoding: chunked" (without a Content-Length header), and the input ends with the body
+        body.seek(0, os.SEEK_END)
+        environ["CONTENT_LENGTH"] = str(body.tell())
+        body.seek(0)
+        environ["wsgi.input_terminated"] = True
+
+        return environ
+
+
+# The number of threads that run views defaults to the size of the database connection pool
+application = AsgiAdapter(app, max_workers=int(os.environ.get("ASGI_WORKERS", app.config["DB_POOL_SIZE"])))
@@ -0,0 +1,84 @@
+"""Measure what response compression costs and saves for every compression level (COMPRESSION_LEVEL).
+
+A database is generated (see generate_dataset.py), and the full lists of bill records and invoice records
+are requested through Flask's test client, without compression and with gzip at every level. For every level,
+the size of the response, the compression ratio and the time of one request are printed, together with the time
+that sending the response would take over a slow link (--link-mbit), so the CPU cost can be compared with the
+bandwidth it saves.
+
+Usage:
+
+    python benchmarks/compression.py
+    python benchmarks/compression.py --bills 20000 --levels 1,6,9 --link-mbit 10"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from generate_dataset import generate
+
+PATHS = ["/bill_records", "/invoice_records", "/invoice_records?stream=1"]
+
+
+def measure(client, path, headers, number):
+    """Return (response size in bytes, average time of one request in milliseconds)"""
+
+    size = 0
+    started = time.perf_counter()
+    for i in range(number):
+        size = len(client.get(path, headers=headers).get_data())
+    return size, (time.perf_counter() - started) / number * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the response size and time of every compression level")
+    parser.add_argument("--bills", type=int, default=5000, help="number of bills of the generated database (default: 5000)")
+    parser.add_argument("--levels", default="1,3,6,9", help="comma-separated compression levels (default: 1,3,6,9)")
+    parser.add_argument("--number", type=int, default=5, help="number of requests per measurement (default: 5)")
+    parser.add_argument("--link-mbit", type=float, default=20, help="speed of the slow link in Mbit/s (default: 20)")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.levels.split(",")]
+    folder = tempfile.mkdtemp(prefix="compression-")
+
+    try:
+        database = os.path.join(folder, "compression.sqlite3")
+        print("Generating the database...")
+        generate(database, partners=50, items=500, bills=args.bills, invoices=args.bills, start=date(2020, 1, 1), days=730)
+
+        # The application reads its settings when it is imported
+        os.environ["DATABASE"] = database
+        os.environ["METRICS_ENABLED"] = "0"
+        sys.path.insert(0, REPO_DIR)
+        from app import app
+
+        client = app.test_client()
+        bytes_per_ms = args.link_mbit * 1000 / 8
+
+        print(f"{'request':<26} {'encoding':>9} {'bytes':>11} {'ratio':>7} {'server ms':>10} {'link ms':>9}")
+        for path in PATHS:
+            size, elapsed = measure(client, path, {}, args.number)
+            print(f"{path:<26} {'identity':>9} {size:>11} {1:>7.1f} {elapsed:>10.1f} {size / bytes_per_ms:>9.0f}")
+            plain_size = size
+
+            for level in levels:
+                app.config["COMPRESSION_LEVEL"] = level
+                size, elapsed = measure(client, path, {"Accept-Encoding": "gzip"}, args.number)
+                print(f"{path:<26} {'gzip-' + str(level):>9} {size:>11} {plain_size / size:>7.1f} {elapsed:>10.1f} {size / bytes_per_ms:>9.0f}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
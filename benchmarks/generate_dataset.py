@@ -0,0 +1,335 @@
+"""Generate a synthetic database for benchmarks, at a configurable scale.
+
+The database has the schema of the migrations (see migrations.py) and consistent data:
+every bill and invoice belongs to an existing partner, every record to an existing item and document,
+invoices never sell more than is on stock on their date, the items hold their quantities and average prices,
+and the stock ledger and the invoice number sequence are filled in.
+
+Dates are spread over the provided number of days, with less traffic on weekends and a steady growth over time,
+and some items are bought and sold much more often than others.
+
+Usage:
+
+    python benchmarks/generate_dataset.py bench.sqlite3 --partners 1000 --items 20000 --bills 200000 --invoices 300000
+    python benchmarks/generate_dataset.py bench.sqlite3 --bills 1000000 --lines-per-bill 5 --invoices 1500000 --lines-per-invoice 3 --force"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import bump_table_version
+from migrations import migrate
+from stock_ledger import rebuild_stock_ledger
+
+# Number of rows kept in memory before they are inserted with executemany
+CHUNK_SIZE = 50000
+
+VAT_RATES = [0, 5, 10, 18, 25]
+
+UNITS_OF_MEASURE = [("pcs", "pieces"), ("kg", "kilograms"), ("l", "liters"), ("m", "meters"), ("box", "boxes")]
+
+# Relative traffic on each day of the week (Monday first)
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 0.9, 0.3, 0.1]
+
+
+def daily_counts(rng, total, start, days):
+    """Split a total number of documents over the days, by weekday and with traffic doubling from the first to the last day"""
+
+    weights = []
+    for day_index in range(days):
+        day = start + timedelta(days=day_index)
+        weights.append(WEEKDAY_WEIGHTS[day.weekday()] * (1 + day_index / max(days - 1, 1)))
+
+    total_weight = sum(weights)
+    counts = [int(total * weight / total_weight) for weight in weights]
+
+    # Rounding down leaves a few documents, which go to random days (weighted the same way)
+    for day_index in rng.choices(range(days), weights=weights, k=total - sum(counts)):
+        counts[day_index] += 1
+
+    return counts
+
+
+def popularity_weights(count, exponent=0.8):
+    """Cumulative weights that make the first ids much more popular than the last ones (a Zipf-like distribution)"""
+
+    cum_weights = []
+    total = 0
+    for rank in range(1, count + 1):
+        total += 1 / rank ** exponent
+        cum_weights.append(total)
+
+    return cum_weights
+
+
+class BulkWriter:
+    """Collect the rows of each table and insert them with executemany, one chunk per transaction"""
+
+    def __init__(self, conn, chunk_size=CHUNK_SIZE):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.queries = {}
+        self.rows = {}
+        self.counts = {}
+
+    def add_table(self, table_name, query):
+        self.queries[table_name] = query
+        self.rows[table_name] = []
+        self.counts[table_name] = 0
+
+    def add(self, table_name, row):
+        self.rows[table_name].append(row)
+        if len(self.rows[table_name]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        for table_name, rows in self.rows.items():
+            if rows:
+                self.conn.executemany(self.queries[table_name], rows)
+                self.counts[table_name] += len(rows)
+                self.rows[table_name] = []
+        self.conn.commit()
+
+
+def generate(database, partners=100, items=1000, bills=2000, lines_per_bill=5, invoices=3000, lines_per_invoice=3,
+             start=date(2020, 1, 1), days=730, seed=1, chunk_size=CHUNK_SIZE):
+    """Create and fill a new database. Return the number of rows of every table"""
+
+    rng = random.Random(seed)
+    migrate(database)
+
+    conn = sqlite3.connect(database)
+
+    # The database is generated from scratch, so durability while generating it does not matter
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.execute("PRAGMA cache_size = -200000")
+
+    writer = BulkWriter(conn, chunk_size)
+    writer.add_table("vat_rates", "INSERT INTO vat_rates (vat_rate_id, vat_rate) VALUES (:vat_rate_id, :vat_rate)")
+    writer.add_table("units_of_measure", """INSERT INTO units_of_measure (unit_id, unit_acronym, unit_name)
+        VALUES (:unit_id, :unit_acronym, :unit_name)""")
+    writer.add_table("partners", """INSERT INTO partners (partner_id, partner_name, partner_address, partner_manager_first_name, partner_manager_last_name)
+        VALUES (:partner_id, :partner_name, :partner_address, :partner_manager_first_name, :partner_manager_last_name)""")
+    writer.add_table("items", """INSERT INTO items (item_id, item_code, item_description, unit_id, vat_rate_id,
+        item_quantity, latest_purchase_price, average_purchase_price, latest_net_selling_price, average_net_selling_price)
+        VALUES (:item_id, :item_code, :item_description, :unit_id, :vat_rate_id,
+        :item_quantity, :latest_purchase_price, :average_purchase_price, :latest_net_selling_price, :average_net_selling_price)""")
+    writer.add_table("bills", """INSERT INTO bills (bill_id, bill_number, bill_date, bill_due_date, bill_amount, partner_id)
+        VALUES (:bill_id, :bill_number, :bill_date, :bill_due_date, :bill_amount, :partner_id)""")
+    writer.add_table("bill_records", """INSERT INTO bill_records (item_id, quantity, price, bill_record_amount_net, bill_record_vat, bill_record_amount_total, bill_id)
+        VALUES (:item_id, :quantity, :price, :bill_record_amount_net, :bill_record_vat, :bill_record_amount_total, :bill_id)""")
+    writer.add_table("invoices", """INSERT INTO invoices (invoice_id, invoice_number, invoice_date, invoice_due_date,
+        invoice_amount_net, invoice_vat, invoice_amount_total, partner_id)
+        VALUES (:invoice_id, :invoice_number, :invoice_date, :invoice_due_date,
+        :invoice_amount_net, :invoice_vat, :invoice_amount_total, :partner_id)""")
+    writer.add_table("invoice_records", """INSERT INTO invoice_records (item_id, quantity, net_selling_price, invoice_record_amount_net,
+        invoice_record_vat, invoice_record_amount_total, invoice_id, average_purchase_price, vat_amount_per_unit, gross_selling_price)
+        VALUES (:item_id, :quantity, :net_selling_price, :invoice_record_amount_net,
+        :invoice_record_vat, :invoice_record_amount_total, :invoice_id, :average_purchase_price, :vat_amount_per_unit, :gross_selling_price)""")
+
+    # Reference data
+    for vat_rate_id, vat_rate in enumerate(VAT_RATES, start=1):
+        writer.add("vat_rates", {"vat_rate_id": vat_rate_id, "vat_rate": vat_rate})
+    for unit_id, (unit_acronym, unit_name) in enumerate(UNITS_OF_MEASURE, start=1):
+        writer.add("units_of_measure", {"unit_id": unit_id, "unit_acronym": unit_acronym, "unit_name": unit_name})
+
+    for partner_id in range(1, partners + 1):
+        writer.add("partners", {
+            "partner_id": partner_id,
+            "partner_name": f"Partner {partner_id:07d}",
+            "partner_address": f"Street {rng.randint(1, 500)}, City {rng.randint(1, 100)}",
+            "partner_manager_first_name": f"First{rng.randint(1, 1000)}",
+            "partner_manager_last_name": f"Last{rng.randint(1, 1000)}"
+        })
+
+    # The items are written at the end, with their quantities and average prices.
+    # Until then, the stock and the totals of every item are kept in lists indexed by item_id
+    item_vat_rates = [0] + [VAT_RATES[rng.randrange(len(VAT_RATES))] for _ in range(items)]
+    item_base_prices = [0] + [round(rng.uniform(0.5, 500), 2) for _ in range(items)]
+    stock_quantity = [0] * (items + 1)
+    stock_value = [0.0] * (items + 1)
+    purchase_quantity = [0] * (items + 1)
+    purchase_value = [0.0] * (items + 1)
+    latest_purchase_price = [0] * (items + 1)
+    sales_quantity = [0] * (items + 1)
+    sales_value = [0.0] * (items + 1)
+    latest_selling_price = [0] * (items + 1)
+
+    item_ids = range(1, items + 1)
+    item_cum_weights = popularity_weights(items)
+    partner_ids = range(1, partners + 1)
+    partner_cum_weights = popularity_weights(partners, exponent=0.5)
+
+    bill_counts = daily_counts(rng, bills, start, days)
+    invoice_counts = daily_counts(rng, invoices, start, days)
+    bill_id = 0
+    invoice_id = 0
+
+    for day_index in range(days):
+        day = start + timedelta(days=day_index)
+        document_date = day.isoformat()
+        due_date = (day + timedelta(days=30)).isoformat()
+
+        # Purchases of the day
+        for partner_id in rng.choices(partner_ids, cum_weights=partner_cum_weights, k=bill_counts[day_index]):
+            bill_id += 1
+            bill_amount = 0
+
+            for item_id in rng.choices(item_ids, cum_weights=item_cum_weights, k=rng.randint(1, 2 * lines_per_bill - 1)):
+                quantity = rng.randint(1, 100)
+                price = round(item_base_prices[item_id] * rng.uniform(0.9, 1.1), 2)
+                vat_rate = item_vat_rates[item_id]
+                bill_record_amount_net = quantity * price
+                bill_record_vat = bill_record_amount_net * (vat_rate / 100)
+                bill_record_amount_total = bill_record_amount_net + bill_record_vat
+                bill_amount += bill_record_amount_total
+
+                writer.add("bill_records", {
+                    "item_id": item_id,
+                    "quantity": quantity,
+                    "price": price,
+                    "bill_record_amount_net": bill_record_amount_net,
+                    "bill_record_vat": bill_record_vat,
+                    "bill_record_amount_total": bill_record_amount_total,
+                    "bill_id": bill_id
+                })
+
+                stock_quantity[item_id] += quantity
+                stock_value[item_id] += bill_record_amount_net
+                purchase_quantity[item_id] += quantity
+                purchase_value[item_id] += bill_record_amount_net
+                latest_purchase_price[item_id] = price
+
+            writer.add("bills", {
+                "bill_id": bill_id,
+                "bill_number": f"B-{bill_id:08d}",
+                "bill_date": document_date,
+                "bill_due_date": due_date,
+                "bill_amount": round(bill_amount),
+                "partner_id": partner_id
+            })
+
+        # Sales of the day. Only items that are on stock are sold, at their average purchase price plus a margin
+        for partner_id in rng.choices(partner_ids, cum_weights=partner_cum_weights, k=invoice_counts[day_index]):
+            invoice_id += 1
+
+            for item_id in rng.choices(item_ids, cum_weights=item_cum_weights, k=rng.randint(1, 2 * lines_per_invoice - 1)):
+                if stock_quantity[item_id] <= 0:
+                    continue
+
+                quantity = rng.randint(1, min(20, stock_quantity[item_id]))
+                average_purchase_price = stock_value[item_id] / stock_quantity[item_id]
+                net_selling_price = round(average_purchase_price * rng.uniform(1.1, 1.5), 2)
+                vat_rate = item_vat_rates[item_id]
+                gross_selling_price = net_selling_price * (1 + (vat_rate / 100))
+                invoice_record_amount_net = quantity * net_selling_price
+                invoice_record_vat = invoice_record_amount_net * (vat_rate / 100)
+
+                writer.add("invoice_records", {
+                    "item_id": item_id,
+                    "quantity": quantity,
+                    "net_selling_price": net_selling_price,
+                    "invoice_record_amount_net": invoice_record_amount_net,
+                    "invoice_record_vat": invoice_record_vat,
+                    "invoice_record_amount_total": invoice_record_amount_net + invoice_record_vat,
+                    "invoice_id": invoice_id,
+                    "average_purchase_price": average_purchase_price,
+                    "vat_amount_per_unit": gross_selling_price - net_selling_price,
+                    "gross_selling_price": gross_selling_price
+                })
+
+                stock_quantity[item_id] -= quantity
+                stock_value[item_id] -= quantity * average_purchase_price
+                sales_quantity[item_id] += quantity
+                sales_value[item_id] += invoice_record_amount_net
+                latest_selling_price[item_id] = net_selling_price
+
+            # Like the invoices added through the API, the invoice totals are 0
+            writer.add("invoices", {
+                "invoice_id": invoice_id,
+                "invoice_number": f"{invoice_id:05d}",
+                "invoice_date": document_date,
+                "invoice_due_date": due_date,
+                "invoice_amount_net": 0,
+                "invoice_vat": 0,
+                "invoice_amount_total": 0,
+                "partner_id": partner_id
+            })
+
+    for item_id in item_ids:
+        writer.add("items", {
+            "item_id": item_id,
+            "item_code": f"ITEM{item_id:07d}",
+            "item_description": f"Item {item_id:07d}",
+            "unit_id": rng.randint(1, len(UNITS_OF_MEASURE)),
+            "vat_rate_id": VAT_RATES.index(item_vat_rates[item_id]) + 1,
+            "item_quantity": stock_quantity[item_id],
+            "latest_purchase_price": latest_purchase_price[item_id],
+            "average_purchase_price": purchase_value[item_id] / purchase_quantity[item_id] if purchase_quantity[item_id] else 0,
+            "latest_net_selling_price": latest_selling_price[item_id],
+            "average_net_selling_price": sales_value[item_id] / sales_quantity[item_id] if sales_quantity[item_id] else 0
+        })
+
+    writer.flush()
+
+    # Derived data: the stock ledger, the invoice number sequence and the change versions of the tables
+    rebuild_stock_ledger(conn)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO sequences (sequence_name, last_value) VALUES ('invoices:', :last_value)", {"last_value": invoice_id})
+        for table_name in writer.counts:
+            bump_table_version(conn, table_name)
+
+    counts = dict(writer.counts)
+    counts["stock_ledger"] = conn.execute("SELECT COUNT(*) FROM stock_ledger").fetchone()[0]
+    conn.close()
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic database for benchmarks")
+    parser.add_argument("database", help="path of the database to create")
+    parser.add_argument("--partners", type=int, default=100)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--bills", type=int, default=2000)
+    parser.add_argument("--lines-per-bill", type=int, default=5, help="average number of records per bill (default: 5)")
+    parser.add_argument("--invoices", type=int, default=3000)
+    parser.add_argument("--lines-per-invoice", type=int, default=3, help="average number of records per invoice (default: 3)")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2020, 1, 1), help="first date, yyyy-mm-dd (default: 2020-01-01)")
+    parser.add_argument("--days", type=int, default=730, help="number of days with bills and invoices (default: 730)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed; the same seed generates the same data (default: 1)")
+    parser.add_argument("--force", action="store_true", help="replace the database if it exists")
+    args = parser.parse_args(argv)
+
+    if min(args.partners, args.items, args.lines_per_bill, args.lines_per_invoice, args.days) < 1 or min(args.bills, args.invoices) < 0:
+        print("The numbers of partners, items, lines and days must be at least 1")
+        return 2
+
+    if os.path.exists(args.database):
+        if not args.force:
+            print(f"{args.database} already exists (use --force to replace it)")
+            return 2
+        os.remove(args.database)
+
+    started = time.perf_counter()
+    counts = generate(args.database, args.partners, args.items, args.bills, args.lines_per_bill, args.invoices,
+                      args.lines_per_invoice, args.start, args.days, args.seed)
+    duration = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for table_name, count in counts.items():
+        print(f"{table_name:<20} {count:>12}")
+    print(f"{total} rows written to {args.database} in {duration:.1f} s ({total / duration:.0f} rows/s)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""Replay a JSONL request log against the application and report the throughput and latency per route.
+
+Every line of the log is one request:
+
+    {"method": "POST", "path": "/bill_records", "form": {"item_id": 1, "quantity": 2, "price": 3.5, "bill_id": 1}}
+    {"method": "GET", "path": "/bills", "params": {"limit": 100}, "headers": {"Accept": "application/json"}}
+    {"method": "POST", "path": "/invoice_records/batch", "json": {"invoice_id": 1, "invoice_records": []}}
+
+Usage:
+
+    python benchmarks/replay.py benchmarks/sample_requests.jsonl --database bench.sqlite3 --concurrency 4
+    python benchmarks/replay.py requests.jsonl --url http://127.0.0.1:5000 --concurrency 32 --output results.json
+    python benchmarks/replay.py requests.jsonl --url http://127.0.0.1:5000 --compare baseline.json
+
+Without --url, the requests run in-process through Flask's test client (against --database).
+With --compare, the command fails (exit code 1) if the p95 latency of a route is worse than in the
+baseline results file by more than --threshold (default: 20%)."""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_log(path):
+    """Read the requests of a JSONL log. Lines that are not requests are skipped"""
+
+    requests = []
+    skipped = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or "path" not in entry:
+                skipped += 1
+                continue
+            entry.setdefault("method", "GET")
+            requests.append(entry)
+
+    return requests, skipped
+
+
+def route_name(entry):
+    """Group requests by method and path, with the ids in the path replaced, e.g. "GET /item/<id>\""""
+
+    return f"{entry['method'].upper()} {re.sub(r'/[0-9]+', '/<id>', entry['path'])}"
+
+
+def encode_body(entry):
+    """Return the body and the content type of a request"""
+
+    if "json" in entry:
+        return json.dumps(entry["json"]).encode(), "application/json"
+    if "form" in entry:
+        return urlencode(entry["form"]).encode(), "application/x-www-form-urlencoded"
+    if "body" in entry:
+        return entry["body"].encode(), entry.get("content_type", "application/octet-stream")
+    return None, None
+
+
+def full_path(entry):
+    """Return the path of a request with its query string"""
+
+    if entry.get("params"):
+        return f"{entry['path']}?{urlencode(entry['params'])}"
+    return entry["path"]
+
+
+class InProcessClient:
+    """Send the requests through Flask's test client (one client per thread)"""
+
+    def __init__(self, database):
+        os.environ["DATABASE"] = database
+        sys.path.insert(0, REPO_DIR)
+        from app import app
+
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, entry):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client()
+
+        body, content_type = encode_body(entry)
+        headers = dict(entry.get("headers", {}))
+        if content_type:
+            headers["Content-Type"] = content_type
+
+        response = self.local.client.open(full_path(entry), method=entry["method"].upper(), data=body, headers=headers)
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient:
+    """Send the requests to a running server over HTTP (one keep-alive connection per thread)"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.local = threading.local()
+
+    def send(self, entry):
+        if not hasattr(self.local, "connection"):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+        body, content_type = encode_body(entry)
+        headers = dict(entry.get("headers", {}))
+        if content_type:
+            headers["Content-Type"] = content_type
+
+        try:
+            self.local.connection.request(entry["method"].upper(), full_path(entry), body=body, headers=headers)
+            response = self.local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # Reconnect on the next request
+            self.local.connection.close()
+            del self.local.connection
+            raise
+
+        return response.status
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of a sorted list"""
+
+    if not sorted_values:
+        return 0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, duration):
+    """Compute the count, throughput and latency percentiles (in milliseconds) of one route"""
+
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / duration, 2) if duration else 0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0
+    }
+
+
+def replay(client, requests, concurrency, repeat=1):
+    """Send all requests (repeat times) with the provided number of concurrent workers.
+    Return (latencies per route, errors per route, duration in seconds)"""
+
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def run(entry):
+        route = route_name(entry)
+        started = time.perf_counter()
+        try:
+            status = client.send(entry)
+            failed = status >= 500
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+
+        with lock:
+            latencies.setdefault(route, []).append(elapsed)
+            if failed:
+                errors[route] = errors.get(route, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(repeat):
+            # Consume the results, so that exceptions are not silently lost
+            list(executor.map(run, requests))
+    duration = time.perf_counter() - started
+
+    return latencies, errors, duration
+
+
+def git_commit():
+    """Return the current git commit of the repository, if there is one"""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Return the routes whose p95 latency is worse than in the baseline by more than the threshold"""
+
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if previous is None or not previous["p95_ms"]:
+            continue
+        change = (current["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+        if change > threshold:
+            regressions.append((route, previous["p95_ms"], current["p95_ms"], change))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a JSONL request log and report throughput and latency per route")
+    parser.add_argument("log", help="JSONL file with one request per line")
+    parser.add_argument("--url", help="base URL of a running server (default: in-process through Flask's test client)")
+    parser.add_argument("--database", default="database.sqlite3", help="database used in-process (default: database.sqlite3)")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of concurrent workers (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="how many times the log is replayed (default: 1)")
+    parser.add_argument("--warmup", type=int, default=0, help="number of requests sent before measuring (default: 0)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results file of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 regression when comparing (default: 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    requests, skipped = load_log(args.log)
+    if not requests:
+        print(f"No requests found in {args.log}")
+        return 2
+
+    client = HttpClient(args.url) if args.url else InProcessClient(args.database)
+
+    if args.warmup:
+        replay(client, requests[:args.warmup], args.concurrency)
+
+    latencies, errors, duration = replay(client, requests, args.concurrency, args.repeat)
+    total = sum(len(values) for values in latencies.values())
+
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "mode": "http" if args.url else "in-process",
+        "concurrency": args.concurrency,
+        "requests": total,
+        "skipped_lines": skipped,
+        "duration_s": round(duration, 3),
+        "throughput": round(total / duration, 2) if duration else 0,
+        "routes": {route: summarize(values, errors.get(route, 0), duration) for route, values in sorted(latencies.items())}
+    }
+
+    print(f"{total} requests in {duration:.2f} s ({results['throughput']} requests/s, concurrency {args.concurrency})")
+    print(f"{'route':<40} {'count':>7} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, summary in results["routes"].items():
+        print(f"{route:<40} {summary['count']:>7} {summary['errors']:>7} {summary['throughput']:>9} "
+              f"{summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for route, previous, current, change in regressions:
+            print(f"Regression in {route}: p95 {previous} ms -> {current} ms (+{change:.0%})")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
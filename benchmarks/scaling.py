@@ -0,0 +1,144 @@
+"""Measure how the latency of the endpoints grows with the size of the data.
+
+For every scale (a number of bills; the numbers of partners, items and invoices grow with it),
+a synthetic database is generated (see generate_dataset.py) and a request log that touches every endpoint
+is replayed against it in-process (see replay.py). The p50 and p95 latencies of every route are printed side by side,
+with the growth factor from the smallest to the largest scale, and all results are written as JSON.
+
+Usage:
+
+    python benchmarks/scaling.py --scales 1000,10000,100000 --repeat 20 --output scaling.json
+    python benchmarks/scaling.py --scales 1000,100000,1000000 --keep bench_data"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from generate_dataset import generate
+
+START = date(2020, 1, 1)
+DAYS = 730
+
+
+def dataset_size(scale):
+    """Return the generator settings of a scale (the number of bills)"""
+
+    return {
+        "partners": max(10, scale // 20),
+        "items": max(20, scale // 10),
+        "bills": scale,
+        "invoices": scale * 3 // 2
+    }
+
+
+def request_log(database, count, seed=1):
+    """Build a request log (a list of requests) with read requests for every endpoint, on random existing ids and dates"""
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    max_partner_id = conn.execute("SELECT MAX(partner_id) FROM partners").fetchone()[0]
+    max_item_id = conn.execute("SELECT MAX(item_id) FROM items").fetchone()[0]
+    conn.close()
+
+    def random_date():
+        return (START + timedelta(days=rng.randrange(DAYS))).isoformat()
+
+    requests = []
+    for _ in range(count):
+        item_id = rng.randint(1, max_item_id)
+        date_from = date.fromisoformat(random_date())
+        requests += [
+            {"method": "GET", "path": "/partners", "params": {"limit": 100}},
+            {"method": "GET", "path": f"/partner/{rng.randint(1, max_partner_id)}"},
+            {"method": "GET", "path": "/items", "params": {"limit": 100}},
+            {"method": "GET", "path": f"/item/{item_id}"},
+            {"method": "GET", "path": f"/item/{item_id}/stock", "params": {"as_of": random_date()}},
+            {"method": "GET", "path": f"/item/{item_id}/stock", "params": {"from": date_from.isoformat(), "to": (date_from + timedelta(days=30)).isoformat()}},
+            {"method": "GET", "path": "/vat_rates"},
+            {"method": "GET", "path": "/units_of_measure"},
+            {"method": "GET", "path": "/bills", "params": {"limit": 100}},
+            {"method": "GET", "path": "/bill_records", "params": {"limit": 100}},
+            {"method": "GET", "path": "/invoices", "params": {"limit": 100}},
+            {"method": "GET", "path": "/invoice_records", "params": {"limit": 100}}
+        ]
+
+    # The valuation report reads all items, so it runs fewer times
+    for _ in range(max(1, count // 10)):
+        requests.append({"method": "GET", "path": "/reports/valuation", "params": {"as_of": random_date()}})
+
+    rng.shuffle(requests)
+    return requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the latency of every endpoint at growing data sizes")
+    parser.add_argument("--scales", default="1000,10000,100000", help="comma-separated numbers of bills (default: 1000,10000,100000)")
+    parser.add_argument("--requests", type=int, default=20, help="number of requests per route and scale (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of concurrent workers (default: 1)")
+    parser.add_argument("--output", help="write the results of all scales as JSON to this file")
+    parser.add_argument("--keep", help="keep the generated databases in this folder (and reuse them on the next run)")
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    folder = args.keep or tempfile.mkdtemp(prefix="scaling-")
+    os.makedirs(folder, exist_ok=True)
+
+    results = {}
+    try:
+        for scale in scales:
+            database = os.path.join(folder, f"scale_{scale}.sqlite3")
+            if not os.path.exists(database):
+                print(f"Generating the database for scale {scale}...")
+                generate(database, start=START, days=DAYS, **dataset_size(scale))
+
+            log_path = os.path.join(folder, f"scale_{scale}.jsonl")
+            with open(log_path, "w", encoding="utf-8") as f:
+                for entry in request_log(database, args.requests):
+                    f.write(json.dumps(entry) + "\n")
+
+            # Every scale runs in its own process, because the application opens its database when it is imported
+            results_path = os.path.join(folder, f"scale_{scale}.json")
+            subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, "replay.py"), log_path,
+                            "--database", database, "--concurrency", str(args.concurrency), "--warmup", "20",
+                            "--output", results_path], check=True, stdout=subprocess.DEVNULL)
+
+            with open(results_path, encoding="utf-8") as f:
+                results[scale] = json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    routes = sorted({route for result in results.values() for route in result["routes"]})
+    header = " ".join(f"{f'p50/p95 ms @{scale}':>24}" for scale in scales)
+    print(f"{'route':<32} {header} {'p95 growth':>11}")
+    for route in routes:
+        cells = []
+        for scale in scales:
+            summary = results[scale]["routes"].get(route)
+            cells.append(f"{summary['p50_ms']:>11} / {summary['p95_ms']:<10}" if summary else f"{'-':>24}")
+
+        first = results[scales[0]]["routes"].get(route)
+        last = results[scales[-1]]["routes"].get(route)
+        growth = f"{last['p95_ms'] / first['p95_ms']:.1f}x" if first and last and first["p95_ms"] else "-"
+        print(f"{route:<32} {' '.join(cells)} {growth:>11}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"scales": {scale: {"dataset": dataset_size(scale), "results": results[scale]} for scale in scales}}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
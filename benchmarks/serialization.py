@@ -0,0 +1,148 @@
+"""Measure the cost of turning the rows of a list endpoint into the JSON response: the shared serialization
+layer (serialization.py) against the way the list endpoints built their responses before it (copied below):
+one dictionary per row, filled field by field, and jsonify.
+
+The rows are read from an in-memory SQLite table with the columns of the invoice records (mostly numbers)
+and of the partners (mostly text). The serialization layer is measured with the json module of the standard
+library, and with orjson if it is installed. All of them must produce the same JSON document.
+
+Usage:
+
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --rows 100000 --number 3"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_DIR)
+
+from flask import Flask, jsonify
+
+import serialization
+from serialization import list_response
+
+INVOICE_RECORD_KEYS = ["invoice_record_id", "item_id", "quantity", "net_selling_price", "invoice_record_amount_net", "invoice_record_vat",
+    "invoice_record_amount_total", "invoice_id", "average_purchase_price", "vat_amount_per_unit", "gross_selling_price"]
+
+PARTNER_COLUMNS = ["partner_id", "partner_name", "partner_address", "partner_manager_first_name", "partner_manager_last_name"]
+
+
+def legacy_invoice_records(data):
+    """The response of GET /invoice_records before the serialization layer"""
+
+    invoice_records = []
+    for row in data:
+        invoice_record = {}
+        invoice_record["invoice_record_id"] = row[0]
+        invoice_record["item_id"] = row[1]
+        invoice_record["quantity"] = row[2]
+        invoice_record["net_selling_price"] = row[3]
+        invoice_record["invoice_record_amount_net"] = row[4]
+        invoice_record["invoice_record_vat"] = row[5]
+        invoice_record["invoice_record_amount_total"] = row[6]
+        invoice_record["invoice_id"] = row[7]
+        invoice_record["average_purchase_price"] = row[8]
+        invoice_record["vat_amount_per_unit"] = row[9]
+        invoice_record["gross_selling_price"] = row[10]
+
+        invoice_records.append(invoice_record)
+
+    return jsonify({"success": True, "invoice_records": invoice_records})
+
+
+def legacy_partners(data):
+    """The response of GET /partners before the serialization layer"""
+
+    partners = []
+    for row in data:
+        partner = {}
+        partner["id"] = row[0]
+        partner["partner_name"] = row[1]
+        partner["partner_address"] = row[2]
+        partner["partner_manager_first_name"] = row[3]
+        partner["partner_manager_last_name"] = row[4]
+
+        partners.append(partner)
+
+    return jsonify({"success": True, "partners": partners})
+
+
+def create_tables(conn, count, seed=1):
+    """Create the invoice_records and partners tables with count rows each"""
+
+    rng = random.Random(seed)
+    conn.execute(f"CREATE TABLE invoice_records ({', '.join(INVOICE_RECORD_KEYS)})")
+    conn.execute(f"CREATE TABLE partners ({', '.join(PARTNER_COLUMNS)})")
+
+    invoice_records = []
+    partners = []
+    for i in range(1, count + 1):
+        quantity = rng.randint(1, 50)
+        price = round(rng.uniform(1, 500), 2)
+        vat = price * 0.18
+        invoice_records.append((i, rng.randint(1, 5000), quantity, price, quantity * price, quantity * vat, quantity * (price + vat),
+            i // 4 + 1, round(price * rng.uniform(0.5, 0.9), 4), vat, price + vat))
+        partners.append((i, f"Partner {i} d.o.o.", f"Street {rng.randint(1, 200)}, City {rng.randint(1, 50)}", "Ana", "Marković"))
+
+    conn.executemany(f"INSERT INTO invoice_records VALUES ({', '.join('?' * len(INVOICE_RECORD_KEYS))})", invoice_records)
+    conn.executemany(f"INSERT INTO partners VALUES ({', '.join('?' * len(PARTNER_COLUMNS))})", partners)
+
+
+def measure(function, number):
+    """Return the average time of one call in milliseconds (the best of 5 runs)"""
+
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the serialization layer with the old way of building list responses")
+    parser.add_argument("--rows", type=int, default=10000, help="number of rows of every list (default: 10000)")
+    parser.add_argument("--number", type=int, default=5, help="number of responses per run (default: 5)")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(":memory:")
+    create_tables(conn, args.rows)
+    cursor = conn.cursor()
+
+    # The queries of the list endpoints name their columns like the keys of the response
+    cases = [
+        ("GET /invoice_records", legacy_invoice_records, "invoice_records", f"SELECT {', '.join(INVOICE_RECORD_KEYS)} FROM invoice_records"),
+        ("GET /partners", legacy_partners, "partners", """SELECT partner_id AS id, partner_name, partner_address,
+            partner_manager_first_name, partner_manager_last_name FROM partners""")
+    ]
+
+    encoders = [("json", None)]
+    if serialization.orjson is not None:
+        encoders.append(("orjson", serialization.orjson))
+    else:
+        print("orjson is not installed, only the json module is measured")
+
+    print(f"{'response':<22} {'encoder':>8} {'old ms':>9} {'new ms':>9} {'speedup':>8}")
+    with Flask(__name__).app_context():
+        for name, legacy, list_name, query in cases:
+            data = cursor.execute(query).fetchall()
+            expected = legacy(data).get_data()
+            legacy_time = measure(lambda: legacy(data).get_data(), args.number)
+
+            for encoder_name, encoder in encoders:
+                serialization.orjson = encoder
+
+                # Both ways must produce the same JSON document (orjson does not escape non-ASCII characters)
+                body = list_response({"success": True}, list_name, cursor, data).get_data()
+                assert json.loads(body) == json.loads(expected)
+
+                new_time = measure(lambda: list_response({"success": True}, list_name, cursor, data).get_data(), args.number)
+                print(f"{name:<22} {encoder_name:>8} {legacy_time:>9.2f} {new_time:>9.2f} {legacy_time / new_time:>7.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
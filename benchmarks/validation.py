@@ -0,0 +1,168 @@
+"""Measure the cost of validating one request: the compiled schemas of validation.py against
+the hand-rolled checks they replaced (copied below, as they were in app.py).
+
+Both validate the same valid form-data (a werkzeug MultiDict, like request.form) of a bill and of a bill record.
+The schemas are also measured with a JSON body (a plain dictionary), which the old checks did not accept.
+
+Usage:
+
+    python benchmarks/validation.py
+    python benchmarks/validation.py --number 200000"""
+
+import argparse
+import os
+import sys
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_DIR)
+
+from werkzeug.datastructures import MultiDict
+
+from validation import BILL_RECORD_SCHEMA, BILL_SCHEMA
+
+BILL_FORM = {"bill_number": "B-1042", "bill_date": "14.03.2022", "bill_due_date": "13.04.2022", "bill_amount": "1250", "partner_id": "17"}
+BILL_RECORD_FORM = {"item_id": "42", "quantity": "12", "price": "3.75", "bill_id": "1042"}
+
+
+def legacy_date(value, label):
+    """The dd.mm.yyyy checks of bills() and invoices() before the schemas (one copy per date)"""
+
+    if len(value) != 10:
+        return None, f"The format of {label} must be: dd.mm.yyyy"
+
+    if value[2] != "." or value[5] != ".":
+        return None, f"The format of {label} must be: dd.mm.yyyy"
+
+    try:
+        day = int(value[0:2])
+    except:
+        return None, f"The format of {label} must be: dd.mm.yyyy"
+
+    if day < 1 or day > 31:
+        return None, "Day must be between 01 and 31"
+
+    try:
+        month = int(value[3:5])
+    except:
+        return None, f"The format of {label} must be: dd.mm.yyyy"
+
+    if month < 1 or month > 12:
+        return None, "Month must be between 01 and 12"
+
+    if (month == 2 and day > 28) or ((month == 4 or month == 6 or month == 9 or month == 11) and day > 30):
+        return None, "Invalid date"
+
+    try:
+        year = int(value[6:])
+    except:
+        return None, f"The format of {label} must be: dd.mm.yyyy"
+
+    if year < 1950 and year > 2500:
+        return None, "Year must be between 1950 and 2500"
+
+    day = value[0:2]
+    month = value[3:5]
+    year = value[6:]
+
+    return f"{year}-{month}-{day}", None
+
+
+def legacy_bill(form):
+    """The checks of POST /bills before the schemas"""
+
+    form_fields = ["bill_number", "bill_date", "bill_due_date", "bill_amount", "partner_id"]
+    for form_field in form_fields:
+        if form_field not in form:
+            return {"success": False, "message": f"Form-data must contain a field called \'{form_field}\'"}
+
+    bill_number = form["bill_number"]
+    bill_date = form["bill_date"]
+    bill_due_date = form["bill_due_date"]
+    try:
+        partner_id = int(form["partner_id"])
+    except:
+        return {"success": False, "message": "partner_id must be integer"}
+
+    try:
+        bill_amount = int(form["bill_amount"])
+    except:
+        return {"success": False, "message": "Bill amount must be integer"}
+
+    if not bill_number or not bill_date or not bill_due_date or not bill_amount or not partner_id:
+        return {"success": False, "message": "You need to provide all required data"}
+
+    bill_date, error = legacy_date(bill_date, "bill date")
+    if error:
+        return {"success": False, "message": error}
+
+    bill_due_date, error = legacy_date(bill_due_date, "bill due date")
+    if error:
+        return {"success": False, "message": error}
+
+    if bill_due_date < bill_date:
+        return {"success": False, "message": "Due date can't be before the date"}
+
+    return {"bill_number": bill_number, "bill_date": bill_date, "bill_due_date": bill_due_date, "bill_amount": bill_amount, "partner_id": partner_id}
+
+
+def legacy_bill_record(form):
+    """The checks of POST /bill_records before the schemas"""
+
+    form_fields = ["item_id", "quantity", "price", "bill_id"]
+    for form_field in form_fields:
+        if form_field not in form:
+            return {"success": False, "message": f"form-data must contain {form_field}"}
+
+    try:
+        item_id = int(form["item_id"])
+        quantity = float(form["quantity"])
+        price = float(form["price"])
+        bill_id = int(form["bill_id"])
+    except:
+        item_id = None
+        quantity = None
+        price = None
+        bill_id = None
+
+    if not item_id or not quantity or not price or not bill_id:
+        return {"success": False, "message": "You must provide all necessary data"}
+
+    return {"item_id": item_id, "quantity": quantity, "price": price, "bill_id": bill_id}
+
+
+def measure(function, data, number):
+    """Return the average time of one call in microseconds (the best of 5 runs)"""
+
+    return min(timeit.repeat(lambda: function(data), number=number, repeat=5)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the validation cost of the compiled schemas with the old hand-rolled checks")
+    parser.add_argument("--number", type=int, default=100000, help="number of validations per run (default: 100000)")
+    args = parser.parse_args(argv)
+
+    # Both implementations must accept the same requests and produce the same values
+    bill_values, errors = BILL_SCHEMA.validate(MultiDict(BILL_FORM))
+    assert not errors and bill_values == dict(legacy_bill(MultiDict(BILL_FORM)))
+    record_values, errors = BILL_RECORD_SCHEMA.validate(MultiDict(BILL_RECORD_FORM))
+    assert not errors and record_values == legacy_bill_record(MultiDict(BILL_RECORD_FORM))
+
+    cases = [
+        ("POST /bills", legacy_bill, BILL_SCHEMA, BILL_FORM),
+        ("POST /bill_records", legacy_bill_record, BILL_RECORD_SCHEMA, BILL_RECORD_FORM)
+    ]
+
+    print(f"{'request':<20} {'old form us':>12} {'schema form us':>15} {'schema JSON us':>15} {'speedup':>8}")
+    for name, legacy, schema, form in cases:
+        legacy_time = measure(legacy, MultiDict(form), args.number)
+        schema_time = measure(schema.validate, MultiDict(form), args.number)
+        json_time = measure(schema.validate, dict(form), args.number)
+        print(f"{name:<20} {legacy_time:>12.2f} {schema_time:>15.2f} {json_time:>15.2f} {legacy_time / schema_time:>7.1f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
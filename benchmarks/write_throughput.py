@@ -0,0 +1,132 @@
+"""Measure the write throughput of the application with and without group commit.
+
+A small synthetic database is generated (see generate_dataset.py) together with a log of write requests
+(new partners, bills and bill records). The log is replayed in-process (see replay.py) at a high concurrency,
+once for every group commit size (DB_GROUP_COMMIT_SIZE), each time on a fresh copy of the database.
+A group commit size of 1 commits every request on its own, like a writer without group commit.
+
+Usage:
+
+    python benchmarks/write_throughput.py --requests 2000 --concurrency 32
+    python benchmarks/write_throughput.py --group-sizes 1,8,64 --output write_throughput.json"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from generate_dataset import generate
+
+START = date(2020, 1, 1)
+DAYS = 730
+
+
+def request_log(database, count, seed=1):
+    """Build a request log (a list of requests) with count write requests:
+    mostly bill records on existing bills, and some new partners and bills"""
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    max_partner_id = conn.execute("SELECT MAX(partner_id) FROM partners").fetchone()[0]
+    max_item_id = conn.execute("SELECT MAX(item_id) FROM items").fetchone()[0]
+    max_bill_id = conn.execute("SELECT MAX(bill_id) FROM bills").fetchone()[0]
+    conn.close()
+
+    requests = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.1:
+            requests.append({"method": "POST", "path": "/partners", "form": {
+                "partner_name": f"Benchmark partner {i}",
+                "partner_address": f"Benchmark street {i}",
+                "partner_manager_first_name": "",
+                "partner_manager_last_name": ""
+            }})
+        elif kind < 0.2:
+            bill_date = START + timedelta(days=rng.randrange(DAYS))
+            requests.append({"method": "POST", "path": "/bills", "form": {
+                "bill_number": f"BENCH-{i}",
+                "bill_date": bill_date.strftime("%d.%m.%Y"),
+                "bill_due_date": (bill_date + timedelta(days=30)).strftime("%d.%m.%Y"),
+                "bill_amount": rng.randint(100, 10000),
+                "partner_id": rng.randint(1, max_partner_id)
+            }})
+        else:
+            requests.append({"method": "POST", "path": "/bill_records", "form": {
+                "item_id": rng.randint(1, max_item_id),
+                "quantity": rng.randint(1, 20),
+                "price": round(rng.uniform(1, 100), 2),
+                "bill_id": rng.randint(1, max_bill_id)
+            }})
+
+    return requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the write throughput with different group commit sizes")
+    parser.add_argument("--group-sizes", default="1,64", help="comma-separated group commit sizes (default: 1,64)")
+    parser.add_argument("--requests", type=int, default=2000, help="number of write requests (default: 2000)")
+    parser.add_argument("--concurrency", type=int, default=32, help="number of concurrent workers (default: 32)")
+    parser.add_argument("--output", help="write the results of all group commit sizes as JSON to this file")
+    args = parser.parse_args(argv)
+
+    group_sizes = [int(size) for size in args.group_sizes.split(",")]
+    folder = tempfile.mkdtemp(prefix="write-throughput-")
+
+    results = {}
+    try:
+        template = os.path.join(folder, "template.sqlite3")
+        print("Generating the database...")
+        generate(template, partners=50, items=200, bills=1000, invoices=0, start=START, days=DAYS)
+
+        log_path = os.path.join(folder, "writes.jsonl")
+        with open(log_path, "w", encoding="utf-8") as f:
+            for entry in request_log(template, args.requests):
+                f.write(json.dumps(entry) + "\n")
+
+        for size in group_sizes:
+            # Every run writes to its own copy of the database, so that all runs start from the same data
+            database = os.path.join(folder, f"group_{size}.sqlite3")
+            shutil.copyfile(template, database)
+
+            # Every run is a new process, because the application reads its settings when it is imported
+            results_path = os.path.join(folder, f"group_{size}.json")
+            env = dict(os.environ, DB_GROUP_COMMIT_SIZE=str(size), METRICS_ENABLED="0")
+            subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, "replay.py"), log_path,
+                            "--database", database, "--concurrency", str(args.concurrency),
+                            "--output", results_path], check=True, stdout=subprocess.DEVNULL, env=env)
+
+            with open(results_path, encoding="utf-8") as f:
+                results[size] = json.load(f)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    baseline = results[group_sizes[0]]["throughput"]
+    print(f"{'group size':>10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>9}")
+    for size in group_sizes:
+        result = results[size]
+        routes = result["routes"].values()
+        p50 = max(route["p50_ms"] for route in routes)
+        p95 = max(route["p95_ms"] for route in routes)
+        speedup = f"{result['throughput'] / baseline:.1f}x" if baseline else "-"
+        print(f"{size:>10} {result['throughput']:>9} {p50:>9} {p95:>9} {speedup:>9}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"requests": args.requests, "concurrency": args.concurrency, "group_sizes": results}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import codecs
+import csv
+import json
+import sqlite3
+import sys
+
+from database import bump_table_version
+from validation import ITEM_SCHEMA, PARTNER_SCHEMA
+
+# Number of rows inserted in one transaction
+CHUNK_SIZE = 1000
+
+# Only the first rejected rows are reported one by one, so that the report stays small for any file size
+MAX_REPORTED_REJECTIONS = 1000
+
+
+def iter_records(stream, file_format):
+    """Yield (line number, record) for every record of a CSV or NDJSON text stream, one at a time"""
+
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == "ndjson":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record
+    else:
+        raise ValueError("The format must be 'csv' or 'ndjson'")
+
+
+def text_stream(binary_stream):
+    """Decode a binary stream (an uploaded file or a request body) line by line, without reading it into memory"""
+
+    return codecs.getreader("utf-8-sig")(binary_stream)
+
+
+class ImportReport:
+    """Counts the imported and rejected rows of an import"""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.rejections = []
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append({"line": line_number, "message": message})
+
+    def reject_conflicts(self, count):
+        """Count the rows of a chunk that were skipped because they already existed when the chunk was inserted
+        (they were added by another request after the file had been checked)"""
+
+        self.rejected += count
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append({"line": None, "message": f"{count} rows already exist in database"})
+
+    def to_dict(self):
+        return {"imported": self.imported, "rejected": self.rejected, "rejections": self.rejections}
+
+
+def write_rows(db, table_name, query, rows):
+    """Insert rows with executemany and bump the version of the table, without committing.
+    Return the number of inserted rows (rows that violate a UNIQUE constraint are skipped by "ON CONFLICT DO NOTHING")"""
+
+    inserted = db.executemany(query, rows).rowcount
+    if inserted:
+        bump_table_version(db, table_name)
+    return inserted
+
+
+def insert_in_chunks(conn, table_name, query, rows, report, chunk_size=CHUNK_SIZE, write_chunk=None):
+    """Insert the rows (a generator) in chunks, one transaction per chunk.
+    write_chunk(table_name, query, chunk) inserts and commits a chunk and returns the number of inserted rows;
+    by default, the chunk is inserted with conn and committed"""
+
+    if write_chunk is None:
+        def write_chunk(table_name, query, chunk):
+            inserted = write_rows(conn, table_name, query, chunk)
+            conn.commit()
+            return inserted
+
+    def write(chunk):
+        inserted = write_chunk(table_name, query, chunk)
+        report.imported += inserted
+        if inserted < len(chunk):
+            report.reject_conflicts(len(chunk) - inserted)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            write(chunk)
+            chunk = []
+
+    if chunk:
+        write(chunk)
+
+
+def import_partners(conn, records, chunk_size=CHUNK_SIZE, write_chunk=None):
+    """Import partners from (line number, record) pairs. Every record is validated with the schema of "POST /partners".
+    Invalid partners and partners whose name already exists (in database or earlier in the file) are rejected"""
+
+    report = ImportReport()
+    partner_names = {row[0] for row in conn.execute("SELECT partner_name FROM partners")}
+
+    def valid_partners():
+        for line_number, record in records:
+            if not isinstance(record, dict):
+                report.reject(line_number, "Row is not valid")
+                continue
+
+            # The first error of the row is reported, like the message of a "POST" request
+            values, errors = PARTNER_SCHEMA.validate(record)
+            if errors:
+                report.reject(line_number, next(iter(errors.values())))
+                continue
+
+            partner_name = values["partner_name"]
+            if partner_name in partner_names:
+                report.reject(line_number, f"{partner_name} already exists in database")
+                continue
+
+            partner_names.add(partner_name)
+            yield values
+
+    insert_in_chunks(conn, "partners", """ INSERT INTO partners (
+        partner_name,
+        partner_address,
+        partner_manager_first_name,
+        partner_manager_last_name
+        ) VALUES (
+            :partner_name,
+            :partner_address,
+            :partner_manager_first_name,
+            :partner_manager_last_name
+            ) ON CONFLICT DO NOTHING """, valid_partners(), report, chunk_size, write_chunk)
+
+    return report
+
+
+def import_items(conn, records, chunk_size=CHUNK_SIZE, write_chunk=None):
+    """Import items from (line number, record) pairs. Every record is validated with the schema of "POST /items".
+    Invalid items, items with unknown units of measure or VAT rates, and items whose code or description already exists
+    (in database or earlier in the file) are rejected"""
+
+    report = ImportReport()
+    unit_ids = {row[0] for row in conn.execute("SELECT unit_id FROM units_of_measure")}
+    vat_rate_ids = {row[0] for row in conn.execute("SELECT vat_rate_id FROM vat_rates")}
+    item_codes = set()
+    item_descriptions = set()
+    for item_code, item_description in conn.execute("SELECT item_code, item_description FROM items"):
+        item_codes.add(item_code)
+        item_descriptions.add(item_description)
+
+    def valid_items():
+        for line_number, record in records:
+            if not isinstance(record, dict):
+                report.reject(line_number, "Row is not valid")
+                continue
+
+            # The first error of the row is reported, like the message of a "POST" request
+            values, errors = ITEM_SCHEMA.validate(record)
+            if errors:
+                report.reject(line_number, next(iter(errors.values())))
+                continue
+
+            item_code = values["item_code"]
+            item_description = values["item_description"]
+            unit_id = values["unit_id"]
+            vat_rate_id = values["vat_rate_id"]
+
+            if unit_id not in unit_ids:
+                report.reject(line_number, f"{unit_id} is not valid (not in database)")
+                continue
+
+            if vat_rate_id not in vat_rate_ids:
+                report.reject(line_number, f"{vat_rate_id} is not valid (not in database)")
+                continue
+
+            if item_code in item_codes or item_description in item_descriptions:
+                report.reject(line_number, f"Item with code {item_code} or item with description {item_description} already exists in database")
+                continue
+
+            item_codes.add(item_code)
+            item_descriptions.add(item_description)
+            yield values
+
+    insert_in_chunks(conn, "items", """INSERT INTO items (
+        item_code,
+        item_description,
+        unit_id,
+        vat_rate_id
+        ) VALUES (
+            :item_code,
+            :item_description,
+            :unit_id,
+            :vat_rate_id
+            ) ON CONFLICT DO NOTHING""", valid_items(), report, chunk_size, write_chunk)
+
+    return report
+
+
+IMPORTERS = {
+    "partners": import_partners,
+    "items": import_items
+}
+
+
+if __name__ == "__main__":
+    # Usage: python bulk_import.py partners|items FILE [database]
+    if len(sys.argv) < 3 or sys.argv[1] not in IMPORTERS:
+        print("Usage: python bulk_import.py partners|items FILE [database]")
+        sys.exit(2)
+
+    table, path = sys.argv[1], sys.argv[2]
+    database = sys.argv[3] if len(sys.argv) > 3 else "database.sqlite3"
+    file_format = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+    conn = sqlite3.connect(database)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        report = IMPORTERS[table](conn, iter_records(f, file_format))
+    conn.close()
+
+    print(f"{report.imported} {table} imported, {report.rejected} rejected")
+    for rejection in report.rejections:
+        if rejection["line"] is None:
+            print(rejection["message"])
+        else:
+            print(f"Line {rejection['line']}: {rejection['message']}")
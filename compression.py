@@ -0,0 +1,110 @@
+import zlib
+from itertools import chain
+
+from flask import current_app, request
+
+# Content codings that can be used, in the order of preference.
+# "deflate" is the zlib format (RFC 9110), gzip the same compressed data with a gzip header
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Only text responses are compressed
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/plain", "text/csv", "text/html")
+
+
+def choose_encoding(accept_encodings):
+    """Return the content coding ("gzip" or "deflate") that the client prefers, or None if it accepts neither"""
+
+    best = None
+    best_quality = 0
+    for encoding in WBITS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def compressed_stream(chunks, compressor):
+    """Yield the compressed chunks of a streamed response. Every chunk is flushed, so the client
+    gets the rows as soon as they are read (and not only when the compressor's buffer is full)"""
+
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """Compress the response with gzip or deflate, if the client accepts it and the response is large enough (after_request hook).
+
+    A streamed response is read up to the minimum size: if it ends before that, it is sent as it is,
+    otherwise the rest of the stream is compressed chunk by chunk while it is sent"""
+
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers or response.direct_passthrough:
+        return response
+
+    # The response depends on the Accept-Encoding header, even if this one is not compressed
+    response.vary.add("Accept-Encoding")
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    min_size = current_app.config["COMPRESSION_MIN_SIZE"]
+    compressor = zlib.compressobj(current_app.config["COMPRESSION_LEVEL"], zlib.DEFLATED, WBITS[encoding])
+
+    if response.is_streamed:
+        original = response.response
+        chunks = response.iter_encoded()
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= min_size:
+                break
+        else:
+            # The whole stream has been read and is smaller than the minimum size
+            response.response = head
+            return response
+
+        response.response = compressed_stream(chain(head, chunks), compressor)
+        # Closing the original stream runs its cleanup (e.g. the pooled connection is given back),
+        # even if the compressed stream is never read (e.g. for a "HEAD" request)
+        if hasattr(original, "close"):
+            response.call_on_close(original.close)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        # set_data() also sets the Content-Length header to the compressed size
+        response.set_data(compressor.compress(data) + compressor.flush())
+
+    response.headers["Content-Encoding"] = encoding
+
+    # The compressed body is a different representation, so its ETag is weak (the "If-None-Match" checks use the weak comparison)
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_compression(app):
+    """Register the response compression hook, if compression is enabled.
+    It has to be registered before the other after_request hooks, so that it runs after them
+    (e.g. the idempotency keys store the uncompressed response)"""
+
+    app.config.setdefault("COMPRESSION_ENABLED", True)
+    app.config.setdefault("COMPRESSION_MIN_SIZE", 1024)
+    app.config.setdefault("COMPRESSION_LEVEL", 6)
+    if not app.config["COMPRESSION_ENABLED"]:
+        return
+
+    if not 1 <= app.config["COMPRESSION_LEVEL"] <= 9:
+        raise ValueError("COMPRESSION_LEVEL must be between 1 and 9")
+
+    app.after_request(compress_response)
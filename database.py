@@ -0,0 +1,488 @@
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.parse import quote
+
+from flask import current_app, g
+
+from migrations import migrate, set_journal_mode
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available before the pool timeout"""
+
+
+class WriterTimeout(Exception):
+    """Raised when the writer has not started a work unit before the wait timeout (the work unit is not run at all)"""
+
+
+def read_only_uri(database):
+    """Return the URI that opens the database file in the read-only mode"""
+
+    return f"file:{quote(os.path.abspath(database))}?mode=ro"
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections that get reused between requests.
+
+    Connections are opened lazily (up to max_size) and handed back to the pool
+    when a request ends, so the connect cost and the page cache warmup are only
+    paid once per connection. Every connection keeps its own prepared statement
+    cache (cached_statements), which stays warm because the connection is reused.
+    The connections are instances of factory (a subclass of sqlite3.Connection).
+    With read_only, the connections are opened in the read-only mode (a "file:...?mode=ro" URI),
+    so a request that uses them can never take the write lock of the database."""
+
+    def __init__(self, database, max_size=5, timeout=30.0, cached_statements=256, factory=sqlite3.Connection, read_only=False):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self.read_only = read_only
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+
+        # Counters exposed through stats()
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        """Open a new connection to the database"""
+
+        if self.read_only:
+            return sqlite3.connect(
+                read_only_uri(self.database),
+                timeout=self.timeout,
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+                factory=self.factory,
+                uri=True
+            )
+
+        return sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory
+        )
+
+    def acquire(self):
+        """Take a connection from the pool, opening a new one if the pool is not full yet.
+        If all connections are in use, wait until one is released"""
+
+        # Reuse an idle connection if there is one
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is not None:
+            with self._lock:
+                self._hits += 1
+                self._in_use += 1
+            return conn
+
+        # Open a new connection if the pool has not reached its maximum size
+        with self._lock:
+            can_open = self._open < self.max_size
+            if can_open:
+                self._open += 1
+                self._misses += 1
+
+        if can_open:
+            try:
+                conn = self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._open -= 1
+                raise
+            with self._lock:
+                self._in_use += 1
+            return conn
+
+        # The pool is exhausted, so wait for a connection to be released
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout} seconds")
+
+        with self._lock:
+            self._waits += 1
+            self._wait_time += time.perf_counter() - started
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Give a connection back to the pool. Uncommitted work is rolled back"""
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # The connection is broken, so drop it instead of returning it to the pool
+            with self._lock:
+                self._open -= 1
+                self._in_use -= 1
+            conn.close()
+            return
+
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Close all idle connections"""
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        """Return a snapshot of the pool counters"""
+
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": self._open - self._in_use,
+                "hits": self._hits,
+                "misses": self._misses,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 6),
+                "timeouts": self._timeouts
+            }
+
+
+class Writer:
+    """Single writer that runs all changes to the database on one connection, in one thread (see "Configuration" in the README).
+    Waiting work units run in one transaction, each in its own savepoint, and are committed together (group commit)"""
+
+    def __init__(self, database, max_batch=64, timeout=30.0, cached_statements=256, factory=sqlite3.Connection, wait_timeout=60.0):
+        self.database = database
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.wait_timeout = wait_timeout
+        self.cached_statements = cached_statements
+        self.factory = factory
+        # Functions called as hook(cursor, result) after every unit that has not failed, in the savepoint of the unit
+        self.result_hooks = []
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # Counters exposed through stats()
+        self._units = 0
+        self._commits = 0
+        self._failed_commits = 0
+
+    def _connect(self):
+        """Open the write connection. Transactions are started and committed explicitly (isolation_level=None)"""
+
+        return sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            isolation_level=None,
+            factory=self.factory
+        )
+
+    def run(self, work, *args):
+        """Submit a work unit, called as work(cursor, *args), and wait until its transaction has been committed.
+        Return the result of the work unit, or raise its exception (or the exception of the commit)"""
+
+        future = Future()
+        with self._lock:
+            # The writer thread is started with the first work unit, so that it runs in the process that serves the requests
+            # (and started again if it has stopped)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((work, args, contextvars.copy_context(), future))
+
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeout:
+            # A unit that has not started yet is cancelled, so it is never run. A unit that is already running
+            # is waited for, because its transaction decides whether the changes are committed
+            if future.cancel():
+                raise WriterTimeout(f"The database writer has not started the change after {self.wait_timeout} seconds") from None
+            return future.result()
+
+    def _run(self):
+        """Take the waiting work units, up to max_batch at a time, and run each group in one transaction"""
+
+        conn = None
+        while True:
+            unit = self._queue.get()
+            if unit is None:
+                break
+
+            group = [unit]
+            while len(group) < self.max_batch:
+                try:
+                    unit = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if unit is None:
+                    # Stop after this group
+                    self._queue.put(None)
+                    break
+                group.append(unit)
+
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._run_group(conn, group)
+            except Exception as e:
+                # The connection can't be used: the units of the group fail, and the next group opens a new connection
+                self._fail_group(group, e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+                    conn = None
+
+        if conn is not None:
+            conn.close()
+
+    def _fail_group(self, group, exception):
+        """Fail the units of a group that has not been committed (the units that have not failed already)"""
+
+        pending = [future for work, args, context, future in group if not future.done()]
+        if not pending:
+            return
+
+        with self._lock:
+            self._failed_commits += 1
+        for future in pending:
+            future.set_exception(exception)
+
+    def _run_group(self, conn, group):
+        """Run a group of work units in one transaction and commit it"""
+
+        # Units whose request has stopped waiting (cancelled by run()) are left out
+        group = [unit for unit in group if unit[3].set_running_or_notify_cancel()]
+        if not group:
+            return
+
+        succeeded = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+
+            for work, args, context, future in group:
+                conn.execute("SAVEPOINT work_unit")
+                try:
+                    result = context.run(work, conn.cursor(), *args)
+                    failed = isinstance(result, dict) and result.get("success") is False
+                    if not failed:
+                        for hook in self.result_hooks:
+                            context.run(hook, conn.cursor(), result)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO work_unit")
+                    conn.execute("RELEASE work_unit")
+                    future.set_exception(e)
+                    continue
+
+                # A failed request must not leave any changes behind
+                if failed:
+                    conn.execute("ROLLBACK TO work_unit")
+                conn.execute("RELEASE work_unit")
+                succeeded.append((future, result))
+
+            conn.execute("COMMIT")
+        except Exception as e:
+            # The transaction could not be completed (e.g. the database stayed locked), so none of the units is committed.
+            # The units fail even if the rollback fails too (then _run() replaces the connection)
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            finally:
+                self._fail_group(group, e)
+            return
+
+        with self._lock:
+            self._units += len(group)
+            self._commits += 1
+        for future, result in succeeded:
+            future.set_result(result)
+
+    def close(self):
+        """Stop the writer thread after the work units that are already waiting"""
+
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        """Return a snapshot of the writer counters"""
+
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "queued": self._queue.qsize(),
+                "units": self._units,
+                "commits": self._commits,
+                "units_per_commit": round(self._units / self._commits, 2) if self._commits else 0,
+                "failed_commits": self._failed_commits
+            }
+
+
+def get_pool(app=None):
+    """Return the connection pool of the application"""
+
+    if app is None:
+        app = current_app
+    return app.extensions["db_pool"]
+
+
+def get_writer(app=None):
+    """Return the single writer of the application"""
+
+    if app is None:
+        app = current_app
+    return app.extensions["db_writer"]
+
+
+def db_connection():
+    """Return the (read-only) database connection of the current request.
+    The connection is taken from the pool the first time it is needed and released when the request ends"""
+
+    if "db_conn" not in g:
+        g.db_conn = get_pool().acquire()
+    return g.db_conn
+
+
+def close_db_connection(exception=None):
+    """Release the connection of the current request back to the pool"""
+
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def bump_table_version(db, table_name):
+    """Increment the change version of a table. Must run in the same transaction that changes the table"""
+
+    db.execute("""INSERT INTO table_versions (table_name, version) VALUES (:table_name, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = version + 1""", {"table_name": table_name})
+
+
+def insert_unique(db, table_name, query, params):
+    """Run an "INSERT ... ON CONFLICT DO NOTHING" statement and bump the version of the table.
+    Return False, without changing anything, if the row already exists (it violates a UNIQUE constraint).
+    The duplicate check and the insert are one statement, so two requests can never insert the same row"""
+
+    db.execute(query, params)
+    if db.rowcount == 0:
+        return False
+
+    bump_table_version(db, table_name)
+    return True
+
+
+def table_version(db, table_name):
+    """Return the change version of a table (0 if the table has never been changed)"""
+
+    data = db.execute("SELECT version FROM table_versions WHERE table_name = :table_name", {"table_name": table_name}).fetchone()
+    if data is None:
+        return 0
+    return data[0]
+
+
+def next_sequence_value(db, sequence_name):
+    """Increment a sequence and return its new value. A sequence that does not exist yet starts with 1.
+    The increment takes the database write lock, so it must run in the same transaction that uses the value"""
+
+    db.execute("""INSERT INTO sequences (sequence_name, last_value) VALUES (:sequence_name, 1)
+    ON CONFLICT (sequence_name) DO UPDATE SET last_value = last_value + 1""", {"sequence_name": sequence_name})
+
+    return db.execute("SELECT last_value FROM sequences WHERE sequence_name = :sequence_name", {"sequence_name": sequence_name}).fetchone()[0]
+
+
+def allocate_invoice_number(db, invoice_date, invoice_series="", numbering="continuous"):
+    """Allocate the number of a new invoice.
+    With "continuous" numbering the invoices are numbered 00001, 00002, ...
+    With "yearly" numbering the numbering starts again every year: 2022-00001, 2022-00002, ...
+    Invoices of a series have their own numbering, prefixed with the series: POS-00001 or POS-2022-00001"""
+
+    prefix = ""
+    if invoice_series:
+        prefix += f"{invoice_series}-"
+    if numbering == "yearly":
+        prefix += f"{invoice_date[0:4]}-"
+
+    value = next_sequence_value(db, f"invoices:{prefix}")
+
+    return f"{prefix}{value:05d}"
+
+
+def init_db(app):
+    """Set the journal mode, bring the database schema up to date, create the read-only connection pool and the writer,
+    and register the teardown hook"""
+
+    app.config.setdefault("DATABASE", "database.sqlite3")
+    app.config.setdefault("DB_AUTO_MIGRATE", True)
+    app.config.setdefault("INVOICE_NUMBERING", "continuous")
+    app.config.setdefault("DB_POOL_SIZE", 5)
+    app.config.setdefault("DB_POOL_TIMEOUT", 30.0)
+    app.config.setdefault("DB_CACHED_STATEMENTS", 256)
+    app.config.setdefault("DB_GROUP_COMMIT_SIZE", 64)
+    app.config.setdefault("DB_JOURNAL_MODE", "wal")
+    app.config.setdefault("DB_WRITER_TIMEOUT", 60.0)
+
+    # The journal mode is set before the application starts, even if the migrations are applied separately
+    if app.config["DB_AUTO_MIGRATE"]:
+        migrate(app.config["DATABASE"], journal_mode=app.config["DB_JOURNAL_MODE"])
+    else:
+        conn = sqlite3.connect(app.config["DATABASE"])
+        try:
+            set_journal_mode(conn, app.config["DB_JOURNAL_MODE"])
+        finally:
+            conn.close()
+
+    # The pooled connections are read-only: requests read through them, and all changes go through the single writer.
+    # In the WAL mode, reads run in parallel with each other and with the writer, so a long report never delays an insert
+    app.extensions["db_pool"] = ConnectionPool(
+        app.config["DATABASE"],
+        max_size=app.config["DB_POOL_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+        cached_statements=app.config["DB_CACHED_STATEMENTS"],
+        read_only=True
+    )
+
+    app.extensions["db_writer"] = Writer(
+        app.config["DATABASE"],
+        max_batch=app.config["DB_GROUP_COMMIT_SIZE"],
+        timeout=app.config["DB_POOL_TIMEOUT"],
+        cached_statements=app.config["DB_CACHED_STATEMENTS"],
+        wait_timeout=app.config["DB_WRITER_TIMEOUT"]
+    )
+    app.teardown_appcontext(close_db_connection)
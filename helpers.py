@@ -1,6 +1,218 @@
-def validate_form_fields(form_fields, request_form):
-    for form_field in form_fields:
-        if form_field not in request_form:
-            return False, form_field
+import base64
+import json
+import time
+import zlib
 
-    return True
\ No newline at end of file
+from flask import Response
+
+from serialization import RowEncoder, record_serialization_time
+
+
+# Default and maximum number of rows returned on one page of a list endpoint
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values):
+    """Encode the sort key values of the last row of a page into an opaque cursor"""
+
+    # The base64 padding is left out, so that the cursor can be used in a URL as it is
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key_count):
+    """Decode a cursor created by encode_cursor. Raises ValueError if the cursor is not valid"""
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode() + b"=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("'after' is not a valid cursor")
+
+    if not isinstance(values, list) or len(values) != key_count:
+        raise ValueError("'after' is not a valid cursor")
+
+    # The values are bound to the query as they are, so they must be values that SQLite can store
+    # (not objects or arrays, and no integers larger than 64 bits)
+    for value in values:
+        if value is not None and not isinstance(value, (int, float, str)):
+            raise ValueError("'after' is not a valid cursor")
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+            raise ValueError("'after' is not a valid cursor")
+
+    return values
+
+
+def pagination_args(request_args, key_count):
+    """Read the 'limit' and 'after' query parameters.
+    Return (limit, after), where limit is None if the list is not paginated and after is None for the first page.
+    Raises ValueError if a parameter is not valid"""
+
+    limit = request_args.get("limit")
+    after = request_args.get("after")
+
+    if limit is None and after is None:
+        return None, None
+
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    else:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("'limit' must be integer")
+
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+
+    if after is not None:
+        after = decode_cursor(after, key_count)
+
+    return limit, after
+
+
+def keyset_query(select, key_columns, limit, after):
+    """Add keyset pagination to a SELECT statement.
+    The rows are ordered by the key columns and only the rows that come after the cursor are selected.
+    One row more than the limit is selected, so that page_rows can tell if there is a next page"""
+
+    params = {}
+    query = select
+
+    if after is not None:
+        # Row value comparison, so that the index on the key columns is used for seeking to the cursor
+        columns = ", ".join(key_columns)
+        placeholders = ", ".join(f":after_{i}" for i in range(len(key_columns)))
+        query += f" WHERE ({columns}) > ({placeholders})"
+        for i, value in enumerate(after):
+            params[f"after_{i}"] = value
+
+    query += " ORDER BY " + ", ".join(key_columns)
+
+    if limit is not None:
+        query += " LIMIT :limit"
+        params["limit"] = limit + 1
+
+    return query, params
+
+
+def page_rows(rows, limit, key_indexes):
+    """Cut the rows selected by a keyset_query to the page size.
+    Return (rows, next_cursor), where next_cursor is None if this is the last page"""
+
+    if limit is None or len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last_row = rows[-1]
+    return rows, encode_cursor([last_row[i] for i in key_indexes])
+
+
+# Number of rows fetched from the database at once when a list is streamed
+STREAM_BATCH_SIZE = 500
+
+
+def stream_format(request):
+    """Return the streaming format requested by the client: "ndjson", "json" or None (no streaming).
+    NDJSON is requested with the "Accept: application/x-ndjson" header or with "?stream=1",
+    and a chunked JSON document (same shape as the regular response) with "?stream=json\""""
+
+    stream = request.args.get("stream")
+    if stream == "json":
+        return "json"
+    if stream in ("1", "ndjson") or "application/x-ndjson" in request.headers.get("Accept", ""):
+        return "ndjson"
+    return None
+
+
+def iter_batches(cursor, batch_size=STREAM_BATCH_SIZE):
+    """Yield the rows of an executed cursor in batches (lists of rows), so that the whole result is never in memory"""
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def ndjson_stream(cursor):
+    """Yield the rows of an executed cursor as JSON lines, one chunk per batch of rows.
+    The keys are the column names of the query"""
+
+    encoder = RowEncoder.for_cursor(cursor)
+    for rows in iter_batches(cursor):
+        started = time.perf_counter()
+        chunk = encoder.encode_lines(rows)
+        record_serialization_time(started)
+        yield chunk
+
+
+def json_array_stream(cursor, list_name):
+    """Yield a JSON document {"success": true, list_name: [...]} in chunks, one chunk per batch of rows"""
+
+    encoder = RowEncoder.for_cursor(cursor)
+    yield b'{"success": true, "' + list_name.encode() + b'": ['
+    separator = b""
+    for rows in iter_batches(cursor):
+        started = time.perf_counter()
+        # The rows of a batch are encoded as one array, whose brackets are cut off
+        chunk = separator + encoder.encode(rows)[1:-1]
+        record_serialization_time(started)
+        yield chunk
+        separator = b","
+    yield b"]}\n"
+
+
+# Maximum number of lines accepted by a batch endpoint in one request
+MAX_BATCH_LINES = 500
+
+
+def batch_lines(request_json, list_name):
+    """Read the lines and the error handling mode of a batch request.
+    The body is either a JSON array of lines, or an object {list_name: [...], "on_error": "reject_batch" | "skip_line"}.
+    Return (lines, on_error). Raises ValueError if the body is not valid"""
+
+    on_error = "reject_batch"
+    if isinstance(request_json, dict):
+        on_error = request_json.get("on_error", on_error)
+        request_json = request_json.get(list_name)
+
+    if not isinstance(request_json, list) or len(request_json) == 0:
+        raise ValueError(f"The request body must be a JSON array of {list_name} (or an object with a '{list_name}' array)")
+
+    if len(request_json) > MAX_BATCH_LINES:
+        raise ValueError(f"A batch can contain at most {MAX_BATCH_LINES} lines")
+
+    if on_error not in ("reject_batch", "skip_line"):
+        raise ValueError("'on_error' must be 'reject_batch' or 'skip_line'")
+
+    return request_json, on_error
+
+
+def in_clause(name, values):
+    """Build the placeholders and parameters of an "IN (...)" condition with named parameters.
+    Return (placeholders, params), e.g. (":item_id_0, :item_id_1", {"item_id_0": 4, "item_id_1": 7})"""
+
+    params = {f"{name}_{i}": value for i, value in enumerate(values)}
+    return ", ".join(f":{key}" for key in params), params
+
+
+def make_etag(versions, variant=b""):
+    """Build an ETag from the change versions of the tables a response is read from.
+    The variant (the query string) is part of the ETag, because it changes the response (e.g. the page)"""
+
+    return "-".join(str(version) for version in versions) + f"-{zlib.crc32(variant):08x}"
+
+
+def not_modified(etag):
+    """Return an empty "304 Not Modified" response"""
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """Add the ETag header to a response"""
+
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,307 @@
+import hashlib
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, jsonify, request
+
+from database import db_connection, get_writer
+
+# Maximum length of an Idempotency-Key header
+MAX_KEY_LENGTH = 255
+
+# Request bodies up to this size are part of the request fingerprint.
+# Larger bodies (e.g. imported files) are streamed, so only their length is used
+MAX_FINGERPRINT_BODY = 1024 * 1024
+
+# Header added to a response that is replayed from the idempotency table
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def request_fingerprint():
+    """Return a hash of the request (method, path, query string, content type and body),
+    so that a key that is reused for a different request can be detected"""
+
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{request.method} {request.path}?{request.query_string.decode('latin-1')}\n".encode())
+    fingerprint.update(f"{request.mimetype}\n".encode())
+
+    if request.content_length is not None and request.content_length <= MAX_FINGERPRINT_BODY:
+        # The body stays cached, so the view can still read the form-data or the JSON body
+        fingerprint.update(request.get_data(cache=True))
+    else:
+        fingerprint.update(f"{request.content_length}".encode())
+
+    return fingerprint.hexdigest()
+
+
+class IdempotencyStore:
+    """Stores the responses of "POST" requests that were sent with an Idempotency-Key header.
+
+    The first request with a key claims the key (a "pending" row in the idempotency_keys table) through
+    the single writer, so only one request with the key can ever run, even across processes. The response is
+    stored in the row in the same transaction as the changes of the request (see store_unit_response()),
+    or when the request has been handled if it has not changed anything. A retried request with the same key gets
+    the stored response with one primary key lookup, without running the view (so nothing is validated or written twice).
+
+    Stored responses expire after ttl seconds. A pending row expires after pending_ttl seconds, but its claim
+    is extended every pending_ttl / 3 seconds while its request runs (see track()), so only a key whose request
+    never finished (e.g. the process was killed) can be used again. Expired rows are deleted
+    at most once every purge_interval seconds"""
+
+    def __init__(self, ttl=86400, pending_ttl=60, purge_interval=60):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.purge_interval = purge_interval
+
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        # Keys claimed by the running requests of this process, and the thread that extends their claims
+        self._claimed = set()
+        self._renewer = None
+
+        # Counters exposed through stats()
+        self._replays = 0
+        self._stored = 0
+        self._conflicts = 0
+
+    def lookup(self, db, key):
+        """Return the stored row (request_hash, status, content_type, body) of a key, or None if there is no unexpired row"""
+
+        return db.execute("""SELECT request_hash, status, content_type, body FROM idempotency_keys
+            WHERE idempotency_key = :idempotency_key AND expires_at > :now""", {
+                "idempotency_key": key,
+                "now": time.time()
+            }).fetchone()
+
+    def claim(self, db, key, request_hash):
+        """Claim a key for a new request (a work unit of the single writer).
+        Return None if the key has been claimed, otherwise the unexpired row of the key"""
+
+        now = time.time()
+        self.purge(db, now)
+
+        # An expired row (a stored response or a pending request) is taken over by the new request
+        claimed = db.execute("""INSERT INTO idempotency_keys (idempotency_key, request_hash, status, content_type, body, expires_at)
+            VALUES (:idempotency_key, :request_hash, NULL, NULL, NULL, :expires_at)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+            request_hash = excluded.request_hash,
+            status = NULL,
+            content_type = NULL,
+            body = NULL,
+            expires_at = excluded.expires_at
+            WHERE idempotency_keys.expires_at <= :now""", {
+                "idempotency_key": key,
+                "request_hash": request_hash,
+                "expires_at": now + self.pending_ttl,
+                "now": now
+            }).rowcount
+
+        if claimed:
+            return None
+        return self.lookup(db, key)
+
+    def store(self, db, key, status, content_type, body):
+        """Store the response of a claimed key (a work unit of the single writer)"""
+
+        db.execute("""UPDATE idempotency_keys SET
+            status = :status,
+            content_type = :content_type,
+            body = :body,
+            expires_at = :expires_at
+            WHERE idempotency_key = :idempotency_key""", {
+                "status": status,
+                "content_type": content_type,
+                "body": body,
+                "expires_at": time.time() + self.ttl,
+                "idempotency_key": key
+            })
+
+        with self._lock:
+            self._stored += 1
+
+    def extend(self, db, keys):
+        """Extend the claims of keys whose requests are still running (a work unit of the single writer)"""
+
+        expires_at = time.time() + self.pending_ttl
+        db.executemany("""UPDATE idempotency_keys SET expires_at = :expires_at
+            WHERE idempotency_key = :idempotency_key AND status IS NULL""", [
+                {"expires_at": expires_at, "idempotency_key": key} for key in keys
+            ])
+
+    def track(self, key, writer):
+        """Keep extending the claim of a key until untrack() is called for it. The claims are extended
+        by one background thread, which is started with the first claimed key and stops when there are none left"""
+
+        with self._lock:
+            self._claimed.add(key)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_claims, args=(writer,), name="idempotency-renewer", daemon=True)
+                self._renewer.start()
+
+    def untrack(self, key):
+        """Stop extending the claim of a key (its request has ended)"""
+
+        with self._lock:
+            self._claimed.discard(key)
+
+    def _renew_claims(self, writer):
+        """Extend the claims of the tracked keys every pending_ttl / 3 seconds"""
+
+        while True:
+            time.sleep(self.pending_ttl / 3)
+            with self._lock:
+                keys = list(self._claimed)
+                if not keys:
+                    self._renewer = None
+                    return
+
+            try:
+                writer.run(self.extend, keys)
+            except Exception:
+                # The claims are extended again in the next round, before they expire
+                pass
+
+    def release(self, db, key):
+        """Delete the pending row of a claimed key whose request failed, so that the request can be retried"""
+
+        db.execute("DELETE FROM idempotency_keys WHERE idempotency_key = :idempotency_key AND status IS NULL", {"idempotency_key": key})
+
+    def purge(self, db, now):
+        """Delete the expired rows, at most once every purge_interval seconds (the expires_at index makes it cheap)"""
+
+        with self._lock:
+            if now - self._last_purge < self.purge_interval:
+                return
+            self._last_purge = now
+
+        db.execute("DELETE FROM idempotency_keys WHERE expires_at <= :now", {"now": now})
+
+    def replay(self, row):
+        """Return the stored response of a row"""
+
+        with self._lock:
+            self._replays += 1
+
+        response = Response(row[3], status=row[1], content_type=row[2])
+        response.headers[REPLAYED_HEADER] = "true"
+        return response
+
+    def conflict(self, message, status):
+        """Return the error response of a key that can't be used for the request"""
+
+        with self._lock:
+            self._conflicts += 1
+
+        return jsonify({"success": False, "message": message}), status
+
+    def stats(self):
+        """Return a snapshot of the store counters"""
+
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "replays": self._replays,
+                "stored": self._stored,
+                "conflicts": self._conflicts
+            }
+
+
+def check_idempotency_key():
+    """Replay the stored response of a retried "POST" request, or claim its key (before_request hook)"""
+
+    key = request.headers.get("Idempotency-Key")
+    if request.method != "POST" or key is None:
+        return None
+
+    store = get_idempotency_store()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return store.conflict(f"'Idempotency-Key' must have between 1 and {MAX_KEY_LENGTH} characters", 400)
+
+    request_hash = request_fingerprint()
+
+    # A finished request is replayed with one lookup on a read-only connection, without going through the writer
+    row = store.lookup(db_connection(), key)
+    if row is None or row[1] is None:
+        row = get_writer().run(store.claim, key, request_hash)
+        if row is None:
+            g.idempotency_key = key
+            store.track(key, get_writer())
+            return None
+
+    if row[0] != request_hash:
+        return store.conflict("This 'Idempotency-Key' has already been used for a different request", 422)
+    if row[1] is None:
+        return store.conflict("A request with this 'Idempotency-Key' is still being processed", 409)
+
+    return store.replay(row)
+
+
+def store_unit_response(db, result):
+    """Store the response of a request that has claimed an idempotency key, in the transaction of its changes
+    (a result hook of the single writer). The "POST" views answer with the result of their work unit (a dictionary
+    with "success"), so the response is stored together with the changes, and a process that stops right after
+    the commit can't leave the changes without their response"""
+
+    if not has_request_context() or not isinstance(result, dict) or "success" not in result:
+        return
+
+    key = g.get("idempotency_key")
+    if key is None or g.get("idempotency_stored"):
+        return
+
+    response = jsonify(result)
+    get_idempotency_store().store(db, key, response.status_code, response.content_type, response.get_data())
+    g.idempotency_stored = True
+
+
+def store_idempotent_response(response):
+    """Store the response of a request that has claimed an idempotency key (after_request hook),
+    if it has not been stored with the changes of the request already"""
+
+    key = g.pop("idempotency_key", None)
+    if key is None:
+        return response
+
+    store = get_idempotency_store()
+    store.untrack(key)
+
+    # Server errors are not stored, so that the request can be retried. Streamed responses can't be stored.
+    # A response that has been stored with the changes is kept (only a pending row is released)
+    if response.status_code >= 500 or response.is_streamed:
+        get_writer().run(store.release, key)
+    elif not g.pop("idempotency_stored", False):
+        get_writer().run(store.store, key, response.status_code, response.content_type, response.get_data())
+
+    return response
+
+
+def release_idempotency_key(exception=None):
+    """Release the key of a request that ended with an exception (teardown_request hook)"""
+
+    key = g.pop("idempotency_key", None)
+    if key is not None:
+        store = get_idempotency_store()
+        store.untrack(key)
+        get_writer().run(store.release, key)
+
+
+def get_idempotency_store(app=None):
+    """Return the idempotency store of the application"""
+
+    if app is None:
+        app = current_app
+    return app.extensions["idempotency_store"]
+
+
+def init_idempotency(app):
+    """Create the idempotency store of the application and register the request hooks"""
+
+    app.config.setdefault("IDEMPOTENCY_TTL", 86400)
+
+    app.extensions["idempotency_store"] = IdempotencyStore(ttl=app.config["IDEMPOTENCY_TTL"])
+    get_writer(app).result_hooks.append(store_unit_response)
+
+    app.before_request(check_idempotency_key)
+    app.after_request(store_idempotent_response)
+    app.teardown_request(release_idempotency_key)
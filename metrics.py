@@ -0,0 +1,314 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import current_app, request
+from flask.json import JSONEncoder
+
+from database import get_pool, get_writer
+
+# Upper bounds (in seconds) of the buckets of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Timings of the request that runs in the current context (None outside of requests).
+# A context variable (and not a thread local) follows the request in the ASGI mode too,
+# where the view and the chunks of a streamed response can run in different threads
+current_timings = ContextVar("current_timings", default=None)
+
+
+class RequestTimings:
+    """Time spent by one request in SQLite and in JSON serialization"""
+
+    __slots__ = ("started", "status", "sql_statements", "sql_time", "serialization_time", "slow_query_log")
+
+    def __init__(self, slow_query_log=None):
+        self.started = time.perf_counter()
+        self.status = 500
+        self.sql_statements = 0
+        self.sql_time = 0.0
+        self.serialization_time = 0.0
+        self.slow_query_log = slow_query_log
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that adds the time of every statement (and of fetching its rows) to the timings of the current request"""
+
+    def execute(self, *args):
+        timings = current_timings.get()
+        if timings is None:
+            return super().execute(*args)
+
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings.sql_time += elapsed
+            timings.sql_statements += 1
+            if timings.slow_query_log is not None and elapsed >= timings.slow_query_log.threshold:
+                timings.slow_query_log.record(self.connection, args, elapsed, many=False)
+
+    def executemany(self, *args):
+        timings = current_timings.get()
+        if timings is None:
+            return super().executemany(*args)
+
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings.sql_time += elapsed
+            timings.sql_statements += 1
+            if timings.slow_query_log is not None and elapsed >= timings.slow_query_log.threshold:
+                timings.slow_query_log.record(self.connection, args, elapsed, many=True)
+
+    # SQLite reads the rows of a query while they are fetched, so fetching counts as time in SQLite as well
+    def fetchone(self):
+        timings = current_timings.get()
+        if timings is None:
+            return super().fetchone()
+
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            timings.sql_time += time.perf_counter() - started
+
+    def fetchmany(self, *args):
+        timings = current_timings.get()
+        if timings is None:
+            return super().fetchmany(*args)
+
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            timings.sql_time += time.perf_counter() - started
+
+    def fetchall(self):
+        timings = current_timings.get()
+        if timings is None:
+            return super().fetchall()
+
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            timings.sql_time += time.perf_counter() - started
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are instrumented (including the cursors of conn.execute())"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """JSON encoder of the application (used by jsonify) that adds the encoding time to the timings of the current request"""
+
+    def encode(self, o):
+        timings = current_timings.get()
+        if timings is None:
+            return super().encode(o)
+
+        started = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            timings.serialization_time += time.perf_counter() - started
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-route request counters, latency histograms and SQL and serialization timings.
+
+    Routes are identified by their URL rule (e.g. "/item/<int:item_id>"), so the number of series
+    stays small whatever ids the clients request"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, method, route, status, duration, timings):
+        """Record a finished request"""
+
+        bucket = bisect_left(self.buckets, duration)
+
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = {
+                    "requests": {},
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "duration": 0.0,
+                    "sql_statements": 0,
+                    "sql_time": 0.0,
+                    "serialization_time": 0.0
+                }
+                self._routes[(method, route)] = metrics
+
+            metrics["requests"][status] = metrics["requests"].get(status, 0) + 1
+            metrics["buckets"][bucket] += 1
+            metrics["duration"] += duration
+            metrics["sql_statements"] += timings.sql_statements
+            metrics["sql_time"] += timings.sql_time
+            metrics["serialization_time"] += timings.serialization_time
+
+    def render(self, pool_stats=None, cache_stats=None, writer_stats=None):
+        """Return all metrics in the Prometheus text exposition format"""
+
+        with self._lock:
+            routes = {key: dict(metrics, requests=dict(metrics["requests"]), buckets=list(metrics["buckets"]))
+                      for key, metrics in self._routes.items()}
+
+        lines = []
+
+        def metric(name, metric_type, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def route_labels(method, route):
+            return f'method="{escape_label(method)}",route="{escape_label(route)}"'
+
+        metric("http_requests_total", "counter", "Number of requests by route and status code")
+        for (method, route), metrics in sorted(routes.items()):
+            for status, count in sorted(metrics["requests"].items()):
+                lines.append(f'http_requests_total{{{route_labels(method, route)},status="{status}"}} {count}')
+
+        metric("http_request_duration_seconds", "histogram", "Request latency by route (including streamed responses)")
+        for (method, route), metrics in sorted(routes.items()):
+            labels = route_labels(method, route)
+            cumulative = 0
+            for bound, count in zip(self.buckets, metrics["buckets"]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += metrics["buckets"][-1]
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics['duration']:.6f}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+        metric("sql_statements_total", "counter", "Number of SQL statements executed by route")
+        for (method, route), metrics in sorted(routes.items()):
+            lines.append(f"sql_statements_total{{{route_labels(method, route)}}} {metrics['sql_statements']}")
+
+        metric("sql_time_seconds_total", "counter", "Time spent in SQLite (executing statements and fetching rows) by route")
+        for (method, route), metrics in sorted(routes.items()):
+            lines.append(f"sql_time_seconds_total{{{route_labels(method, route)}}} {metrics['sql_time']:.6f}")
+
+        metric("serialization_time_seconds_total", "counter", "Time spent encoding JSON responses by route")
+        for (method, route), metrics in sorted(routes.items()):
+            lines.append(f"serialization_time_seconds_total{{{route_labels(method, route)}}} {metrics['serialization_time']:.6f}")
+
+        if pool_stats is not None:
+            metric("db_pool_connections", "gauge", "Database connections of the pool by state")
+            lines.append(f'db_pool_connections{{state="in_use"}} {pool_stats["in_use"]}')
+            lines.append(f'db_pool_connections{{state="idle"}} {pool_stats["idle"]}')
+            metric("db_pool_waits_total", "counter", "Number of times a request waited for a free connection")
+            lines.append(f"db_pool_waits_total {pool_stats['waits']}")
+            metric("db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection")
+            lines.append(f"db_pool_wait_seconds_total {pool_stats['wait_time']:.6f}")
+            metric("db_pool_timeouts_total", "counter", "Number of requests that got no connection before the pool timeout")
+            lines.append(f"db_pool_timeouts_total {pool_stats['timeouts']}")
+
+        if cache_stats is not None:
+            metric("reference_cache_requests_total", "counter", "Reference data cache lookups by result")
+            lines.append(f'reference_cache_requests_total{{result="hit"}} {cache_stats["hits"]}')
+            lines.append(f'reference_cache_requests_total{{result="miss"}} {cache_stats["misses"]}')
+
+        if writer_stats is not None:
+            metric("db_writer_units_total", "counter", "Number of work units committed by the single writer")
+            lines.append(f"db_writer_units_total {writer_stats['units']}")
+            metric("db_writer_commits_total", "counter", "Number of transactions committed by the single writer (one per group of work units)")
+            lines.append(f"db_writer_commits_total {writer_stats['commits']}")
+            metric("db_writer_failed_commits_total", "counter", "Number of groups of work units that could not be committed")
+            lines.append(f"db_writer_failed_commits_total {writer_stats['failed_commits']}")
+            metric("db_writer_queued", "gauge", "Number of work units waiting for the single writer")
+            lines.append(f"db_writer_queued {writer_stats['queued']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def start_request_timings():
+    """Start the timings of a request (before_request hook)"""
+
+    current_timings.set(RequestTimings(current_app.extensions.get("slow_query_log")))
+
+
+def record_response_status(response):
+    """Remember the status code of the response (after_request hook)"""
+
+    timings = current_timings.get()
+    if timings is not None:
+        timings.status = response.status_code
+    return response
+
+
+def record_request_metrics(exception=None):
+    """Record the finished request (teardown_request hook, which runs after a streamed response has been sent)"""
+
+    timings = current_timings.get()
+    if timings is None:
+        return
+    current_timings.set(None)
+
+    metrics = get_metrics()
+    if metrics is None:
+        return
+
+    duration = time.perf_counter() - timings.started
+    metrics.observe(request.method, request_route(), timings.status, duration, timings)
+
+
+def request_route():
+    """Return the URL rule of the current request (e.g. "/item/<int:item_id>"), or "unmatched" for unknown URLs"""
+
+    if request.url_rule is None:
+        return "unmatched"
+    return request.url_rule.rule
+
+
+def get_metrics(app=None):
+    """Return the metrics of the application (None if metrics are disabled)"""
+
+    if app is None:
+        app = current_app
+    return app.extensions.get("metrics")
+
+
+def instrument_app(app):
+    """Instrument the database connections and the JSON encoder, and register the request hooks.
+    Used by the metrics and by the slow query log; calling it again does nothing"""
+
+    if app.extensions.get("instrumented"):
+        return
+    app.extensions["instrumented"] = True
+
+    # The pool and the writer open their connections lazily, so all of them are instrumented
+    get_pool(app).factory = InstrumentedConnection
+    get_writer(app).factory = InstrumentedConnection
+    app.json_encoder = TimedJSONEncoder
+
+    app.before_request(start_request_timings)
+    app.after_request(record_response_status)
+    app.teardown_request(record_request_metrics)
+
+
+def init_metrics(app):
+    """Create the metrics of the application, if they are enabled"""
+
+    app.config.setdefault("METRICS_ENABLED", True)
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    app.extensions["metrics"] = Metrics()
+    instrument_app(app)
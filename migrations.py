@@ -0,0 +1,376 @@
+import sqlite3
+import sys
+from datetime import datetime
+
+from stock_ledger import CREATE_STOCK_LEDGER, REBUILD_STOCK_LEDGER
+
+
+class MigrationError(Exception):
+    """Raised when a migration can't be applied to the data that is in the database"""
+
+
+def require_unique(*constraints):
+    """Return a migration step that checks the data before unique indexes are created. Every constraint is a tuple
+    (table name, id column, columns). If rows of a table have the same values in the columns, the step raises
+    a MigrationError that lists them, so that they can be merged or renamed before the migration is applied again
+    (the index creation would only fail with "UNIQUE constraint failed")"""
+
+    def check(conn):
+        duplicates = []
+        for table_name, id_column, columns in constraints:
+            # Like a unique index, rows with a NULL value are never duplicates
+            rows = conn.execute(f"""SELECT {', '.join(columns)}, GROUP_CONCAT({id_column}, ', ')
+                FROM {table_name}
+                WHERE {' AND '.join(f'{column} IS NOT NULL' for column in columns)}
+                GROUP BY {', '.join(columns)}
+                HAVING COUNT(*) > 1""").fetchall()
+            for row in rows:
+                values = ", ".join(f"{column}={value!r}" for column, value in zip(columns, row))
+                duplicates.append(f"{table_name} {row[-1]} ({values})")
+
+        if duplicates:
+            raise MigrationError("The database has duplicate rows that must be merged or renamed first: " + "; ".join(duplicates))
+
+    return check
+
+
+# Every migration is a tuple (version, description, statements).
+# A statement is an SQL string, or a function that is called with the connection (e.g. a check of the data).
+# Migrations are applied in order and each applied version is recorded in the schema_migrations table,
+# so running the migrations again only applies the ones that are missing.
+MIGRATIONS = [
+    (1, "Initial schema", [
+        """ CREATE TABLE IF NOT EXISTS partners (
+        partner_id integer PRIMARY KEY,
+        partner_name text NOT NULL,
+        partner_address text,
+        partner_manager_first_name text,
+        partner_manager_last_name text
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS bills (
+        bill_id integer PRIMARY KEY,
+        bill_number text NOT NULL,
+        bill_date date NOT NULL,
+        bill_due_date date NOT NULL,
+        bill_amount integer NOT NULL,
+        partner_id integer,
+        FOREIGN KEY (partner_id) REFERENCES partnters(partner_id) ON UPDATE CASCADE ON DELETE CASCADE
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS vat_rates (
+        vat_rate_id integer PRIMARY KEY,
+        vat_rate integer
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS units_of_measure (
+        unit_id integer PRIMARY KEY,
+        unit_acronym text NOT NULL,
+        unit_name text NOT NULL
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS items (
+        item_id integer PRIMARY KEY,
+        item_code text NUT NULL,
+        item_description text NOT NULL,
+        unit_id integer NOT NULL,
+        vat_rate_id integer NOT NULL,
+        item_quantity numeric DEFAULT 0,
+        latest_purchase_price numeric DEFAULT 0,
+        average_purchase_price numeric DEFAULT 0,
+        latest_net_selling_price numeric DEFAULT 0,
+        average_net_selling_price numeric DEFAULT 0,
+        FOREIGN KEY (unit_id) REFERENCES units_of_measure(unit_id) ON UPDATE CASCADE ON DELETE CASCADE,
+        FOREIGN KEY (vat_rate_id) REFERENCES vat_rates(vat_rate_id) ON UPDATE CASCADE ON DELETE CASCADE
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS bill_records (
+        bill_record_id integer PRIMARY KEY,
+        item_id integer NOT NULL,
+        quantity numeric NOT NULL,
+        price numeric NOT NULL,
+        bill_record_amount_net numeric NOT NULL,
+        bill_record_vat numeric NOT NULL,
+        bill_record_amount_total integer NOT NULL,
+        bill_id integer NOT NULL,
+        FOREIGN KEY (item_id) REFERENCES items (item_id) ON UPDATE CASCADE ON DELETE CASCADE,
+        FOREIGN KEY (bill_id) REFERENCES bills (bill_id) ON UPDATE CASCADE ON DELETE CASCADE
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS invoices (
+        invoice_id integer PRIMARY KEY,
+        invoice_number text NOT NULL,
+        invoice_date date NOT NULL,
+        invoice_due_date date NOT NULL,
+        invoice_amount_net integer,
+        invoice_vat integer,
+        invoice_amount_total integer,
+        partner_id integer NOT NULL,
+        FOREIGN KEY (partner_id) REFERENCES partners(partner_id) ON UPDATE CASCADE ON DELETE CASCADE
+        ) """,
+
+        """ CREATE TABLE IF NOT EXISTS invoice_records (
+        invoice_record_id integer PRIMARY KEY,
+        item_id integer NOT NULL,
+        quantity numeric NOT NULL,
+        net_selling_price numeric NOT NULL,
+        invoice_record_amount_net numeric NOT NULL,
+        invoice_record_vat numeric NOT NULL,
+        invoice_record_amount_total integer NOT NULL,
+        invoice_id integer NOT NULL,
+        average_purchase_price numeric NOT NULL,
+        vat_amount_per_unit numeric NOT NULL,
+        gross_selling_price numeric NOT NULL,
+        FOREIGN KEY (item_id) REFERENCES items(item_id) ON UPDATE CASCADE ON DELETE CASCADE
+        ) """
+    ]),
+
+    (2, "Indexes for the lookups, duplicate checks and stock queries", [
+        "CREATE INDEX IF NOT EXISTS idx_partners_partner_name ON partners (partner_name)",
+        "CREATE INDEX IF NOT EXISTS idx_items_item_code ON items (item_code)",
+        "CREATE INDEX IF NOT EXISTS idx_items_item_description ON items (item_description)",
+        "CREATE INDEX IF NOT EXISTS idx_vat_rates_vat_rate ON vat_rates (vat_rate)",
+        "CREATE INDEX IF NOT EXISTS idx_units_of_measure_unit_acronym ON units_of_measure (unit_acronym)",
+        "CREATE INDEX IF NOT EXISTS idx_units_of_measure_unit_name ON units_of_measure (unit_name)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON bills (bill_date)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_partner_id ON bills (partner_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_bill_number_partner_id ON bills (bill_number, partner_id)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices (invoice_date)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_invoice_number ON invoices (invoice_number)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_partner_id ON invoices (partner_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bill_records_item_id_bill_id ON bill_records (item_id, bill_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bill_records_bill_id ON bill_records (bill_id)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_records_item_id_invoice_id ON invoice_records (item_id, invoice_id)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_records_invoice_id ON invoice_records (invoice_id)"
+    ]),
+
+    (3, "Sequences for numbering invoices", [
+        """ CREATE TABLE IF NOT EXISTS sequences (
+        sequence_name text PRIMARY KEY,
+        last_value integer NOT NULL
+        ) """,
+
+        # Continue the continuous invoice numbering from the highest existing invoice number
+        """ INSERT OR IGNORE INTO sequences (sequence_name, last_value)
+        SELECT 'invoices:', MAX(CAST(invoice_number AS integer)) FROM invoices
+        WHERE invoice_number NOT GLOB '*[^0-9]*'
+        HAVING COUNT(*) > 0 """
+    ]),
+
+    (4, "Per-item stock ledger with running quantity and value", [
+        CREATE_STOCK_LEDGER,
+        REBUILD_STOCK_LEDGER
+    ]),
+
+    (5, "Change versions of the tables", [
+        """ CREATE TABLE IF NOT EXISTS table_versions (
+        table_name text PRIMARY KEY,
+        version integer NOT NULL
+        ) """
+    ]),
+
+    # The duplicate checks are enforced by the database, so the inserts use "ON CONFLICT DO NOTHING" instead of a SELECT first.
+    # The unique indexes replace the plain indexes of the same columns. Older versions allowed some duplicates
+    # (e.g. a partner could be renamed to the name of another partner), so they are reported before anything is changed
+    (6, "Unique constraints for partners, items, VAT rates, units of measure and bills", [
+        require_unique(
+            ("partners", "partner_id", ["partner_name"]),
+            ("items", "item_id", ["item_code"]),
+            ("items", "item_id", ["item_description"]),
+            ("vat_rates", "vat_rate_id", ["vat_rate"]),
+            ("units_of_measure", "unit_id", ["unit_acronym"]),
+            ("units_of_measure", "unit_id", ["unit_name"]),
+            ("bills", "bill_id", ["bill_number", "partner_id", "bill_date", "bill_due_date", "bill_amount"])
+        ),
+        "DROP INDEX IF EXISTS idx_partners_partner_name",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_partners_partner_name_unique ON partners (partner_name)",
+        "DROP INDEX IF EXISTS idx_items_item_code",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_items_item_code_unique ON items (item_code)",
+        "DROP INDEX IF EXISTS idx_items_item_description",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_items_item_description_unique ON items (item_description)",
+        "DROP INDEX IF EXISTS idx_vat_rates_vat_rate",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_vat_rates_vat_rate_unique ON vat_rates (vat_rate)",
+        "DROP INDEX IF EXISTS idx_units_of_measure_unit_acronym",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_units_of_measure_unit_acronym_unique ON units_of_measure (unit_acronym)",
+        "DROP INDEX IF EXISTS idx_units_of_measure_unit_name",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_units_of_measure_unit_name_unique ON units_of_measure (unit_name)",
+        "DROP INDEX IF EXISTS idx_bills_bill_number_partner_id",
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_unique
+        ON bills (bill_number, partner_id, bill_date, bill_due_date, bill_amount)"""
+    ]),
+
+    # Responses of "POST" requests sent with an Idempotency-Key header (see idempotency.py).
+    # A row without a status is a request that is still running
+    (7, "Idempotency keys and their stored responses", [
+        """ CREATE TABLE IF NOT EXISTS idempotency_keys (
+        idempotency_key text PRIMARY KEY,
+        request_hash text NOT NULL,
+        status integer,
+        content_type text,
+        body blob,
+        expires_at real NOT NULL
+        ) """,
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)"
+    ])
+]
+
+# The queries that run on every request of the busiest endpoints, with sample parameters.
+# check_query_plans() makes sure none of them falls back to a full table scan.
+HOT_QUERIES = {
+    "bills of partner": ("SELECT * FROM bills WHERE partner_id = :partner_id", {"partner_id": 1}),
+    "invoices of partner": ("SELECT * FROM invoices WHERE partner_id = :partner_id", {"partner_id": 1}),
+    "bill records of item": ("SELECT * FROM bill_records WHERE item_id = :item_id", {"item_id": 1}),
+    "invoice records of item": ("SELECT * FROM invoice_records WHERE item_id = :item_id", {"item_id": 1}),
+    "purchased quantity up to date": ("""SELECT SUM(quantity), SUM(bill_record_amount_net)
+        FROM bill_records
+        JOIN bills ON bill_records.bill_id = bills.bill_id
+        WHERE
+        item_id = :item_id AND
+        bills.bill_date <= :invoice_date""", {"item_id": 1, "invoice_date": "x"}),
+    "sold quantity up to date": ("""SELECT SUM(quantity), SUM(quantity*average_purchase_price)
+        FROM invoice_records
+        JOIN invoices ON invoice_records.invoice_id = invoices.invoice_id
+        WHERE
+        item_id = :item_id AND
+        invoices.invoice_date <= :invoice_date""", {"item_id": 1, "invoice_date": "x"}),
+    "item purchase totals": ("""SELECT SUM(bill_record_amount_net), SUM(quantity)
+        FROM bill_records
+        WHERE item_id = :item_id""", {"item_id": 1}),
+    "item sales totals": ("""SELECT SUM(invoice_record_amount_net), SUM(quantity)
+        FROM invoice_records
+        WHERE item_id = :item_id""", {"item_id": 1}),
+    "bills ordered by date": ("SELECT * FROM bills ORDER BY bill_date", {}),
+    "invoices ordered by number": ("SELECT * FROM invoices ORDER BY invoice_number", {}),
+    "stock as of date": ("""SELECT running_quantity, running_value FROM stock_ledger
+        WHERE item_id = :item_id AND ledger_date <= :ledger_date
+        ORDER BY ledger_date DESC
+        LIMIT 1""", {"item_id": 1, "ledger_date": "x"}),
+    "bills page after cursor": ("""SELECT * FROM bills WHERE (bill_date, bill_id) > (:after_0, :after_1)
+        ORDER BY bill_date, bill_id LIMIT :limit""", {"after_0": "x", "after_1": 1, "limit": 100}),
+    "invoices page after cursor": ("""SELECT * FROM invoices WHERE (invoice_number, invoice_id) > (:after_0, :after_1)
+        ORDER BY invoice_number, invoice_id LIMIT :limit""", {"after_0": "x", "after_1": 1, "limit": 100}),
+    "idempotency key": ("""SELECT request_hash, status, content_type, body FROM idempotency_keys
+        WHERE idempotency_key = :idempotency_key AND expires_at > :now""", {"idempotency_key": "x", "now": 0}),
+    "expired idempotency keys": ("DELETE FROM idempotency_keys WHERE expires_at <= :now", {"now": 0})
+}
+
+
+def schema_version(conn):
+    """Return the latest applied schema version (0 if no migration has been applied)"""
+
+    conn.execute(""" CREATE TABLE IF NOT EXISTS schema_migrations (
+        version integer PRIMARY KEY,
+        description text NOT NULL,
+        applied_at text NOT NULL
+        ) """)
+    version = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0]
+    if version is None:
+        return 0
+    return version
+
+
+def set_journal_mode(conn, journal_mode="wal"):
+    """Set the journal mode of the database and return the mode that is now in use.
+    The WAL mode is stored in the database file, so it stays on for all connections that are opened later.
+    In the WAL mode, readers never block the writer and the writer never blocks readers"""
+
+    return conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchone()[0]
+
+
+def migrate(database, target=None, journal_mode="wal", timeout=60.0):
+    """Set the journal mode (None keeps the current one) and apply all migrations that have not been applied yet
+    (up to the target version, if provided). Return the schema version of the database after migrating.
+
+    Several processes (e.g. gunicorn workers) can migrate the same database at the same time: every migration
+    takes the write lock first ("BEGIN IMMEDIATE") and reads the schema version again inside that transaction,
+    so a process that waited for the lock sees the migration of the other process and doesn't apply it again.
+    timeout is the number of seconds a process waits for the lock"""
+
+    conn = sqlite3.connect(database, timeout=timeout)
+    try:
+        if journal_mode is not None:
+            set_journal_mode(conn, journal_mode)
+
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = schema_version(conn)
+                pending = [migration for migration in MIGRATIONS if migration[0] > current]
+                if not pending or (target is not None and pending[0][0] > target):
+                    conn.commit()
+                    return current
+
+                # Each migration is applied in its own transaction, together with its schema_migrations row
+                version, description, statements = pending[0]
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)", {
+                    "version": version,
+                    "description": description,
+                    "applied_at": datetime.now().isoformat(timespec="seconds")
+                })
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    finally:
+        conn.close()
+
+
+def explain_query_plan(conn, query, params):
+    """Return the EXPLAIN QUERY PLAN details of a query"""
+
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+
+
+def check_query_plans(conn, queries=None):
+    """Return a dictionary of the hot queries that do a full table scan, with their query plans.
+    An empty dictionary means that all hot queries use an index"""
+
+    if queries is None:
+        queries = HOT_QUERIES
+
+    failures = {}
+    for name, (query, params) in queries.items():
+        plan = explain_query_plan(conn, query, params)
+
+        # "SCAN table" (without "USING ... INDEX") means that SQLite reads the whole table
+        scans = [detail for detail in plan if detail.startswith("SCAN") and "INDEX" not in detail]
+
+        # Sorting without an index is just as bad for the ORDER BY queries
+        scans += [detail for detail in plan if detail.startswith("USE TEMP B-TREE FOR ORDER BY")]
+
+        if scans:
+            failures[name] = plan
+
+    return failures
+
+
+if __name__ == "__main__":
+    database = "database.sqlite3"
+    args = sys.argv[1:]
+    if args and not args[0].startswith("--"):
+        database = args.pop(0)
+
+    try:
+        version = migrate(database)
+    except MigrationError as e:
+        print(f"{database} can't be migrated: {e}")
+        sys.exit(1)
+    print(f"{database} is at schema version {version}")
+
+    # "--check" fails (exit code 1) if a hot query does a full table scan
+    if "--check" in args:
+        conn = sqlite3.connect(database)
+        failures = check_query_plans(conn)
+        conn.close()
+
+        for name, plan in failures.items():
+            print(f"Full table scan in query '{name}': {'; '.join(plan)}")
+
+        if failures:
+            sys.exit(1)
+        print("All hot queries use an index")
@@ -0,0 +1,89 @@
+import threading
+
+from flask import current_app
+
+from database import table_version
+
+
+class ReferenceCache:
+    """In-process cache of the reference tables (VAT rates and units of measure), which rarely change.
+
+    Every table is loaded the first time it is needed. Before cached data is used, the change version
+    of the table (from the table_versions table) is compared with the version the data was loaded at,
+    so a change made by another process is never missed. The POST handlers of the reference tables
+    bump the version in the same transaction in which they insert the data"""
+
+    LOADERS = {
+        "vat_rates": "SELECT vat_rate_id, vat_rate FROM vat_rates",
+        "units_of_measure": "SELECT unit_id, unit_acronym, unit_name FROM units_of_measure"
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._hits = 0
+        self._misses = 0
+
+    def _get(self, db, table_name):
+        """Return the cached rows of a table as a dictionary {id: row}, reloading them if the table has changed"""
+
+        version = table_version(db, table_name)
+
+        with self._lock:
+            cached = self._tables.get(table_name)
+            if cached is not None and cached[0] == version:
+                self._hits += 1
+                return cached[1]
+            self._misses += 1
+
+        rows = {row[0]: row for row in db.execute(self.LOADERS[table_name]).fetchall()}
+
+        with self._lock:
+            self._tables[table_name] = (version, rows)
+        return rows
+
+    def vat_rate(self, db, vat_rate_id):
+        """Return the VAT rate with the provided id, or None if there is no such VAT rate"""
+
+        row = self._get(db, "vat_rates").get(vat_rate_id)
+        if row is None:
+            return None
+        return row[1]
+
+    def units_of_measure(self, db):
+        """Return {unit_id: (unit_id, unit_acronym, unit_name)} for all units of measure"""
+
+        return self._get(db, "units_of_measure")
+
+    def invalidate(self, table_name=None):
+        """Drop the cached rows of a table (or of all tables) in this process"""
+
+        with self._lock:
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+    def stats(self):
+        """Return the cache counters and the versions of the cached tables"""
+
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "tables": {table_name: cached[0] for table_name, cached in self._tables.items()}
+            }
+
+
+def get_reference_cache(app=None):
+    """Return the reference data cache of the application"""
+
+    if app is None:
+        app = current_app
+    return app.extensions["reference_cache"]
+
+
+def init_reference_cache(app):
+    """Create the reference data cache of the application"""
+
+    app.extensions["reference_cache"] = ReferenceCache()
@@ -0,0 +1,48 @@
+# Quantity on hand, average purchase price and stock value of every item at the end of a date.
+# The purchases and sales of all items are summed with one grouped query each, and the stock math
+# (quantity, value, average price) is done by SQLite for all items at once, so no per-item queries are needed.
+# Sales are valued at the average purchase price stored with every invoice record, like in the stock ledger.
+# {total} is replaced with the column of the total value (or with nothing), see below.
+VALUATION_SELECT = """SELECT item_id, item_code, item_description, quantity,
+    CASE WHEN quantity = 0 THEN 0 ELSE value * 1.0 / quantity END AS average_purchase_price,
+    value{total}
+    FROM (
+        SELECT items.item_id, items.item_code, items.item_description,
+        COALESCE(purchases.quantity, 0) - COALESCE(sales.quantity, 0) AS quantity,
+        COALESCE(purchases.value, 0) - COALESCE(sales.value, 0) AS value
+        FROM items
+        LEFT JOIN (
+            SELECT bill_records.item_id AS item_id, SUM(bill_records.quantity) AS quantity, SUM(bill_records.bill_record_amount_net) AS value
+            FROM bill_records
+            JOIN bills ON bill_records.bill_id = bills.bill_id
+            WHERE bills.bill_date <= :as_of
+            GROUP BY bill_records.item_id
+        ) AS purchases ON purchases.item_id = items.item_id
+        LEFT JOIN (
+            SELECT invoice_records.item_id AS item_id, SUM(invoice_records.quantity) AS quantity,
+            SUM(invoice_records.quantity * invoice_records.average_purchase_price) AS value
+            FROM invoice_records
+            JOIN invoices ON invoice_records.invoice_id = invoices.invoice_id
+            WHERE invoices.invoice_date <= :as_of
+            GROUP BY invoice_records.item_id
+        ) AS sales ON sales.item_id = items.item_id
+    )
+    ORDER BY item_id"""
+
+VALUATION_REPORT = VALUATION_SELECT.format(total="")
+
+# The same report with the total value of all items as an extra last column (the same value in every row),
+# so that the total is summed by SQLite in the same query
+VALUATION_REPORT_WITH_TOTAL = VALUATION_SELECT.format(total=",\n    SUM(value) OVER () AS total_value")
+
+# The columns of an item of the report (without the total value)
+VALUATION_COLUMNS = ["item_id", "item_code", "item_description", "quantity", "average_purchase_price", "value"]
+
+
+def inventory_valuation(db, as_of, with_total=False):
+    """Execute the valuation report for the end of a date (yyyy-mm-dd) and return the cursor with its rows.
+    with_total adds the total value of all items as the last column"""
+
+    if with_total:
+        return db.execute(VALUATION_REPORT_WITH_TOTAL, {"as_of": as_of})
+    return db.execute(VALUATION_REPORT, {"as_of": as_of})
@@ -0,0 +1,112 @@
+import json
+import time
+from functools import lru_cache
+from operator import itemgetter
+
+from flask import Response
+
+from metrics import current_timings
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (it is not in "requirements.txt"). Without it, the json module of the standard library is used
+    orjson = None
+
+# Encoders of the standard library, with the separators of jsonify (no spaces).
+# The rows of a query are built with their keys already sorted, so they are encoded without sorting (and without
+# the check for circular references, which rows can't have), which is much faster than sorting the keys of every row
+_sorted_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+_row_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+
+
+def dumps(value):
+    """Encode a value as JSON bytes, with sorted keys (like jsonify)"""
+
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return _sorted_encoder.encode(value).encode()
+
+
+@lru_cache(maxsize=256)
+def row_builder(keys):
+    """Return a function that turns a list of rows into a list of dictionaries with the keys, in sorted order.
+    The sorted keys and the order in which the values of a row are taken are computed once per list of keys"""
+
+    order = sorted(range(len(keys)), key=lambda i: keys[i])
+    sorted_keys = tuple(keys[i] for i in order)
+
+    if order == list(range(len(keys))):
+        def build(rows):
+            return [dict(zip(sorted_keys, row)) for row in rows]
+    else:
+        # itemgetter returns the values of a row in the order of the sorted keys
+        values = itemgetter(*order)
+
+        def build(rows):
+            return [dict(zip(sorted_keys, values(row))) for row in rows]
+
+    return build
+
+
+class RowEncoder:
+    """Encodes the rows of a query as JSON objects. The keys are the column names of the query
+    (cursor.description, so a column is renamed with "AS"). They are mapped to the row values once per query,
+    in sorted order, so every row becomes a dictionary whose keys are already sorted"""
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.dicts = row_builder(self.keys)
+
+    @classmethod
+    def for_cursor(cls, cursor):
+        """Return the encoder of the rows of an executed cursor"""
+
+        return cls([column[0] for column in cursor.description])
+
+    def encode(self, rows):
+        """Encode the rows as a JSON array (bytes)"""
+
+        if orjson is not None:
+            return orjson.dumps(self.dicts(rows))
+        return _row_encoder.encode(self.dicts(rows)).encode()
+
+    def encode_lines(self, rows):
+        """Encode the rows as NDJSON (bytes): one JSON object per line"""
+
+        if orjson is not None:
+            option = orjson.OPT_APPEND_NEWLINE
+            return b"".join([orjson.dumps(row, option=option) for row in self.dicts(rows)])
+        encode = _row_encoder.encode
+        return "".join([encode(row) + "\n" for row in self.dicts(rows)]).encode()
+
+
+def record_serialization_time(started):
+    """Add the time since started to the serialization time of the current request (see metrics.py)"""
+
+    timings = current_timings.get()
+    if timings is not None:
+        timings.serialization_time += time.perf_counter() - started
+
+
+def list_response(fields, list_name, cursor, rows, keys=None):
+    """Return the JSON response of a list endpoint: the fields (e.g. "success" and "next_cursor")
+    and the rows of the cursor under the key list_name. The rows are encoded straight from the tuples
+    that SQLite returns, and the document is put together in the order of the sorted keys, like jsonify does.
+    keys are the keys of the first columns of the rows (default: the column names of the cursor); the other columns are left out"""
+
+    started = time.perf_counter()
+
+    parts = []
+    for key in sorted([*fields, list_name]):
+        if key == list_name:
+            encoder = RowEncoder.for_cursor(cursor) if keys is None else RowEncoder(keys)
+            value = encoder.encode(rows)
+        else:
+            value = dumps(fields[key])
+        parts.append(dumps(key) + b":" + value)
+    body = b"{" + b",".join(parts) + b"}\n"
+
+    record_serialization_time(started)
+
+    return Response(body, mimetype="application/json")
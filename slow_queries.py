@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from flask import has_request_context, request
+
+from metrics import instrument_app, request_route
+
+
+def redact(value):
+    """Replace a bound parameter with its type (and length), so that no data ends up in the log"""
+
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_params(params):
+    """Redact named (dictionary) or positional (sequence) parameters"""
+
+    if isinstance(params, dict):
+        return {name: redact(value) for name, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact(value) for value in params]
+    return None
+
+
+class SlowQueryLog:
+    """Writes every statement that takes at least threshold seconds as a JSON line:
+    the SQL, the redacted parameters, the duration, the route of the request and the EXPLAIN QUERY PLAN output.
+    A plan with "SCAN table" (and no index) shows which query lacks an index"""
+
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+        # "-" writes the log to the standard error
+        if path == "-":
+            self._file = sys.stderr
+        else:
+            self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def explain(self, conn, sql, params):
+        """Return the query plan of a statement (None if the statement can't be explained)"""
+
+        # A plain cursor, so that the EXPLAIN statement itself is not timed (and never logged)
+        try:
+            cursor = sqlite3.Cursor(conn)
+            if params is None:
+                rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            else:
+                rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error:
+            return None
+
+        return [row[3] for row in rows]
+
+    def record(self, conn, args, duration, many=False):
+        """Write a slow statement to the log. args are the arguments of execute() or executemany()"""
+
+        sql = args[0]
+        params = args[1] if len(args) > 1 else None
+
+        # executemany() gets a sequence of parameter sets; the first one is logged and explained
+        if many:
+            count = len(params) if isinstance(params, (list, tuple)) else None
+            params = params[0] if count else None
+        else:
+            count = None
+
+        entry = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "duration_ms": round(duration * 1000, 3),
+            "route": request_route() if has_request_context() else None,
+            "method": request.method if has_request_context() else None,
+            "sql": " ".join(sql.split()),
+            "params": redact_params(params),
+            "plan": self.explain(conn, sql, params)
+        }
+        if many:
+            entry["executemany"] = count
+
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+
+def init_slow_query_log(app):
+    """Create the slow query log of the application, if a threshold is configured"""
+
+    app.config.setdefault("SLOW_QUERY_THRESHOLD", None)
+    app.config.setdefault("SLOW_QUERY_LOG", "slow_queries.log")
+    if app.config["SLOW_QUERY_THRESHOLD"] is None:
+        return
+
+    app.extensions["slow_query_log"] = SlowQueryLog(app.config["SLOW_QUERY_LOG"], app.config["SLOW_QUERY_THRESHOLD"])
+    instrument_app(app)
+
+
+if __name__ == "__main__":
+    # Usage: python slow_queries.py [log file]
+    # Summarizes the log: every statement with its count, total and maximum duration, and its plan
+    path = sys.argv[1] if len(sys.argv) > 1 else "slow_queries.log"
+
+    statements = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            summary = statements.setdefault(entry["sql"], {"count": 0, "total_ms": 0, "max_ms": 0, "routes": set(), "plan": entry["plan"]})
+            summary["count"] += 1
+            summary["total_ms"] += entry["duration_ms"]
+            summary["max_ms"] = max(summary["max_ms"], entry["duration_ms"])
+            summary["routes"].add(f"{entry['method']} {entry['route']}")
+
+    for sql, summary in sorted(statements.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+        plan = summary["plan"] or []
+        missing_index = any(detail.startswith("SCAN") and "INDEX" not in detail for detail in plan)
+        print(f"{summary['count']} x, {summary['total_ms']:.1f} ms total, {summary['max_ms']:.1f} ms max{' (full table scan)' if missing_index else ''}")
+        print(f"  {sql}")
+        print(f"  routes: {', '.join(sorted(summary['routes']))}")
+        print(f"  plan: {'; '.join(plan)}")
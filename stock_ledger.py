@@ -0,0 +1,197 @@
+import sqlite3
+import sys
+from datetime import timedelta
+
+# The stock ledger keeps one row per item and date on which the stock of the item changed.
+# quantity_delta and value_delta are the changes on that date (purchases are positive, sales are negative,
+# and sales are valued at their average purchase price), and running_quantity and running_value
+# are the quantity and value on stock at the end of that date.
+CREATE_STOCK_LEDGER = """ CREATE TABLE IF NOT EXISTS stock_ledger (
+    item_id integer NOT NULL,
+    ledger_date date NOT NULL,
+    quantity_delta numeric NOT NULL DEFAULT 0,
+    value_delta numeric NOT NULL DEFAULT 0,
+    running_quantity numeric NOT NULL DEFAULT 0,
+    running_value numeric NOT NULL DEFAULT 0,
+    PRIMARY KEY (item_id, ledger_date)
+    ) WITHOUT ROWID """
+
+# All stock movements, computed from the bill records and invoice records
+STOCK_MOVEMENTS = """
+    SELECT bill_records.item_id AS item_id, bills.bill_date AS ledger_date,
+    bill_records.quantity AS quantity, bill_records.bill_record_amount_net AS value
+    FROM bill_records
+    JOIN bills ON bill_records.bill_id = bills.bill_id
+    UNION ALL
+    SELECT invoice_records.item_id, invoices.invoice_date,
+    -invoice_records.quantity, -(invoice_records.quantity * invoice_records.average_purchase_price)
+    FROM invoice_records
+    JOIN invoices ON invoice_records.invoice_id = invoices.invoice_id """
+
+REBUILD_STOCK_LEDGER = f""" INSERT INTO stock_ledger (item_id, ledger_date, quantity_delta, value_delta, running_quantity, running_value)
+    SELECT item_id, ledger_date, SUM(quantity), SUM(value),
+    SUM(SUM(quantity)) OVER item_dates,
+    SUM(SUM(value)) OVER item_dates
+    FROM ({STOCK_MOVEMENTS})
+    GROUP BY item_id, ledger_date
+    WINDOW item_dates AS (PARTITION BY item_id ORDER BY ledger_date) """
+
+# Differences smaller than this are rounding errors of the running sums
+TOLERANCE = 1e-6
+
+
+def record_stock_movement(db, item_id, ledger_date, quantity, value):
+    """Add a stock movement (a bill record or an invoice record) to the stock ledger.
+    Must run in the same transaction that inserts the record"""
+
+    # Create the row of the date, starting from the stock at the end of the previous date
+    previous_quantity, previous_value = stock_as_of(db, item_id, ledger_date)
+    db.execute("""INSERT OR IGNORE INTO stock_ledger (item_id, ledger_date, running_quantity, running_value)
+    VALUES (:item_id, :ledger_date, :running_quantity, :running_value)""", {
+        "item_id": item_id,
+        "ledger_date": ledger_date,
+        "running_quantity": previous_quantity,
+        "running_value": previous_value
+    })
+
+    db.execute("""UPDATE stock_ledger SET
+    quantity_delta = quantity_delta + :quantity,
+    value_delta = value_delta + :value
+    WHERE item_id = :item_id AND ledger_date = :ledger_date""", {
+        "quantity": quantity,
+        "value": value,
+        "item_id": item_id,
+        "ledger_date": ledger_date
+    })
+
+    # The movement changes the stock on its date and on all later dates.
+    # Usually the movement is on the latest date, so only one row gets updated
+    db.execute("""UPDATE stock_ledger SET
+    running_quantity = running_quantity + :quantity,
+    running_value = running_value + :value
+    WHERE item_id = :item_id AND ledger_date >= :ledger_date""", {
+        "quantity": quantity,
+        "value": value,
+        "item_id": item_id,
+        "ledger_date": ledger_date
+    })
+
+
+def stock_as_of(db, item_id, ledger_date):
+    """Return the quantity and value of an item on stock at the end of a date"""
+
+    data = db.execute("""SELECT running_quantity, running_value FROM stock_ledger
+    WHERE item_id = :item_id AND ledger_date <= :ledger_date
+    ORDER BY ledger_date DESC
+    LIMIT 1""", {
+        "item_id": item_id,
+        "ledger_date": ledger_date
+    }).fetchone()
+
+    if data is None:
+        return 0, 0
+    return data[0], data[1]
+
+
+def average_cost(quantity, value):
+    """Return the average purchase price of the quantity on stock (0 if there is nothing on stock)"""
+
+    if not quantity:
+        return 0
+    return value / quantity
+
+
+def stock_series(db, item_id, date_from, date_to):
+    """Return the quantity, value and average purchase price of an item on stock at the end of every day
+    from date_from to date_to (both are datetime.date objects), as a list of dictionaries"""
+
+    # Start from the stock at the end of the day before the range, then apply the ledger rows of the range
+    quantity, value = stock_as_of(db, item_id, (date_from - timedelta(days=1)).isoformat())
+    data = db.execute("""SELECT ledger_date, running_quantity, running_value
+    FROM stock_ledger
+    WHERE item_id = :item_id AND ledger_date >= :date_from AND ledger_date <= :date_to
+    ORDER BY ledger_date""", {
+        "item_id": item_id,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat()
+    }).fetchall()
+    changes = {row[0]: (row[1], row[2]) for row in data}
+
+    series = []
+    day = date_from
+    while day <= date_to:
+        quantity, value = changes.get(day.isoformat(), (quantity, value))
+        series.append({
+            "date": day.isoformat(),
+            "quantity": quantity,
+            "value": value,
+            "average_purchase_price": average_cost(quantity, value)
+        })
+        day += timedelta(days=1)
+
+    return series
+
+
+def rebuild_stock_ledger(conn):
+    """Recompute the whole stock ledger from the bill records and invoice records"""
+
+    with conn:
+        conn.execute("DELETE FROM stock_ledger")
+        conn.execute(REBUILD_STOCK_LEDGER)
+
+
+def check_stock_ledger(conn):
+    """Compare the stock ledger with the bill records and invoice records.
+    Return a list of (item_id, ledger_date, ledger quantity, expected quantity, ledger value, expected value)
+    for every date on which they differ. An empty list means that the ledger is consistent"""
+
+    expected = {}
+    rows = conn.execute(f"""SELECT item_id, ledger_date,
+    SUM(SUM(quantity)) OVER item_dates,
+    SUM(SUM(value)) OVER item_dates
+    FROM ({STOCK_MOVEMENTS})
+    GROUP BY item_id, ledger_date
+    WINDOW item_dates AS (PARTITION BY item_id ORDER BY ledger_date)""")
+    for item_id, ledger_date, quantity, value in rows:
+        expected[(item_id, ledger_date)] = (quantity, value)
+
+    ledger = {}
+    for item_id, ledger_date, quantity, value in conn.execute("SELECT item_id, ledger_date, running_quantity, running_value FROM stock_ledger"):
+        ledger[(item_id, ledger_date)] = (quantity, value)
+
+    differences = []
+    for key in sorted(set(expected) | set(ledger)):
+        ledger_quantity, ledger_value = ledger.get(key, (None, None))
+        expected_quantity, expected_value = expected.get(key, (None, None))
+
+        if ledger_quantity is None or expected_quantity is None \
+                or abs(ledger_quantity - expected_quantity) > TOLERANCE or abs(ledger_value - expected_value) > TOLERANCE:
+            differences.append((key[0], key[1], ledger_quantity, expected_quantity, ledger_value, expected_value))
+
+    return differences
+
+
+if __name__ == "__main__":
+    # Usage: python stock_ledger.py rebuild|check [database]
+    if len(sys.argv) < 2 or sys.argv[1] not in ("rebuild", "check"):
+        print("Usage: python stock_ledger.py rebuild|check [database]")
+        sys.exit(2)
+
+    command = sys.argv[1]
+    database = sys.argv[2] if len(sys.argv) > 2 else "database.sqlite3"
+    conn = sqlite3.connect(database)
+
+    if command == "rebuild":
+        rebuild_stock_ledger(conn)
+        count = conn.execute("SELECT COUNT(*) FROM stock_ledger").fetchone()[0]
+        print(f"Stock ledger rebuilt ({count} rows)")
+    else:
+        differences = check_stock_ledger(conn)
+        for item_id, ledger_date, ledger_quantity, expected_quantity, ledger_value, expected_value in differences:
+            print(f"Item {item_id} on {ledger_date}: quantity {ledger_quantity} (expected {expected_quantity}), value {ledger_value} (expected {expected_value})")
+
+        if differences:
+            sys.exit(1)
+        print("Stock ledger is consistent")
+
+    conn.close()
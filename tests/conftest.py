@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the application are in the root folder of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """The application, with a new database. The application reads its settings when it is imported,
+    so it is imported only here (once for all tests, which therefore use their own rows)"""
+
+    os.environ["DATABASE"] = str(tmp_path_factory.mktemp("database") / "test.sqlite3")
+    from app import app
+
+    yield app
+
+    from database import get_pool, get_writer
+    get_writer(app).close()
+    get_pool(app).close_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+
+def asgi_request(application, method, path, headers, chunks):
+    """Send one request through an ASGI application (the body in several messages) and return (status, body)"""
+
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    }
+    asyncio.run(application(scope, receive, send))
+
+    status = sent[0]["status"]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return status, body
+
+
+def test_chunked_json_body(app):
+    """A body sent with "Transfer-Encoding: chunked" (no Content-Length header) reaches the view"""
+
+    from asgi import AsgiAdapter
+
+    application = AsgiAdapter(app, max_workers=2)
+    payload = json.dumps({"unit_acronym": "asg", "unit_name": "ASGI chunked unit"}).encode()
+
+    status, body = asgi_request(application, "POST", "/units_of_measure",
+        [("content-type", "application/json"), ("transfer-encoding", "chunked")],
+        [payload[:10], payload[10:25], payload[25:]])
+
+    assert status == 200
+    assert json.loads(body)["success"] is True
@@ -0,0 +1,55 @@
+import time
+
+import idempotency
+from database import Writer, get_writer
+from idempotency import REPLAYED_HEADER, IdempotencyStore, get_idempotency_store
+from migrations import migrate
+
+
+def test_claim_is_extended_while_the_request_runs(tmp_path):
+    database = str(tmp_path / "idempotency.sqlite3")
+    migrate(database)
+    writer = Writer(database)
+    store = IdempotencyStore(pending_ttl=0.3)
+
+    try:
+        assert writer.run(store.claim, "long-request", "first") is None
+        store.track("long-request", writer)
+
+        # The request runs much longer than pending_ttl, so a retry must still find the key claimed
+        time.sleep(1)
+        row = writer.run(store.claim, "long-request", "retry")
+        assert row is not None and row[1] is None
+
+        # When the request has ended without storing a response, the claim expires again
+        store.untrack("long-request")
+        time.sleep(1)
+        assert writer.run(store.claim, "long-request", "retry") is None
+    finally:
+        writer.close()
+
+
+def test_response_is_stored_with_the_changes(app, client, monkeypatch):
+    store = get_idempotency_store(app)
+    writer = get_writer(app)
+
+    class StoppingWriter:
+        """Fails to store a response after the request, as if the process had stopped right after the commit"""
+
+        def run(self, work, *args):
+            if work == store.store:
+                raise RuntimeError("The process has stopped")
+            return writer.run(work, *args)
+
+    headers = {"Idempotency-Key": "unit-of-measure-stopped"}
+    data = {"unit_acronym": "IDK", "unit_name": "Idempotent kilogram"}
+
+    monkeypatch.setattr(idempotency, "get_writer", lambda: StoppingWriter())
+    first = client.post("/units_of_measure", data=data, headers=headers)
+    monkeypatch.undo()
+    assert first.get_json()["success"] is True
+
+    # The retry gets the response of the first request, instead of running it again
+    retry = client.post("/units_of_measure", data=data, headers=headers)
+    assert retry.headers.get(REPLAYED_HEADER) == "true"
+    assert retry.get_json() == first.get_json()
@@ -0,0 +1,53 @@
+import json
+import sqlite3
+
+from idempotency import REPLAYED_HEADER
+
+
+def test_import_validates_rows_like_a_post_request(client):
+    """The rows of an import are checked with the same schema as "POST /partners" """
+
+    rows = [
+        {"partner_name": "Import partner 1", "partner_address": "Street 1"},
+        {"partner_name": "Import partner 2"},
+        {"partner_name": 42, "partner_address": "Street 3"},
+        {"partner_name": "Import partner 4", "partner_address": "Street 4", "partner_manager_first_name": ["Ana"]},
+        {"partner_name": "Import partner 1", "partner_address": "Street 5"}
+    ]
+    body = "".join(json.dumps(row) + "\n" for row in rows)
+
+    response = client.post("/partners/import?format=ndjson", data=body)
+
+    assert response.get_json() == {
+        "success": True,
+        "message": "1 partners imported, 4 rejected",
+        "imported": 1,
+        "rejected": 4,
+        "rejections": [
+            {"line": 2, "message": "'partner_address' is a required field"},
+            {"line": 3, "message": "'partner_name' must be text"},
+            {"line": 4, "message": "'partner_manager_first_name' must be text"},
+            {"line": 5, "message": "Import partner 1 already exists in database"}
+        ]
+    }
+
+
+def test_import_with_an_idempotency_key(app, client):
+    """The body of an import is read for the fingerprint of the key first, and the rows must still be imported (and replayed)"""
+
+    body = "".join(json.dumps({"partner_name": f"Idempotent import partner {i}", "partner_address": "Street 1"}) + "\n" for i in range(3))
+    headers = {"Idempotency-Key": "partners-import"}
+
+    first = client.post("/partners/import?format=ndjson", data=body, headers=headers)
+    assert first.get_json()["imported"] == 3
+
+    conn = sqlite3.connect(app.config["DATABASE"])
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM partners WHERE partner_name LIKE 'Idempotent import partner %'").fetchone()[0]
+    finally:
+        conn.close()
+    assert count == 3
+
+    retry = client.post("/partners/import?format=ndjson", data=body, headers=headers)
+    assert retry.headers.get(REPLAYED_HEADER) == "true"
+    assert retry.get_json() == first.get_json()
@@ -0,0 +1,83 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, MigrationError, check_query_plans, migrate
+
+
+def test_hot_queries_use_an_index(tmp_path):
+    """None of the hot queries does a full table scan on a freshly migrated database"""
+
+    database = str(tmp_path / "test.sqlite3")
+    migrate(database)
+
+    conn = sqlite3.connect(database)
+    try:
+        assert check_query_plans(conn) == {}
+    finally:
+        conn.close()
+
+
+def migrate_after(database, barrier, results):
+    """Wait until all processes are ready, then migrate the database (target of the processes of the test below)"""
+
+    barrier.wait()
+    try:
+        results.put(migrate(database))
+    except Exception as e:
+        results.put(repr(e))
+
+
+def test_concurrent_migrations_apply_every_migration_once(tmp_path):
+    """Processes that start at the same time (like the workers of a server) all migrate the same new database"""
+
+    database = str(tmp_path / "test.sqlite3")
+    processes = 6
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+
+    workers = [multiprocessing.Process(target=migrate_after, args=(database, barrier, results)) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    versions = [results.get(timeout=120) for worker in workers]
+    for worker in workers:
+        worker.join()
+
+    latest = MIGRATIONS[-1][0]
+    assert versions == [latest] * processes
+
+    conn = sqlite3.connect(database)
+    try:
+        applied = [row[0] for row in conn.execute("SELECT version FROM schema_migrations ORDER BY version")]
+    finally:
+        conn.close()
+    assert applied == [migration[0] for migration in MIGRATIONS]
+
+
+def test_migrate_up_to_a_target(tmp_path):
+    """A target version stops the migrations, and migrating again applies the rest"""
+
+    database = str(tmp_path / "test.sqlite3")
+    assert migrate(database, target=3) == 3
+    assert migrate(database) == MIGRATIONS[-1][0]
+
+
+def test_duplicates_are_reported_before_the_unique_indexes(tmp_path):
+    """A database with duplicate partners (allowed before schema version 6) is not migrated until they are renamed"""
+
+    database = str(tmp_path / "test.sqlite3")
+    migrate(database, target=5)
+
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO partners (partner_id, partner_name) VALUES (?, ?)", [(1, "ACME"), (2, "Other"), (3, "ACME")])
+    conn.commit()
+
+    with pytest.raises(MigrationError, match=r"partners 1, 3 \(partner_name='ACME'\)"):
+        migrate(database)
+    assert conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0] == 5
+
+    conn.execute("UPDATE partners SET partner_name = 'ACME 2' WHERE partner_id = 3")
+    conn.commit()
+    conn.close()
+    assert migrate(database) == MIGRATIONS[-1][0]
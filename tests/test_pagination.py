@@ -0,0 +1,31 @@
+import pytest
+
+from helpers import encode_cursor
+
+
+@pytest.mark.parametrize("values", [[{"partner_id": 1}], [[1]], [2 ** 70], [1, 2], "1"])
+def test_invalid_cursor_values(client, values):
+    response = client.get(f"/partners?limit=10&after={encode_cursor(values)}")
+
+    assert response.status_code == 200
+    assert response.get_json() == {"success": False, "message": "'after' is not a valid cursor"}
+
+
+def test_chained_pages_return_every_row_once(client):
+    for i in range(5):
+        client.post("/partners", data={"partner_name": f"Paginated partner {i}", "partner_address": "Street 1"})
+    expected = [partner["id"] for partner in client.get("/partners").get_json()["partners"]]
+    assert len(expected) >= 5
+
+    # Every page starts right after the last row of the previous page
+    pages = []
+    response = client.get("/partners?limit=2").get_json()
+    while True:
+        pages.append([partner["id"] for partner in response["partners"]])
+        if response["next_cursor"] is None:
+            break
+        assert response["next_cursor"] == encode_cursor([pages[-1][-1]])
+        response = client.get(f"/partners?limit=2&after={response['next_cursor']}").get_json()
+
+    assert all(len(page) == 2 for page in pages[:-1])
+    assert [row for page in pages for row in page] == expected
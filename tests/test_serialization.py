@@ -0,0 +1,23 @@
+import json
+import sqlite3
+
+from flask import jsonify
+
+from serialization import list_response
+
+
+def test_list_response_is_the_document_of_jsonify(app):
+    conn = sqlite3.connect(":memory:")
+    cursor = conn.execute("SELECT 1 AS id, 'Žito d.o.o.' AS name, NULL AS address, 2.5 AS amount, 'x' AS a_first")
+    rows = cursor.fetchall()
+
+    with app.app_context():
+        body = list_response({"success": True, "next_cursor": None}, "partners", cursor, rows).get_data()
+        expected = jsonify({"success": True, "next_cursor": None, "partners": [
+            {"id": 1, "name": "Žito d.o.o.", "address": None, "amount": 2.5, "a_first": "x"}
+        ]}).get_data()
+    conn.close()
+
+    assert json.loads(body) == json.loads(expected)
+    # The keys are in the same (sorted) order
+    assert list(json.loads(body)["partners"][0]) == ["a_first", "address", "amount", "id", "name"]
@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+
+
+def select_id(app, query, params):
+    """Return the first column of the first row of a query on the database of the application"""
+
+    conn = sqlite3.connect(app.config["DATABASE"])
+    try:
+        return conn.execute(query, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def new_item(app, client, item_code):
+    """Add an item without any bills or invoices and return its id"""
+
+    client.post("/vat_rates", data={"vat_rate": "18"})
+    client.post("/units_of_measure", data={"unit_acronym": "PCS", "unit_name": "Pieces"})
+    client.post("/items", data={"item_code": item_code, "item_description": f"Item {item_code} of the stock tests", "unit_id": 1, "vat_rate_id": 1})
+    return select_id(app, "SELECT item_id FROM items WHERE item_code = :item_code", {"item_code": item_code})
+
+
+@pytest.fixture
+def item_id(app, client):
+    return new_item(app, client, "STOCK-RANGE")
+
+
+@pytest.mark.parametrize("date_from, date_to", [("0001-01-01", "0001-01-02"), ("9999-12-30", "9999-12-31"), ("2022-01-01", "9999-12-31")])
+def test_stock_range_outside_the_supported_years(client, item_id, date_from, date_to):
+    response = client.get(f"/item/{item_id}/stock?from={date_from}&to={date_to}")
+
+    assert response.status_code == 200
+    assert response.get_json() == {"success": False, "message": "'from' and 'to' must be between the years 1950 and 2500"}
+
+
+def test_batches_book_the_same_stock_as_single_records(app, client):
+    """The same purchases and sales are booked for two items: one record at a time for the first item,
+    and through the batch endpoints for the second one. Both items must end up with the same stock and valuation"""
+
+    single = new_item(app, client, "STOCK-SINGLE")
+    batch = new_item(app, client, "STOCK-BATCH")
+
+    client.post("/partners", data={"partner_name": "Partner of the stock tests", "partner_address": "Street 1"})
+    partner_id = select_id(app, "SELECT partner_id FROM partners WHERE partner_name = 'Partner of the stock tests'", {})
+
+    def new_bill(bill_number, bill_date):
+        response = client.post("/bills", data={"bill_number": bill_number, "bill_date": bill_date, "bill_due_date": bill_date,
+            "bill_amount": 100, "partner_id": partner_id})
+        assert response.get_json()["success"] is True
+        return select_id(app, "SELECT bill_id FROM bills WHERE bill_number = :bill_number", {"bill_number": bill_number})
+
+    def new_invoice(invoice_date):
+        response = client.post("/invoices", data={"invoice_date": invoice_date, "invoice_due_date": invoice_date, "partner_id": partner_id})
+        assert response.get_json()["success"] is True
+        return select_id(app, "SELECT MAX(invoice_id) FROM invoices", {})
+
+    # Purchases on 01.03., sales on 15.03. and another purchase on 20.03.
+    purchases = [(10, 2.0), (5, 3.5), (8, 1.25)]
+    sales = [(6, 5.0, 0), (4, 7.08, 1)]
+    late_purchases = [(3, 4.0)]
+
+    first_bill = new_bill("STOCK-1", "01.03.2022")
+    invoice_id = new_invoice("15.03.2022")
+    late_bill = new_bill("STOCK-2", "20.03.2022")
+
+    for bill_id, lines in ((first_bill, purchases), (late_bill, late_purchases)):
+        for quantity, price in lines:
+            response = client.post("/bill_records", data={"item_id": single, "quantity": quantity, "price": price, "bill_id": bill_id})
+            assert response.get_json()["success"] is True
+
+        response = client.post("/bill_records/batch", json={"bill_records": [
+            {"item_id": batch, "quantity": quantity, "price": price, "bill_id": bill_id} for quantity, price in lines
+        ]})
+        assert response.get_json()["success"] is True
+
+    for quantity, selling_price, vat_included in sales:
+        response = client.post("/invoice_records", data={"item_id": single, "quantity": quantity, "selling_price": selling_price,
+            "vat_included": vat_included, "invoice_id": invoice_id})
+        assert response.get_json()["success"] is True
+
+    response = client.post("/invoice_records/batch", json={"invoice_id": invoice_id, "invoice_records": [
+        {"item_id": batch, "quantity": quantity, "selling_price": selling_price, "vat_included": vat_included}
+        for quantity, selling_price, vat_included in sales
+    ]})
+    assert response.get_json()["success"] is True
+
+    def without_item_id(values):
+        return {key: value for key, value in values.items() if key not in ("item_id", "item_code", "item_description")}
+
+    # The stock at the end of every day of a range, and at the end of a date
+    single_series = client.get(f"/item/{single}/stock?from=2022-02-28&to=2022-03-21").get_json()["stock"]
+    batch_series = client.get(f"/item/{batch}/stock?from=2022-02-28&to=2022-03-21").get_json()["stock"]
+    assert batch_series == [pytest.approx(day) for day in single_series]
+
+    for as_of in ("2022-03-15", "2022-03-31"):
+        single_stock = without_item_id(client.get(f"/item/{single}/stock?as_of={as_of}").get_json())
+        batch_stock = without_item_id(client.get(f"/item/{batch}/stock?as_of={as_of}").get_json())
+        assert batch_stock == pytest.approx(single_stock)
+    assert single_stock["quantity"] == 16
+
+    single_item = without_item_id(client.get(f"/item/{single}").get_json()["item"])
+    batch_item = without_item_id(client.get(f"/item/{batch}").get_json()["item"])
+    assert batch_item == pytest.approx(single_item)
+
+    # The valuation report, before and after the sales
+    for as_of in ("2022-03-14", "2022-03-31"):
+        items = {item["item_id"]: item for item in client.get(f"/reports/valuation?as_of={as_of}").get_json()["items"]}
+        assert without_item_id(items[batch]) == pytest.approx(without_item_id(items[single]))
@@ -0,0 +1,20 @@
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/bill_records", "/invoice_records"])
+def test_streamed_lists_answer_like_the_regular_list(client, path):
+    """Both streaming formats return the same rows, or the same message for an empty table, as the regular response"""
+
+    regular = client.get(path).get_json()
+
+    streamed = client.get(path + "?stream=json")
+    assert json.loads(streamed.get_data()) == regular
+
+    lines = client.get(path + "?stream=1").get_data().decode().splitlines()
+    if regular["success"]:
+        list_name = path.strip("/")
+        assert [json.loads(line) for line in lines] == regular[list_name]
+    else:
+        assert [json.loads(line) for line in lines] == [regular]
@@ -0,0 +1,64 @@
+import pytest
+
+from validation import BILL_RECORD_SCHEMA, BILL_SCHEMA
+
+
+def bill(bill_date, bill_due_date=None):
+    return {"bill_number": "B-1", "bill_date": bill_date, "bill_due_date": bill_due_date or bill_date, "bill_amount": "100", "partner_id": "1"}
+
+
+@pytest.mark.parametrize("bill_date, expected", [("29.02.2024", "2024-02-29"), ("29.02.2000", "2000-02-29"), ("31.12.2500", "2500-12-31"), ("01.01.1950", "1950-01-01")])
+def test_valid_dates(bill_date, expected):
+    values, errors = BILL_SCHEMA.validate(bill(bill_date))
+
+    assert errors == {}
+    assert values["bill_date"] == expected
+
+
+@pytest.mark.parametrize("bill_date, message", [
+    ("29.02.2023", "Invalid bill date"),
+    ("29.02.2100", "Invalid bill date"),
+    ("31.04.2022", "Invalid bill date"),
+    ("31.12.1949", "Year must be between 1950 and 2500"),
+    ("01.01.2501", "Year must be between 1950 and 2500"),
+    ("1.1.2022", "The format of bill date must be: dd.mm.yyyy")
+])
+def test_invalid_dates(bill_date, message):
+    values, errors = BILL_SCHEMA.validate(bill(bill_date, "01.01.2022"))
+
+    assert errors == {"bill_date": message}
+
+
+@pytest.mark.parametrize("item_id, message", [
+    ("99999999999999999999", "'item_id' must be at most 9223372036854775807"),
+    (2 ** 63, "'item_id' must be at most 9223372036854775807"),
+    (1e30, "'item_id' must be at most 9223372036854775807"),
+    ("0", "'item_id' must be at least 1")
+])
+def test_integers_out_of_range(item_id, message):
+    values, errors = BILL_RECORD_SCHEMA.validate({"item_id": item_id, "quantity": "1", "price": "1", "bill_id": "1"})
+
+    assert errors == {"item_id": message}
+
+
+def test_oversized_id_is_a_validation_error(client):
+    response = client.post("/bill_records", data={"item_id": "99999999999999999999", "quantity": "1", "price": "1", "bill_id": "1"})
+
+    assert response.status_code == 200
+    assert response.get_json()["message"] == "'item_id' must be at most 9223372036854775807"
+
+
+@pytest.mark.parametrize("body, message", [
+    ({"invoice_id": 1.9}, "'invoice_id' must be integer"),
+    ({"invoice_id": True}, "'invoice_id' must be integer"),
+    ({"invoice_id": 0}, "'invoice_id' must be at least 1"),
+    ({"invoice_id": -3}, "'invoice_id' must be at least 1"),
+    ({"invoice_id": 2 ** 70}, "'invoice_id' must be at most 9223372036854775807"),
+    ({}, "'invoice_id' is a required field")
+])
+def test_invoice_of_a_batch_is_validated(client, body, message):
+    lines = [{"item_id": 1, "quantity": 1, "selling_price": 1, "vat_included": 0}]
+    response = client.post("/invoice_records/batch", json=dict(body, invoice_records=lines))
+
+    assert response.status_code == 200
+    assert response.get_json()["message"] == message
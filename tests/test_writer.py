@@ -0,0 +1,163 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from database import Writer, WriterTimeout
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A database with one table, numbers (n integer UNIQUE)"""
+
+    path = str(tmp_path / "writer.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE numbers (n integer UNIQUE)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def insert(db, n):
+    db.execute("INSERT INTO numbers (n) VALUES (:n)", {"n": n})
+    return {"success": True}
+
+
+def numbers(database):
+    conn = sqlite3.connect(database)
+    try:
+        return [row[0] for row in conn.execute("SELECT n FROM numbers ORDER BY n")]
+    finally:
+        conn.close()
+
+
+class FailingConnection(sqlite3.Connection):
+    """Connection whose COMMIT and ROLLBACK fail while fail is set (like a disk that has gone away)"""
+
+    fail = False
+
+    def execute(self, sql, *args):
+        if FailingConnection.fail and sql in ("COMMIT", "ROLLBACK"):
+            raise sqlite3.OperationalError("disk I/O error")
+        return super().execute(sql, *args)
+
+
+def test_writer_recovers_when_the_connection_can_not_be_opened(database, tmp_path):
+    writer = Writer(str(tmp_path / "missing" / "writer.sqlite3"))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            writer.run(insert, 1)
+
+        # The writer thread is still running, and the next group opens a new connection
+        writer.database = database
+        assert writer.run(insert, 2) == {"success": True}
+        assert numbers(database) == [2]
+        assert writer.stats()["failed_commits"] == 1
+    finally:
+        writer.close()
+
+
+def test_writer_recovers_when_the_rollback_fails(database):
+    writer = Writer(database, factory=FailingConnection)
+    try:
+        FailingConnection.fail = True
+        with pytest.raises(sqlite3.OperationalError):
+            writer.run(insert, 1)
+        FailingConnection.fail = False
+
+        assert writer.run(insert, 2) == {"success": True}
+        assert numbers(database) == [2]
+        assert writer.stats()["failed_commits"] == 1
+    finally:
+        FailingConnection.fail = False
+        writer.close()
+
+
+def test_unit_that_was_not_started_in_time_is_cancelled(database):
+    writer = Writer(database, max_batch=1, wait_timeout=0.2)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_insert(db, n):
+        started.set()
+        release.wait(5)
+        return insert(db, n)
+
+    try:
+        slow = threading.Thread(target=writer.run, args=(slow_insert, 1))
+        slow.start()
+        started.wait(5)
+
+        # The writer is busy with the slow unit, so this one is not started in time and never runs
+        with pytest.raises(WriterTimeout):
+            writer.run(insert, 2)
+
+        release.set()
+        slow.join()
+        assert writer.run(insert, 3) == {"success": True}
+        assert numbers(database) == [1, 3]
+    finally:
+        release.set()
+        writer.close()
+
+
+def test_failed_unit_rolls_back_only_its_own_savepoint(database):
+    writer = Writer(database)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_insert(db, n):
+        started.set()
+        release.wait(5)
+        return insert(db, n)
+
+    def insert_and_raise(db, n):
+        insert(db, n)
+        raise ValueError("The unit has failed")
+
+    def insert_and_fail(db, n):
+        insert(db, n)
+        return {"success": False, "message": "The unit has failed"}
+
+    # The units are queued while the writer is busy, so they all run in the next group, in this order
+    units = [(insert, 1), (insert_and_raise, 2), (insert_and_fail, 3), (insert, 1), (insert, 4)]
+    results = {}
+
+    def submit(i, work, n):
+        try:
+            results[i] = writer.run(work, n)
+        except Exception as e:
+            results[i] = type(e)
+
+    try:
+        busy = threading.Thread(target=writer.run, args=(blocking_insert, 0))
+        busy.start()
+        started.wait(5)
+
+        threads = []
+        for i, (work, n) in enumerate(units):
+            threads.append(threading.Thread(target=submit, args=(i, work, n)))
+            threads[-1].start()
+            while writer.stats()["queued"] < i + 1:
+                time.sleep(0.01)
+
+        release.set()
+        busy.join()
+        for thread in threads:
+            thread.join()
+
+        assert results == {
+            0: {"success": True},
+            1: ValueError,
+            2: {"success": False, "message": "The unit has failed"},
+            3: sqlite3.IntegrityError,
+            4: {"success": True}
+        }
+        # Only the failed units are rolled back, and the others are committed together
+        assert numbers(database) == [0, 1, 4]
+        assert writer.stats()["commits"] == 2
+        assert writer.stats()["failed_commits"] == 0
+    finally:
+        release.set()
+        writer.close()
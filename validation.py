@@ -0,0 +1,322 @@
+import re
+from datetime import date
+from functools import lru_cache
+
+from flask import request
+from werkzeug.datastructures import MultiDict
+
+# Dates are sent in the format dd.mm.yyyy and stored in the format yyyy-mm-dd
+DATE_FORMAT = re.compile(r"(\d\d)\.(\d\d)\.(\d\d\d\d)")
+MIN_YEAR = 1950
+MAX_YEAR = 2500
+
+# SQLite stores integers in 64 bits
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def request_data():
+    """Return the fields of the request: the JSON body (if the request is sent as application/json), otherwise the form-data"""
+
+    if request.is_json:
+        return request.get_json(silent=True)
+    return request.form
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value, label):
+    """Convert a date from dd.mm.yyyy to yyyy-mm-dd. Raises ValueError with the message for the client.
+    The same dates are sent over and over, so the results are cached"""
+
+    match = DATE_FORMAT.fullmatch(value)
+    if match is None:
+        raise ValueError(f"The format of {label} must be: dd.mm.yyyy")
+
+    day, month, year = int(match[1]), int(match[2]), int(match[3])
+    if day < 1 or day > 31:
+        raise ValueError("Day must be between 01 and 31")
+    if month < 1 or month > 12:
+        raise ValueError("Month must be between 01 and 12")
+    if year < MIN_YEAR or year > MAX_YEAR:
+        raise ValueError(f"Year must be between {MIN_YEAR} and {MAX_YEAR}")
+
+    # date() knows the length of every month, including February of leap years
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid {label}") from None
+
+
+class Field:
+    """A field of a schema. Every type of field (the subclasses below) has a compile(name) method that returns
+    the function that converts a sent value (or raises ValueError). A field without a default is required"""
+
+    REQUIRED = object()
+
+    def __init__(self, default=REQUIRED):
+        self.default = default
+
+
+class Text(Field):
+    """A string (empty strings are only accepted by fields with a default). upper makes it upper case,
+    and pattern (a regular expression with its error message) restricts the accepted values"""
+
+    def __init__(self, default=Field.REQUIRED, strip=False, upper=False, pattern=None):
+        super().__init__(default)
+        self.strip = strip
+        self.upper = upper
+        self.pattern = pattern
+
+    def compile(self, name):
+        strip = self.strip
+        upper = self.upper
+        required = self.default is Field.REQUIRED
+        if self.pattern is not None:
+            pattern = re.compile(self.pattern[0])
+            pattern_message = self.pattern[1]
+        else:
+            pattern = None
+
+        def convert(value):
+            if not isinstance(value, str):
+                raise ValueError(f"'{name}' must be text")
+            if strip:
+                value = value.strip()
+            if upper:
+                value = value.upper()
+            if not value:
+                if required:
+                    raise ValueError(f"'{name}' is a required field")
+                return value
+            if pattern is not None and pattern.fullmatch(value) is None:
+                raise ValueError(pattern_message)
+            return value
+
+        return convert
+
+
+class Integer(Field):
+    """An integer (a JSON number or a string of digits) between min_value and max_value
+    (and always within the 64 bits that SQLite can store)"""
+
+    def __init__(self, default=Field.REQUIRED, min_value=None, max_value=None):
+        super().__init__(default)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def compile(self, name):
+        min_value = MIN_INTEGER if self.min_value is None else max(self.min_value, MIN_INTEGER)
+        max_value = MAX_INTEGER if self.max_value is None else min(self.max_value, MAX_INTEGER)
+
+        def convert(value):
+            # Form-data values are strings, JSON values are numbers
+            if type(value) is str:
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise ValueError(f"'{name}' must be integer") from None
+            elif type(value) is not int:
+                if type(value) is not float or not value.is_integer():
+                    raise ValueError(f"'{name}' must be integer")
+                value = int(value)
+
+            if value < min_value:
+                raise ValueError(f"'{name}' must be at least {min_value}")
+            if value > max_value:
+                raise ValueError(f"'{name}' must be at most {max_value}")
+            return value
+
+        return convert
+
+
+class Number(Field):
+    """A finite number (a JSON number or a numeric string). positive only accepts numbers greater than 0"""
+
+    def __init__(self, default=Field.REQUIRED, positive=False):
+        super().__init__(default)
+        self.positive = positive
+
+    def compile(self, name):
+        positive = self.positive
+
+        def convert(value):
+            if value is True or value is False:
+                raise ValueError(f"'{name}' must be a number")
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{name}' must be a number") from None
+
+            # value - value is 0 for every finite number, and NaN for NaN and infinity
+            if value - value != 0:
+                raise ValueError(f"'{name}' must be a number")
+            if positive and value <= 0:
+                raise ValueError(f"'{name}' must be greater than 0")
+            return value
+
+        return convert
+
+
+class Flag(Field):
+    """0 or 1 (or a JSON boolean), converted to False or True"""
+
+    def __init__(self, default=Field.REQUIRED, message=None):
+        super().__init__(default)
+        self.message = message
+
+    def compile(self, name):
+        message = self.message or f"'{name}' must be 0 or 1"
+        values = {0: False, 1: True, "0": False, "1": True}
+
+        def convert(value):
+            if isinstance(value, bool):
+                return value
+            try:
+                return values[value]
+            except (KeyError, TypeError):
+                raise ValueError(message) from None
+
+        return convert
+
+
+class Date(Field):
+    """A date in the format dd.mm.yyyy, converted to yyyy-mm-dd. label names the date in the error messages"""
+
+    def __init__(self, label, default=Field.REQUIRED):
+        super().__init__(default)
+        self.label = label
+
+    def compile(self, name):
+        label = self.label
+
+        def convert(value):
+            if not isinstance(value, str):
+                raise ValueError(f"The format of {label} must be: dd.mm.yyyy")
+            return parse_date(value, label)
+
+        return convert
+
+
+class Schema:
+    """The fields of a request body, and the checks that compare fields (functions of the converted values,
+    each with the field it reports and its error message).
+
+    The fields are compiled once, when the schema is created: every field becomes one converter function.
+    validate(data) returns (values, errors): the converted values, and an error message per invalid field,
+    so all errors are reported at once. data is the form-data or the JSON object of a request (or of a line of a batch)"""
+
+    def __init__(self, fields, checks=()):
+        self.fields = fields
+        self.checks = tuple(checks)
+        self.converters = [(name, field.compile(name), field.default) for name, field in fields.items()]
+
+    def validate(self, data):
+        """Convert the fields of data. Return (values, errors)"""
+
+        if not isinstance(data, dict):
+            return {}, {"body": "The request body must be a JSON object or form-data"}
+
+        # Form-data (a MultiDict) keeps a list of values per field. Reading the lists directly is much faster than MultiDict.get()
+        multi = isinstance(data, MultiDict)
+        values = {}
+        errors = {}
+
+        for name, convert, default in self.converters:
+            value = dict.get(data, name)
+            if multi and value is not None:
+                value = value[0]
+
+            if value is None:
+                if default is Field.REQUIRED:
+                    errors[name] = f"'{name}' is a required field"
+                else:
+                    values[name] = default
+                continue
+
+            try:
+                values[name] = convert(value)
+            except ValueError as e:
+                errors[name] = str(e)
+
+        # The checks compare converted values, so they only run when all fields are valid
+        if not errors:
+            for check, name, message in self.checks:
+                if not check(values):
+                    errors[name] = message
+
+        return values, errors
+
+
+def validation_error(errors):
+    """Return the response of a request with invalid fields: the message of the first error, and all errors by field"""
+
+    return {"success": False, "message": next(iter(errors.values())), "errors": errors}
+
+
+PARTNER_SCHEMA = Schema({
+    "partner_name": Text(),
+    "partner_address": Text(),
+    "partner_manager_first_name": Text(default=""),
+    "partner_manager_last_name": Text(default="")
+})
+
+ITEM_SCHEMA = Schema({
+    "item_code": Text(),
+    "item_description": Text(),
+    "unit_id": Integer(min_value=1),
+    "vat_rate_id": Integer(min_value=1)
+})
+
+VAT_RATE_SCHEMA = Schema({
+    "vat_rate": Integer(min_value=0, max_value=100)
+})
+
+UNIT_OF_MEASURE_SCHEMA = Schema({
+    "unit_acronym": Text(),
+    "unit_name": Text()
+})
+
+BILL_SCHEMA = Schema({
+    "bill_number": Text(),
+    "bill_date": Date("bill date"),
+    "bill_due_date": Date("bill due date"),
+    "bill_amount": Integer(min_value=1),
+    "partner_id": Integer(min_value=1)
+}, checks=[
+    (lambda values: values["bill_due_date"] >= values["bill_date"], "bill_due_date", "Due date can't be before the date")
+])
+
+BILL_RECORD_SCHEMA = Schema({
+    "item_id": Integer(min_value=1),
+    "quantity": Number(positive=True),
+    "price": Number(positive=True),
+    "bill_id": Integer(min_value=1)
+})
+
+INVOICE_SCHEMA = Schema({
+    "invoice_date": Date("invoice date"),
+    "invoice_due_date": Date("invoice due date"),
+    "partner_id": Integer(min_value=1),
+    # Invoices of a series get their own numbers, prefixed with the series
+    "invoice_series": Text(default="", strip=True, upper=True,
+        pattern=(r"[A-Z0-9]{1,10}", "'invoice_series' must contain only letters and digits (up to 10 characters)"))
+}, checks=[
+    (lambda values: values["invoice_due_date"] >= values["invoice_date"], "invoice_due_date", "The due date can't be before the date")
+])
+
+VAT_INCLUDED_MESSAGE = "\"vat_included\" should be 0 if VAT is not included in the selling price, otherwise it should be 1"
+
+# A line of /invoice_records/batch (the invoice is given once for the whole batch)
+INVOICE_RECORD_LINE_SCHEMA = Schema({
+    "item_id": Integer(min_value=1),
+    "quantity": Number(positive=True),
+    "selling_price": Number(positive=True),
+    "vat_included": Flag(default=False, message=VAT_INCLUDED_MESSAGE)
+})
+
+INVOICE_RECORD_SCHEMA = Schema(dict(INVOICE_RECORD_LINE_SCHEMA.fields, invoice_id=Integer(min_value=1)))
+
+# The fields of /invoice_records/batch besides its lines
+INVOICE_RECORD_BATCH_SCHEMA = Schema({
+    "invoice_id": Integer(min_value=1)
+})